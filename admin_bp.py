@@ -1,10 +1,15 @@
-import os, zipfile, csv, uuid, shutil
+import os, zipfile, uuid, shutil, base64, json
 from pathlib import Path
-from flask import Blueprint, render_template, request, flash, redirect, url_for, current_app , abort
+from flask import Blueprint, render_template, request, flash, redirect, url_for, current_app , abort, Response, stream_with_context
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from flask_login import current_user
 from werkzeug.utils import secure_filename
 from config import Config
-import string
+from models import db, InvCode, Job
+from registry import EXEC_MODES, function_registry
+from metrics import registry as metrics_registry
+from installer import check_archive
+from jobs import job_scheduler
 import secrets
 
 bp = Blueprint('admin', __name__, url_prefix='/admin')
@@ -22,7 +27,7 @@ def cards():
         abort(403)
     """
     GET : 展示新增表单
-    POST: 处理表单 + 上传 zip + 落库 function.csv + 解压到 functions/{id}/
+    POST: 处理表单 + 上传 zip，提交后台安装任务（解压到 functions/{id}/ + 冒烟测试 + 追加 function.csv）
     """
     if request.method == 'POST':
         # 1. 取字段
@@ -33,6 +38,9 @@ def cards():
         output_list = [x.strip() for x in request.form.get('output_list', '').split(',') if x.strip()]
         input_desc = [x.strip() for x in request.form.get('input_list_description', '').split(';') if x.strip()]
         output_desc = [x.strip() for x in request.form.get('output_list_description', '').split(';') if x.strip()]
+        workers = request.form.get('workers', '').strip() or '0'
+        cacheable = request.form.get('cacheable', '').strip() or '1'
+        exec_mode = request.form.get('exec_mode', '').strip() or EXEC_MODES[0]
 
         # 2. 简单校验
         if not id_ or not name or not input_list or not output_list:
@@ -41,6 +49,18 @@ def cards():
         if not all(x.isalnum() or x == '_' for x in id_):
             flash('ID 只能包含小写字母、数字、下划线')
             return redirect(request.url)
+        if not workers.isdigit():
+            flash('worker 数量必须是非负整数')
+            return redirect(request.url)
+        if cacheable not in ('0', '1'):
+            flash('结果可缓存只能填 0 或 1')
+            return redirect(request.url)
+        if exec_mode not in EXEC_MODES:
+            flash('执行方式只能是 ' + ' / '.join(EXEC_MODES))
+            return redirect(request.url)
+        if exec_mode == 'inprocess' and int(workers):
+            flash('inprocess 卡片不使用常驻 worker，worker 数量须为 0')
+            return redirect(request.url)
 
         # 3. 处理上传 zip
         zip_file = request.files.get('zip_file')
@@ -51,44 +71,46 @@ def cards():
             flash('仅允许 zip 格式')
             return redirect(request.url)
 
-        # 4. 落盘临时 zip
-        tmp_zip = Path(Config.UPLOAD_TMP_DIR) / f"{uuid.uuid4().hex}.zip"
-        zip_file.save(tmp_zip)
-
-        # 5. 解压并校验结构
         func_dir = Path(Config.FUNCTIONS_DIR) / id_
-        if func_dir.exists():
+        if func_dir.exists() or id_ in function_registry:
             flash('ID 已存在')
             return redirect(request.url)
-        func_dir.mkdir(parents=True)
-
-        with zipfile.ZipFile(tmp_zip, 'r') as zf:
-            # 提前检查
-            namelist = zf.namelist()
-            if not any('env/' in s for s in namelist) or 'program/run.py' not in namelist:
-                flash('zip 内必须包含 env/ 目录与 program/run.py')
-                return redirect(request.url)
-            zf.extractall(func_dir)
-
-        # 6. 追加写入 function.csv
-        csv_file = Path(current_app.root_path) / 'function.csv'
-        new_row = [
-            id_, name,
-            str(input_list).replace("'", '"'),
-            str(output_list).replace("'", '"'),
-            description,
-            str(input_desc).replace("'", '"'),
-            str(output_desc).replace("'", '"')
-        ]
-        with csv_file.open('a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(new_row)
-
-        # 7. 清理临时文件
-        tmp_zip.unlink(missing_ok=True)
-
-        flash('服务卡片新增成功！')
-        return redirect(url_for('admin.cards'))
+
+        # 4. zip 保存到任务目录，只读目录结构做校验（失败时删除任务目录）
+        job_id = uuid.uuid4().hex
+        temp_dir = Path(Config.UPLOAD_TMP_DIR) / job_id
+        temp_dir.mkdir(parents=True)
+        tmp_zip = temp_dir / 'card.zip'
+        zip_file.save(tmp_zip)
+        try:
+            with zipfile.ZipFile(tmp_zip, 'r') as zf:
+                error = check_archive(zf)
+        except zipfile.BadZipFile:
+            error = 'zip 文件已损坏'
+        if error:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            flash(error)
+            return redirect(request.url)
+
+        # 5. 解压、冒烟测试、启用卡片由后台任务完成（见 installer.py）
+        fields = {
+            'id': id_, 'name': name, 'description': description,
+            'input_list': input_list, 'output_list': output_list,
+            'input_desc': input_desc, 'output_desc': output_desc,
+            'workers': workers, 'cacheable': cacheable, 'exec_mode': exec_mode,
+        }
+        job = job_scheduler.submit(Job(
+            id=job_id,
+            kind='install',
+            function_id=id_,
+            user_id=current_user.id,
+            temp_dir=str(temp_dir),
+            input_paths=json.dumps({'zip': str(tmp_zip), 'fields': fields}, ensure_ascii=False),
+            output_paths=json.dumps([]),
+            input_bytes=tmp_zip.stat().st_size,
+        ))
+        flash('已提交安装任务，解压与冒烟测试通过后卡片会出现在菜单中')
+        return redirect(url_for('jobs.page', job_id=job.id))
 
     # GET：渲染表单
     return render_template('admin/card_form.html')
@@ -96,13 +118,33 @@ def cards():
 
 
 #生成邀请码
-def random64() -> str:
-    """生成 64 位 URL-safe 字符串"""
-    alphabet = string.ascii_letters + string.digits
-    return ''.join(secrets.choice(alphabet) for _ in range(64))
+INVCODE_BYTES = 48          # 48 字节随机数 -> 64 位 URL-safe 字符串
+INVCODE_CHUNK = 5000        # 每批生成 / 插入 / 提交的条数
+
+
+def generate_codes(count):
+    """一次取 count * 48 字节随机数，切分后编码为 64 位 URL-safe 字符串"""
+    raw = secrets.token_bytes(INVCODE_BYTES * count)
+    return [base64.urlsafe_b64encode(raw[i:i + INVCODE_BYTES]).decode('ascii')
+            for i in range(0, len(raw), INVCODE_BYTES)]
+
+
+def insert_codes(codes):
+    """executemany 批量插入，已存在的邀请码忽略（INSERT OR IGNORE）"""
+    stmt = sqlite_insert(InvCode).on_conflict_do_nothing()
+    db.session.execute(stmt, [{'invcode': code} for code in codes])
+    db.session.commit()
+
+
+def create_codes(count):
+    """按批生成并写入 count 个邀请码，逐批产出（每批写入后即可发送给客户端）"""
+    for start in range(0, count, INVCODE_CHUNK):
+        codes = generate_codes(min(INVCODE_CHUNK, count - start))
+        insert_codes(codes)
+        yield codes
+
 
 #这里对用进行管理
-from models import db,InvCode
 # InvCode表只有一列为invcode，是64位字符串类型
 @bp.route('/users', methods=['GET', 'POST'])
 def users():
@@ -111,27 +153,40 @@ def users():
         abort(403)
 
     if request.method == 'POST':
+        as_csv = request.form.get('format') == 'csv'
+        limit = Config.INVCODE_CSV_MAX if as_csv else Config.INVCODE_PAGE_MAX
         # 读取追加数量
         try:
             count = int(request.form.get('count', 0))
         except ValueError:
             count = 0
-        if count <= 0 or count > 10000:          # 一次最多 1w 条，可调
-            flash('请输入 1-10000 之间的整数')
+        if count <= 0 or count > limit:
+            flash(f'请输入 1-{limit} 之间的整数')
             return render_template('admin/invcode.html')
 
+        if as_csv:
+            # 边生成边写库边下载，不在内存中保留全部邀请码
+            def rows():
+                yield 'invcode\r\n'
+                for codes in create_codes(count):
+                    yield ''.join(code + '\r\n' for code in codes)
+            return Response(stream_with_context(rows()), mimetype='text/csv',
+                            headers={'Content-Disposition': 'attachment; filename=invcodes.csv'})
+
         # 生成+写入
-        new_codes = []
-        for _ in range(count):
-            code = random64()
-            new_codes.append(InvCode(invcode=code))
-        # 批量插入（忽略已存在）
-        db.session.bulk_save_objects(new_codes, return_defaults=False)
-        db.session.commit()
+        new_codes = [code for codes in create_codes(count) for code in codes]
 
         # 把新增列表传给模板
         return render_template('admin/invcode.html',
-                               created=[c.invcode + '\n' for c in new_codes])
+                               created=[code + '\n' for code in new_codes])
 
     # GET：展示表单
-    return render_template('admin/invcode.html')
\ No newline at end of file
+    return render_template('admin/invcode.html')
+
+
+#运行指标（Prometheus 文本格式）
+@bp.route('/metrics')
+def metrics():
+    if not current_user.is_authenticated or current_user.role != 'admin':
+        abort(403)
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
@@ -1,52 +1,71 @@
-from pathlib import Path
+"""
+Web 应用入口：create_app() 创建应用，模块级的 app 供 gunicorn app:app 与 flask 命令使用。
+
+创建应用时只做进程内的初始化（注册表、蓝图、路由），不启动后台线程：
+- 建表与补列由 flask --app app init-db 在部署时执行一次；DB_AUTO_INIT 为真（默认）时创建应用时顺带执行，
+  gunicorn --preload 下只在 master 中执行一次（见 gunicorn.conf.py）；
+- 任务调度与 tmp_uploads 清扫线程在每个服务进程中启动一次：gunicorn 由 post_worker_init 钩子启动，
+  开发服务器与 test client 在收到第一个请求时启动；fork 之前的 master 中不运行任何线程。
+"""
 import os
-import csv
-import ast
-import subprocess
 import uuid
-from flask import send_file , Flask, request, redirect, url_for, render_template, flash
+import json
+import itertools
+import click
+from flask import Flask, current_app, request, redirect, url_for, render_template, flash, jsonify
+from flask.cli import with_appcontext
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
+from werkzeug.exceptions import BadRequest, HTTPException
 from werkzeug.utils import secure_filename
-import platform
-import secrets
 from config import Config
-from models import db,User
-
-app = Flask(__name__)
-app.config.from_object(Config)
-db.init_app(app)
-
-
-# 关于注册
+from models import db,User,Job,init_db
+from registry import function_registry
+from limits import card_options, check_options
+from jobs import job_scheduler
+from transfer import stream_upload
+from result_cache import result_cache
+from batch import expand_zip, build_items
+from pipelines import pipeline_registry, resolve_cards, describe
+from metrics import TEMPDIR_SECONDS, UPLOAD_SECONDS, registry as metrics_registry
+from sweeper import tmp_sweeper, discard, user_quota
+from usercache import user_cache
+from pages import page_cache
+from uploads import upload_store
 from auth_bp import bp as auth_bp
-app.register_blueprint(auth_bp)
+from admin_bp import bp as admin_bp
+from manual_bp import bp as manual_bp
+from uploads_bp import bp as uploads_bp
+from jobs_bp import bp as jobs_bp, job_status
+
 
-login_manager = LoginManager(app)
+login_manager = LoginManager()
 login_manager.login_view = 'login'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.get(int(user_id))
 
-with app.app_context():
-    if not os.path.exists('instance'):
-        os.makedirs('instance')
-    db.create_all()
+# 脚本客户端：Authorization: Bearer <token>，无需表单登录与 cookie
+@login_manager.request_loader
+def load_user_from_request(request):
+    return user_cache.load_from_request(request)
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """建表并为已有的表补齐新增列（部署 / 升级后执行一次）"""
+    init_db()
+    click.echo('数据库已初始化')
 
-# 和adminpage有关
-from admin_bp import bp as admin_bp
-app.register_blueprint(admin_bp)
 
-@app.route('/contact')
 def contact () :
-    return render_template('contact.html')
+    return page_cache.template('contact', 'contact.html')
 
-@app.route('/user_guide')
 def user_guide () :
-    return render_template('user_guide.html')
+    return page_cache.template('user_guide', 'user_guide.html')
 
 
-@app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username'].strip()
@@ -59,7 +78,6 @@ def login():
         flash('用户名或密码错误')
     return render_template('login.html')
 
-@app.route('/logout')
 @login_required
 def logout():
     logout_user()
@@ -67,133 +85,269 @@ def logout():
     return redirect(url_for('index'))
 
 
-root_path = os.path.dirname(os.path.abspath(__file__))
-tmp_upload_dir = os.path.join (os.path.dirname(os.path.abspath(__file__)), 'tmp_uploads')
-Path(tmp_upload_dir).mkdir(exist_ok=True)
-function_list_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'function.csv')
-
-@app.route('/')
 @login_required
 def index():
     #return f'欢迎回来，{current_user.username}！<br><a href="{url_for("logout")}">退出</a>'
     return render_template('index.html',username = current_user.username)
 
-@app.route('/menu')
 def menu():
+    # 卡片列表不随用户变化，按注册表版本缓存渲染结果，浏览器以 ETag 重新验证
+    return page_cache.respond('menu', function_registry.current_version(),
+                              lambda: render_template('menu.html', functions=function_registry.all()))
+
 
-    functions = [] 
-    try:
-        with open(function_list_path, newline='', encoding='utf-8') as csvfile:
-            
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                
-                # 转换字符串列表为实际列表
-                row['input_list'] = eval(row['input_list'])
-                row['output_list'] = eval(row['output_list'])
-                functions.append(row)
-    except FileNotFoundError:
-        app.logger.error("function.csv file not found")
-    return render_template('menu.html', functions=functions)
 
 
+def submitted_options(function_id, fields):
+    """表单字段 option_<名称> 提交的卡片参数（见 limits.card_options），取值不合法时返回 400"""
+    try:
+        return check_options(function_id, {name[len('option_'):]: value for name, value in fields.items()
+                                           if name.startswith('option_')})
+    except ValueError as e:
+        raise BadRequest(str(e))
 
 
-@app.route('/function/<function_id>', methods=['GET', 'POST'])
 def function_detail(function_id):
-    FUNCTION_MAP = {}
-    with open(function_list_path, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            FUNCTION_MAP[row['ID']] = {
-            'name': row['name'],
-            'input_list': eval(row['input_list']),
-            'output_list': eval(row['output_list']),
-            'description': row['description'],
-            'input_descs': eval(row['input_list_description']),
-            'output_descs': eval(row['output_list_description'])
-            }
-    if function_id not in FUNCTION_MAP:
+    func_info = function_registry.get(function_id)
+    if func_info is None:
         return "Function not found", 404
     
-    func_info = FUNCTION_MAP[function_id]
-    
     if request.method == 'GET':
         return render_template('function_page.html', 
                                func_id=function_id,
-                               func_info=func_info)
+                               func_info=func_info,
+                               options=card_options(function_id))
     
     elif request.method == 'POST':
-        try:
-            # 为每个请求创建唯一的临时子目录
-            request_id = uuid.uuid4().hex
-            temp_dir = os.path.join(tmp_upload_dir , request_id)
+        user_id = current_user.id if current_user.is_authenticated else None
+        # 为每个任务创建唯一的临时子目录
+        with TEMPDIR_SECONDS.time(function_id=function_id):
+            job_id = uuid.uuid4().hex
+            temp_dir = os.path.join(current_app.config['UPLOAD_TMP_DIR'], job_id)
             os.makedirs(temp_dir, exist_ok=True)
-            
-            input_paths = []
-            # 保存上传的文件到临时目录
+        try:
+            # 上传内容按块直接写入临时目录，不超过用户剩余配额
+            with UPLOAD_SECONDS.time(function_id=function_id), user_quota(user_id) as budget:
+                fields, files, digests = stream_upload(temp_dir, lambda field, name: f'{field}_{name}', budget)
+            options = submitted_options(function_id, fields)
+            # 每个输入可直接上传，也可用 input_<i>_upload 引用上传仓库中已完成的上传句柄
+            input_paths, linked = [], set()
             for i, desc in enumerate(func_info['input_descs']):
-                file = request.files.get(f'input_{i}')
-                if not file:
+                if files.get(f'input_{i}'):
+                    input_paths.append(files[f'input_{i}'][0])
+                    continue
+                handle = fields.get(f'input_{i}_upload', '').strip()
+                upload = upload_store.get(handle, user_id) if handle else None
+                if upload is None or upload.sha256 is None:
+                    discard(temp_dir)
                     return f"Missing input: {desc}", 400
-                
-                # 生成安全文件名
-                filename = f'input_{i}_{file.filename}'
-                save_path = os.path.join(temp_dir, filename)
-                file.save(save_path)
-                input_paths.append(save_path)
+                name = f'input_{i}_' + (secure_filename(upload.filename) or 'upload')
+                path, digests[path] = upload_store.link_into(upload, temp_dir, name)
+                input_paths.append(path)
+                linked.add(path)
             
-            # 准备输出文件路径
+            # 准备输出文件路径（进程内执行的卡片由 main() 返回输出路径）
             output_paths = []
-            for i in range(len(func_info['output_list'])):
-                # 生成输出文件路径
-                filename = f'output_{i}.bin'  # 适当扩展名可以后期改进
-                output_path = os.path.join(temp_dir, filename)
-                output_paths.append(output_path)
-            
-            # 构建命令并执行（使用跨平台兼容的os.path.join）
-            python_exec=''
-            if platform.system() == 'Windows':
-                python_exec = os.path.join(root_path, 'functions', function_id, 'env', 'python.exe')
-            else :
-                python_exec = os.path.join(root_path , 'functions' , function_id , 'env' , 'bin' , 'python3')
-            
-            script_path = os.path.join(root_path , 'functions', function_id, 'program', 'run.py')
-            
-            # 创建跨平台命令列表
-
-            cmd_args = [python_exec, script_path, *input_paths, *output_paths]
-
-            # 执行命令
-            print('run command' , cmd_args)
-            result = subprocess.run(cmd_args, capture_output=True, text=True)
-            
-            if result.returncode != 0:
-                # 保留临时目录用于调试
-                return f"Error: {result.stderr}\nDebugging data saved in {temp_dir}", 500
-            
-            # 如果只有一个输出文件，直接返回
-            if len(output_paths) == 1:
-                return send_file(output_paths[0], as_attachment=True)
+            if func_info['exec_mode'] == 'subprocess':
+                for i in range(len(func_info['output_list'])):
+                    # 生成输出文件路径
+                    filename = f'output_{i}.bin'  # 适当扩展名可以后期改进
+                    output_path = os.path.join(temp_dir, filename)
+                    output_paths.append(output_path)
             
-            # 多个输出文件则打包为ZIP
-            zip_filename = os.path.join(temp_dir, 'outputs.zip')
-            with zipfile.ZipFile(zip_filename, 'w') as zipf:
-                for output_path in output_paths:
-                    zipf.write(output_path, os.path.basename(output_path))
+            job = Job(
+                id=job_id,
+                function_id=function_id,
+                user_id=user_id,
+                temp_dir=temp_dir,
+                input_paths=json.dumps(input_paths),
+                output_paths=json.dumps(output_paths),
+                input_bytes=sum(os.path.getsize(p) for p in input_paths if p not in linked),
+                options=json.dumps(options) if options else None,
+            )
             
-            # 清理临时目录（可选）
-            shutil.rmtree(temp_dir)
+            # 相同卡片版本 + 相同输入已经算过：不再执行，记录一个已完成的任务，
+            # 与未命中时一样返回 202 / 303，结果从任务的下载地址取得
+            if func_info['cacheable']:
+                job.cache_key = result_cache.key(function_id, [digests[p] for p in input_paths],
+                                                 [os.path.basename(p) for p in input_paths], options)
+                cached = result_cache.lookup(job.cache_key, len(func_info['output_list']))
+                if cached is not None:
+                    job.output_paths = json.dumps(result_cache.link_into(cached, temp_dir))
+                    response = job_accepted(job_scheduler.record_done(job))
+                    response.headers['X-Result-Cache'] = 'hit'
+                    return response
             
-            return send_file(zip_filename, as_attachment=True, download_name='outputs.zip')
+            # 入队后立即返回任务 ID，由调度器在后台执行
+            return job_accepted(job_scheduler.submit(job))
             
+        except HTTPException:
+            discard(temp_dir)
+            raise
         except Exception as e:
+            discard(temp_dir)
             import traceback
             traceback.print_exc()
             return f"Internal Error: {str(e)}", 500
 
 
-#创建目录
+def function_batch(function_id):
+    """批量模式：每个 input_i 可上传多个文件，或上传 zip（batch_zip）作为 input_0 的条目"""
+    func_info = function_registry.get(function_id)
+    if func_info is None:
+        return "Function not found", 404
+    
+    user_id = current_user.id if current_user.is_authenticated else None
+    with TEMPDIR_SECONDS.time(function_id=function_id):
+        job_id = uuid.uuid4().hex
+        temp_dir = os.path.join(current_app.config['UPLOAD_TMP_DIR'], job_id)
+        os.makedirs(temp_dir, exist_ok=True)
+    
+    try:
+        # 同一字段的多个文件可能同名，落盘时加序号
+        counter = itertools.count()
+        with UPLOAD_SECONDS.time(function_id=function_id), user_quota(user_id) as budget:
+            fields, files, _ = stream_upload(temp_dir, lambda field, name: f'{field}_{next(counter):05d}_{name}',
+                                             budget)
+        options = submitted_options(function_id, fields)
+        for zip_path in files.pop('batch_zip', []):
+            files.setdefault('input_0', []).extend(
+                expand_zip(zip_path, os.path.join(temp_dir, 'batch_zip')))
+            os.remove(zip_path)
+        items = build_items(func_info, files)
+    except Exception:
+        discard(temp_dir)
+        raise
+    
+    job = job_scheduler.submit(Job(
+        id=job_id,
+        kind='batch',
+        function_id=function_id,
+        user_id=user_id,
+        temp_dir=temp_dir,
+        input_paths=json.dumps(items),
+        output_paths=json.dumps([]),
+        input_bytes=sum(os.path.getsize(p) for paths in files.values() for p in paths),
+        options=json.dumps(options) if options else None,
+    ))
+    return job_accepted(job)
+
+
+def pipeline_list():
+    return jsonify([describe(p) for p in pipeline_registry.all()])
+
+
+def pipeline_run(pipeline_id):
+    """多步流水线：上传 input_i，各步骤在服务器上的同一任务目录中执行，只返回最终输出"""
+    pipeline = pipeline_registry.get(pipeline_id)
+    if pipeline is None:
+        return "Pipeline not found", 404
+    if request.method == 'GET':
+        return jsonify(describe(pipeline))
+    try:
+        resolve_cards(pipeline)
+    except ValueError as e:
+        return f"Pipeline misconfigured: {e}", 500
+    
+    user_id = current_user.id if current_user.is_authenticated else None
+    with TEMPDIR_SECONDS.time(function_id=pipeline_id):
+        job_id = uuid.uuid4().hex
+        temp_dir = os.path.join(current_app.config['UPLOAD_TMP_DIR'], job_id)
+        os.makedirs(temp_dir, exist_ok=True)
+    
+    try:
+        with UPLOAD_SECONDS.time(function_id=pipeline_id), user_quota(user_id) as budget:
+            _, files, _ = stream_upload(temp_dir, lambda field, name: f'{field}_{name}', budget)
+        input_paths = []
+        for i, desc in enumerate(pipeline['inputs']):
+            if not files.get(f'input_{i}'):
+                discard(temp_dir)
+                return f"Missing input: {desc}", 400
+            input_paths.append(files[f'input_{i}'][0])
+    except Exception:
+        discard(temp_dir)
+        raise
+    
+    job = job_scheduler.submit(Job(
+        id=job_id,
+        kind='pipeline',
+        function_id=pipeline_id,
+        user_id=user_id,
+        temp_dir=temp_dir,
+        input_paths=json.dumps(input_paths),
+        output_paths=json.dumps([]),
+        input_bytes=sum(os.path.getsize(p) for p in input_paths),
+    ))
+    return job_accepted(job)
+
+
+def job_accepted(job):
+    """API 客户端得到 202 + 任务信息，浏览器跳转到任务状态页"""
+    if request.accept_mimetypes.best_match(['application/json', 'text/html']) == 'application/json':
+        response = jsonify(job_status(job))
+        response.status_code = 202
+        response.headers['Location'] = url_for('jobs.status', job_id=job.id)
+        return response
+    return redirect(url_for('jobs.page', job_id=job.id), code=303)
+
+
+# ---------- 应用工厂 ----------
+# (URL 规则, 视图函数, 方法)；端点名即视图函数名，与原先 @app.route 注册的一致
+ROUTES = [
+    ('/contact', contact, ['GET']),
+    ('/user_guide', user_guide, ['GET']),
+    ('/login', login, ['GET', 'POST']),
+    ('/logout', logout, ['GET']),
+    ('/', index, ['GET']),
+    ('/menu', menu, ['GET']),
+    ('/function/<function_id>', function_detail, ['GET', 'POST']),
+    ('/function/<function_id>/batch', function_batch, ['POST']),
+    ('/pipelines', pipeline_list, ['GET']),
+    ('/pipeline/<pipeline_id>', pipeline_run, ['GET', 'POST']),
+]
+
+
+def start_background(app):
+    """在当前进程中启动任务调度、tmp_uploads 清扫与指标快照线程（重复调用无副作用）"""
+    job_scheduler.start()
+    tmp_sweeper.start()
+    metrics_registry.start()
+
+
+def create_app(config=Config):
+    app = Flask(__name__)
+    app.config.from_object(config)
+    os.makedirs(app.instance_path, exist_ok=True)
+
+    db.init_app(app)
+    function_registry.init_app(app)
+    pipeline_registry.init_app(app)
+    result_cache.init_app(app)
+    user_cache.init_app(app)
+    page_cache.init_app(app)
+    upload_store.init_app(app)
+    login_manager.init_app(app)
+    job_scheduler.init_app(app)
+    tmp_sweeper.init_app(app)
+    metrics_registry.init_app(app)
+
+    for blueprint in (auth_bp, admin_bp, manual_bp, uploads_bp, jobs_bp):
+        app.register_blueprint(blueprint)
+    for rule, view, methods in ROUTES:
+        app.add_url_rule(rule, view_func=view, methods=methods)
+
+    app.cli.add_command(init_db_command)
+    if app.config['DB_AUTO_INIT']:
+        with app.app_context():
+            init_db()
+
+    # 没有由 gunicorn 钩子启动时（开发服务器、test client），收到第一个请求时启动后台线程
+    app.before_request(lambda: start_background(app))
+    return app
+
+
+app = create_app()
+
+
 if __name__ == '__main__':
     app.run(debug=True)
-    
\ No newline at end of file
@@ -1,6 +1,10 @@
 # auth_bp.py
-from flask import Blueprint, request, redirect, url_for, flash, render_template
+from flask import Blueprint, request, redirect, url_for, flash, render_template, jsonify
+from flask_login import current_user
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
 from models import db, User, InvCode
+from usercache import user_cache
 
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
@@ -15,21 +19,56 @@ def auth():
             flash('用户名已存在')
             return redirect(url_for('auth.auth'))
 
-        inv_code_entry = InvCode.query.filter_by(invcode=invcode).first()
-        if not inv_code_entry:
+        # 密码哈希较慢，在开启写事务之前算好
+        user = User(username=username)
+        user.set_password(password)
+
+        # 核销邀请码：DELETE ... RETURNING 一步完成检查与删除，同一邀请码并发注册只有一个成功
+        redeemed = db.session.execute(
+            delete(InvCode).where(InvCode.invcode == invcode).returning(InvCode.invcode)
+        ).first()
+        if redeemed is None:
+            db.session.rollback()
             flash('错误的邀请码')
             return redirect(url_for('auth.auth'))
 
-        # 创建用户
-        user = User(username=username)
-        user.set_password(password)
+        # 创建用户；与核销在同一事务中提交，用户名冲突时邀请码随回滚恢复
         db.session.add(user)
-
-        # 注册成功后删除邀请码
-        db.session.delete(inv_code_entry)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash('用户名已存在')
+            return redirect(url_for('auth.auth'))
 
         flash('注册成功，请登录')
         return redirect(url_for('login')) 
 
-    return render_template('auth.html')
\ No newline at end of file
+    return render_template('auth.html')
+
+
+# ---------- API token ----------
+@bp.route('/token', methods=['POST'])
+def issue_token():
+    """
+    为脚本客户端签发 API token：已登录时直接签发，
+    否则用表单 / JSON 中的 username、password 验证一次。之后请求携带
+    Authorization: Bearer <token> 即可，无需 cookie。
+    """
+    data = request.get_json(silent=True) or request.form
+    user = current_user if current_user.is_authenticated else None
+    if user is None:
+        user = User.query.filter_by(username=(data.get('username') or '').strip()).first()
+        if user is None or not user.check_password(data.get('password') or ''):
+            return jsonify(error='用户名或密码错误'), 401
+    token = user_cache.issue_token(user, data.get('name') or '')
+    return jsonify(token=token), 201
+
+
+@bp.route('/token', methods=['DELETE'])
+def revoke_token():
+    """吊销请求头中携带的 token"""
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not user_cache.revoke_token(token.strip()):
+        return jsonify(error='token 无效'), 404
+    return '', 204
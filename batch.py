@@ -0,0 +1,141 @@
+"""
+批量任务：一次请求对多个文件执行同一张卡片。
+
+条目的组成：
+- 每个 input_i 可以上传多个文件；上传了多个文件的输入按顺序一一对应，
+  只上传一个文件的输入对所有条目共用（如用同一个密钥加密一批文件）；
+- 也可以上传 zip（字段 batch_zip），zip 中的每个文件作为 input_0 的一个条目。
+
+各条目经由执行器（本机或执行节点，见 executors.py）并行执行，并行的条目占用调度器的执行槽位，
+单个条目失败只记录在 manifest.json 中，不影响其他条目。结果总是以 outputs.zip 下载（即使只有 manifest.json）。
+"""
+import json
+import os
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from werkzeug.exceptions import BadRequest
+from werkzeug.utils import secure_filename
+
+from config import Config
+from executors import get_executor
+from jobs import card_for, job_handler, job_options, job_scheduler
+from limits import LimitExceeded
+from transfer import UploadTooLarge
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def expand_zip(zip_path, target_dir):
+    """解压批量 zip（拍平目录结构），返回解压出的文件路径列表"""
+    os.makedirs(target_dir, exist_ok=True)
+    paths = []
+    with zipfile.ZipFile(zip_path) as zf:
+        members = [m for m in zf.infolist() if not m.is_dir()]
+        if sum(m.file_size for m in members) > Config.UPLOAD_MAX_BYTES:
+            raise UploadTooLarge()
+        for n, member in enumerate(members):
+            # 只保留文件名，防止 zip 中的 ../ 路径逃逸
+            name = secure_filename(os.path.basename(member.filename)) or 'item'
+            path = os.path.join(target_dir, f'{n:05d}_{name}')
+            with zf.open(member) as src, open(path, 'wb') as dst:
+                while chunk := src.read(Config.UPLOAD_CHUNK_SIZE):
+                    dst.write(chunk)
+            paths.append(path)
+    return paths
+
+
+def build_items(card, files):
+    """
+    把各输入槽位的文件列表组合为条目列表 [[input_0, input_1, ...], ...]
+    :param files: {'input_i': [路径, ...]}
+    """
+    slots = []
+    for i, desc in enumerate(card['input_descs']):
+        paths = files.get(f'input_{i}') or []
+        if not paths:
+            raise BadRequest(f'Missing input: {desc}')
+        slots.append(paths)
+
+    count = max(len(paths) for paths in slots)
+    for i, paths in enumerate(slots):
+        if len(paths) not in (1, count):
+            raise BadRequest(f'输入 {card["input_descs"][i]} 的文件数 ({len(paths)}) 与批量条目数 ({count}) 不一致')
+    if count > Config.BATCH_MAX_ITEMS:
+        raise BadRequest(f'单次批量最多 {Config.BATCH_MAX_ITEMS} 个条目')
+    return [[paths[n] if len(paths) > 1 else paths[0] for paths in slots] for n in range(count)]
+
+
+def _run_item(card, results_dir, n, inputs, options):
+    item_dir = os.path.join(results_dir, f'{n:05d}')
+    os.makedirs(item_dir, exist_ok=True)
+    # inprocess 卡片的输出由 main() 写在条目目录下
+    output_paths = []
+    if card['exec_mode'] == 'subprocess':
+        output_paths = [os.path.join(item_dir, f'output_{i}.bin') for i in range(len(card['output_list']))]
+    entry = {'item': os.path.basename(item_dir), 'inputs': [os.path.basename(p) for p in inputs]}
+    try:
+        run = get_executor().run(card, inputs, output_paths, item_dir, options=options)
+    except LimitExceeded as e:
+        return {**entry, 'status': 'failed', 'error': str(e), 'limit': e.to_dict(), 'outputs': []}, []
+    except Exception as e:
+        failed = {**entry, 'status': 'failed', 'error': str(e), 'outputs': []}
+        if getattr(e, 'info', None):
+            failed['limit'] = e.info            # 执行节点上超出的资源限制
+        return failed, []
+    produced = [p for p in run.outputs if os.path.exists(p)]
+    return {**entry, 'status': 'ok',
+            'outputs': [os.path.relpath(p, results_dir) for p in produced]}, produced
+
+
+def archive_names(job, output_paths):
+    """批量结果在压缩包内按条目分目录（<条目>/<文件名>），manifest.json 位于根目录"""
+    results_dir = os.path.join(job.temp_dir, 'results')
+    return [os.path.relpath(path, results_dir) for path in output_paths]
+
+
+@job_handler('batch')
+def run_batch_job(job):
+    card = card_for(job)
+    options = job_options(job)
+    items = json.loads(job.input_paths)
+    results_dir = os.path.join(job.temp_dir, 'results')
+    os.makedirs(results_dir, exist_ok=True)
+
+    # 第一个条目使用任务本身的执行槽位，同时执行的其余条目各向调度器再申请一个槽位，
+    # 批量任务因此与其他任务共享全局 / 单卡片 / 单用户并发上限；槽位已满时等已有条目结束或下一轮再申请
+    parallel = max(1, min(len(items), max(card['workers'], Config.BATCH_PARALLELISM)))
+    pending = list(enumerate(items))
+    done = [None] * len(items)
+    running = {}
+    extra = 0
+    try:
+        with ThreadPoolExecutor(max_workers=parallel) as pool:
+            while pending or running:
+                while pending and len(running) < parallel:
+                    if running:
+                        if not job_scheduler.acquire_slot(job):
+                            break
+                        extra += 1
+                    n, inputs = pending.pop(0)
+                    running[pool.submit(_run_item, card, results_dir, n, inputs, options)] = n
+                finished, _ = wait(running, timeout=Config.JOB_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    done[running.pop(future)] = future.result()
+                    if extra:
+                        job_scheduler.release_slots(job)
+                        extra -= 1
+    finally:
+        job_scheduler.release_slots(job, extra)
+
+    manifest = [entry for entry, _ in done]
+    manifest_path = os.path.join(results_dir, MANIFEST_NAME)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'function_id': job.function_id,
+            'total': len(manifest),
+            'failed': sum(1 for entry in manifest if entry['status'] != 'ok'),
+            'items': manifest,
+        }, f, ensure_ascii=False, indent=2)
+
+    job.output_paths = json.dumps([manifest_path] + [p for _, produced in done for p in produced])
@@ -0,0 +1,567 @@
+"""
+上传 → 执行 → 下载 全流程的压测 / 基准脚本。
+
+用法：
+    # 进程内（Flask test client + 临时数据库，不影响 instance/site.db）
+    python benchmark.py --cards calc_md5,AES_crypt --sizes 1K,1M,100M --concurrency 4 --requests 20
+    # 压测已经启动的 gunicorn（--server-pid 为 gunicorn master，用于统计整个进程树的内存）
+    python benchmark.py --url http://127.0.0.1:8000 --token dp_xxx --server-pid 12345
+    # 保存结果，并与基线比较：p50 延迟或吞吐量变差超过阈值时以退出码 1 结束
+    python benchmark.py --output bench.json --compare baseline.json --threshold 0.15
+    # 启动耗时：多次冷启动 python -X importtime -c "import app"，p50 超过预算时以退出码 1 结束
+    python benchmark.py --startup --startup-runs 5 --startup-budget-ms 1500
+
+每个请求的输入开头写入随机 nonce，避免命中结果缓存（--allow-cache 关闭）。
+输出的指标：吞吐量（请求/秒、输入 MB/秒）、总延迟与各阶段（上传 / 排队+执行 / 下载）的
+p50/p95/p99、父进程与子进程的峰值 RSS、tmp_uploads 的峰值占用。
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlsplit
+
+try:
+    import resource
+except ImportError:          # Windows
+    resource = None
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+BLOCK = 1024 * 1024
+NONCE_BYTES = 16
+UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+# 启动（import app）墙钟时间 p50 的默认预算，毫秒
+STARTUP_BUDGET_MS = 1500
+# 卡片 -> 额外输入（input_0 为被测文件）
+EXTRA_INPUTS = {
+    'AES_crypt': {'input_1': b'0123456789abcdef0123456789abcdef'},
+    'AES': {'input_1': b'0123456789abcdef0123456789abcdef'},
+}
+
+
+# ---------- 工具 ----------
+def parse_size(text):
+    text = text.strip().upper().rstrip('B')
+    unit = text[-1] if text and text[-1] in UNITS else ''
+    return int(float(text[:len(text) - len(unit)]) * UNITS[unit])
+
+
+def format_size(n):
+    for unit in ('G', 'M', 'K'):
+        if n >= UNITS[unit]:
+            return f'{n / UNITS[unit]:.3g}{unit}'
+    return str(n)
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def summarize(values):
+    if not values:
+        return None
+    return {'p50': percentile(values, 50), 'p95': percentile(values, 95), 'p99': percentile(values, 99),
+            'mean': sum(values) / len(values), 'max': max(values)}
+
+
+def make_input(path, size):
+    """生成 size 字节的合成输入（重复写同一块随机数据，GB 级也很快）"""
+    block = os.urandom(min(BLOCK, max(size, 1)))
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[:remaining])
+            remaining -= len(block[:remaining])
+
+
+class NonceReader:
+    """读取文件，开头 NONCE_BYTES 字节替换为本次请求的随机值，使每个请求的输入都不同"""
+
+    def __init__(self, path, nonce=True):
+        self.size = os.path.getsize(path)
+        self._file = open(path, 'rb')
+        self._prefix = uuid.uuid4().bytes[:min(NONCE_BYTES, self.size)] if nonce else b''
+        self._file.seek(len(self._prefix))
+
+    def read(self, n=-1):
+        if self._prefix:
+            head, self._prefix = self._prefix, b''
+            if n is None or n < 0:
+                return head + self._file.read()
+            return head + self._file.read(max(n - len(head), 0))
+        return self._file.read(n)
+
+    def close(self):
+        self._file.close()
+
+
+# ---------- 资源采样 ----------
+def _proc_children():
+    children = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(name))
+    return children
+
+
+def _rss(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.stat(os.path.join(root, name), follow_symlinks=False).st_size
+            except OSError:
+                continue
+    return total
+
+
+class Sampler:
+    """后台采样：服务进程（父）与其子进程树的 RSS 峰值、tmp 目录占用峰值"""
+
+    def __init__(self, server_pid, tmp_dir, interval=0.2):
+        self.server_pid = server_pid
+        self.tmp_dir = tmp_dir
+        self.interval = interval
+        self.parent_peak = self.children_peak = self.tmp_peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._linux = os.path.isdir('/proc') and server_pid is not None
+
+    def _sample(self):
+        if self._linux:
+            parent = _rss(self.server_pid)
+            tree = _proc_children()
+            stack, children = list(tree.get(self.server_pid, [])), 0
+            while stack:
+                pid = stack.pop()
+                children += _rss(pid)
+                stack.extend(tree.get(pid, []))
+            self.parent_peak = max(self.parent_peak, parent)
+            self.children_peak = max(self.children_peak, children)
+        if self.tmp_dir and os.path.isdir(self.tmp_dir):
+            self.tmp_peak = max(self.tmp_peak, dir_size(self.tmp_dir))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+# ---------- 被测服务 ----------
+class TestClientTarget:
+    """进程内：Flask test client，调度器与卡片子进程都在本进程下"""
+
+    name = 'testclient'
+
+    def __init__(self, token=None):
+        self.scratch = tempfile.mkdtemp(prefix='dp-bench-')
+        # 必须在导入 app 之前设置，避免写入 instance/site.db
+        os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(self.scratch, 'bench.db'))
+        sys.path.insert(0, BASE_DIR)
+        from app import app
+        self.app = app
+        self.headers = {'Accept': 'application/json'}
+        if token:
+            self.headers['Authorization'] = f'Bearer {token}'
+        self._local = threading.local()
+        self.server_pid = os.getpid()
+        self.tmp_dir = app.config['UPLOAD_TMP_DIR']
+
+    @property
+    def client(self):
+        if not hasattr(self._local, 'client'):
+            self._local.client = self.app.test_client()
+        return self._local.client
+
+    def submit(self, card_id, files):
+        data = {field: (reader, name) for field, (reader, name) in files.items()}
+        response = self.client.post(f'/function/{card_id}', data=data, headers=self.headers)
+        return response.status_code, response.get_json(silent=True)
+
+    def get_json(self, url):
+        response = self.client.get(url, headers=self.headers)
+        return response.status_code, response.get_json(silent=True)
+
+    def download(self, url):
+        response = self.client.get(url, headers=self.headers, buffered=False)
+        size = sum(len(chunk) for chunk in response.response)
+        response.close()
+        return response.status_code, size
+
+
+class HttpTarget:
+    """压测独立运行的服务（gunicorn / waitress），multipart 请求体边读文件边发送"""
+
+    name = 'http'
+
+    def __init__(self, url, token=None, server_pid=None, tmp_dir=None):
+        parts = urlsplit(url)
+        self.scheme, self.netloc = parts.scheme, parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.headers = {'Accept': 'application/json'}
+        if token:
+            self.headers['Authorization'] = f'Bearer {token}'
+        self.server_pid = server_pid
+        self.tmp_dir = tmp_dir
+
+    def _connection(self):
+        cls = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+        return cls(self.netloc, timeout=3600)
+
+    @staticmethod
+    def _multipart(files):
+        boundary = uuid.uuid4().hex
+        parts = []
+        for field, (reader, name) in files.items():
+            head = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{name}"\r\n'
+                    f'Content-Type: application/octet-stream\r\n\r\n').encode()
+            parts.append((head, reader))
+        tail = f'--{boundary}--\r\n'.encode()
+        length = sum(len(head) + reader.size + 2 for head, reader in parts) + len(tail)
+
+        def body():
+            for head, reader in parts:
+                yield head
+                while chunk := reader.read(BLOCK):
+                    yield chunk
+                yield b'\r\n'
+            yield tail
+        return f'multipart/form-data; boundary={boundary}', length, body()
+
+    def submit(self, card_id, files):
+        content_type, length, body = self._multipart(files)
+        conn = self._connection()
+        headers = {**self.headers, 'Content-Type': content_type, 'Content-Length': str(length)}
+        conn.request('POST', f'{self.prefix}/function/{card_id}', body=body, headers=headers)
+        response = conn.getresponse()
+        data = response.read()
+        conn.close()
+        try:
+            return response.status, json.loads(data)
+        except ValueError:
+            return response.status, None
+
+    def get_json(self, url):
+        conn = self._connection()
+        conn.request('GET', self.prefix + url, headers=self.headers)
+        response = conn.getresponse()
+        data = response.read()
+        conn.close()
+        try:
+            return response.status, json.loads(data)
+        except ValueError:
+            return response.status, None
+
+    def download(self, url):
+        conn = self._connection()
+        conn.request('GET', self.prefix + url, headers=self.headers)
+        response = conn.getresponse()
+        size = 0
+        while chunk := response.read(BLOCK):
+            size += len(chunk)
+        conn.close()
+        return response.status, size
+
+
+# ---------- 执行 ----------
+def one_request(target, card_id, input_path, extra_paths, nonce):
+    readers = {'input_0': (NonceReader(input_path, nonce), os.path.basename(input_path))}
+    for field, path in extra_paths.items():
+        readers[field] = (NonceReader(path, nonce=False), os.path.basename(path))
+    sample = {'ok': False, 'error': None}
+    start = time.perf_counter()
+    try:
+        # 命中结果缓存时同样返回 202，任务已是 done
+        status, data = target.submit(card_id, readers)
+        uploaded = time.perf_counter()
+        if status == 202 and data:
+            delay = 0.01
+            while data.get('status') in ('queued', 'running'):
+                time.sleep(delay)
+                delay = min(delay * 2, 0.5)
+                _, data = target.get_json(data['status_url'])
+            finished = time.perf_counter()
+            if data.get('status') != 'done':
+                sample['error'] = data.get('error') or data.get('status')
+                return sample
+            status, size = target.download(data['result_url'])
+        else:
+            sample['error'] = f'HTTP {status}'
+            return sample
+        done = time.perf_counter()
+    except Exception as e:
+        sample['error'] = f'{type(e).__name__}: {e}'
+        return sample
+    finally:
+        for reader, _ in readers.values():
+            reader.close()
+    sample.update(ok=status == 200, upload=uploaded - start, run=finished - uploaded,
+                  download=done - finished, total=done - start, bytes_out=size)
+    if status != 200:
+        sample['error'] = f'HTTP {status}'
+    return sample
+
+
+def run_scenario(target, card_id, size, args, workdir):
+    input_path = os.path.join(workdir, f'input_{format_size(size)}.bin')
+    if not os.path.exists(input_path):
+        make_input(input_path, size)
+    extra_paths = {}
+    for field, content in EXTRA_INPUTS.get(card_id, {}).items():
+        path = os.path.join(workdir, f'{field}.txt')
+        with open(path, 'wb') as f:
+            f.write(content)
+        extra_paths[field] = path
+    nonce = not args.allow_cache
+
+    # 预热：拉起常驻 worker、填充各级缓存，不计入结果
+    for _ in range(args.warmup):
+        one_request(target, card_id, input_path, extra_paths, nonce)
+
+    with Sampler(target.server_pid, target.tmp_dir) as sampler:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            samples = list(pool.map(lambda _: one_request(target, card_id, input_path, extra_paths, nonce),
+                                    range(args.requests)))
+        wall = time.perf_counter() - start
+
+    ok = [s for s in samples if s['ok']]
+    errors = sorted({s['error'] for s in samples if s['error']})
+    result = {
+        'card': card_id,
+        'size': size,
+        'size_label': format_size(size),
+        'requests': len(samples),
+        'ok': len(ok),
+        'failed': len(samples) - len(ok),
+        'errors': errors[:10],
+        'wall_seconds': wall,
+        'throughput_rps': len(ok) / wall if wall else 0,
+        'throughput_mbps': len(ok) * size / UNITS['M'] / wall if wall else 0,
+        'latency': summarize([s['total'] for s in ok]),
+        'phases': {phase: summarize([s[phase] for s in ok]) for phase in ('upload', 'run', 'download')},
+        'rss_peak_parent': sampler.parent_peak,
+        'rss_peak_children': sampler.children_peak,
+        'tmp_peak_bytes': sampler.tmp_peak,
+    }
+    if resource is not None and isinstance(target, TestClientTarget):
+        scale = 1 if sys.platform == 'darwin' else 1024
+        result['ru_maxrss_self'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+        result['ru_maxrss_children'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return result
+
+
+# ---------- 启动耗时 ----------
+def parse_importtime(stderr):
+    """解析 -X importtime 的输出，返回 [(模块, 自身微秒, 累计微秒, 嵌套深度)]"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' '))) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative), depth))
+    return modules
+
+
+def measure_startup(runs, init_db=False, top=10):
+    """
+    冷启动 runs 次 worker 需要的导入（import app，含 create_app），
+    返回墙钟时间与导入耗时的分布，以及自身耗时最多的模块（取最后一次）。
+    """
+    scratch = tempfile.mkdtemp(prefix='dp-bench-startup-')
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(scratch, 'startup.db'),
+               DB_AUTO_INIT='1' if init_db else '0', PYTHONDONTWRITEBYTECODE='')
+    walls, imports, modules = [], [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=BASE_DIR, env=env,
+                              capture_output=True, text=True, timeout=120)
+        walls.append(time.perf_counter() - start)
+        if proc.returncode != 0:
+            raise RuntimeError(f'import app 失败: {proc.stderr[-2000:]}')
+        modules = parse_importtime(proc.stderr)
+        imports.append(sum(cumulative for _, _, cumulative, depth in modules if depth == 0) / 1e6)
+    return {
+        'runs': runs,
+        'init_db': init_db,
+        'wall': summarize(walls),
+        'import': summarize(imports),
+        'top_self': [{'module': name, 'self_ms': self_us / 1000, 'cumulative_ms': cumulative / 1000}
+                     for name, self_us, cumulative, _ in sorted(modules, key=lambda m: -m[1])[:top]],
+    }
+
+
+def print_startup(result, budget_ms):
+    wall, imports = result['wall'], result['import']
+    print(f'启动（{result["runs"]} 次，{"含" if result["init_db"] else "不含"}建表）: '
+          f'墙钟 p50 {wall["p50"] * 1000:.0f} ms / max {wall["max"] * 1000:.0f} ms，'
+          f'导入 p50 {imports["p50"] * 1000:.0f} ms，预算 {budget_ms:.0f} ms')
+    for m in result['top_self']:
+        print(f'    {m["self_ms"]:>8.1f} ms  {m["cumulative_ms"]:>8.1f} ms  {m["module"]}')
+
+
+# ---------- 报告与回归比较 ----------
+def print_report(results):
+    header = f'{"card":<12}{"size":>7}{"ok/n":>9}{"req/s":>9}{"MB/s":>9}{"p50":>9}{"p95":>9}{"p99":>9}' \
+             f'{"rss(P)":>9}{"rss(C)":>9}{"tmp":>9}'
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        lat = r['latency'] or {'p50': 0, 'p95': 0, 'p99': 0}
+        print(f'{r["card"]:<12}{r["size_label"]:>7}{r["ok"]:>5}/{r["requests"]:<3}'
+              f'{r["throughput_rps"]:>9.2f}{r["throughput_mbps"]:>9.1f}'
+              f'{lat["p50"]:>9.3f}{lat["p95"]:>9.3f}{lat["p99"]:>9.3f}'
+              f'{format_size(r["rss_peak_parent"]):>9}{format_size(r["rss_peak_children"]):>9}'
+              f'{format_size(r["tmp_peak_bytes"]):>9}')
+        for error in r['errors']:
+            print(f'    error: {error[:200]}')
+
+
+def compare(results, baseline_path, threshold):
+    """与基线比较，返回回归列表；p50 延迟变大或吞吐量下降超过 threshold 视为回归"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(r['card'], r['size']): r for r in json.load(f)['scenarios']}
+    regressions = []
+    for r in results:
+        base = baseline.get((r['card'], r['size']))
+        if base is None or not base['latency'] or not r['latency']:
+            continue
+        p50_ratio = r['latency']['p50'] / base['latency']['p50'] if base['latency']['p50'] else 1
+        tput_ratio = r['throughput_rps'] / base['throughput_rps'] if base['throughput_rps'] else 1
+        line = f'{r["card"]} {r["size_label"]}: p50 x{p50_ratio:.2f}, 吞吐 x{tput_ratio:.2f}'
+        if p50_ratio > 1 + threshold or tput_ratio < 1 - threshold or r['failed'] > base['failed']:
+            regressions.append(line)
+            print('回归  ' + line)
+        else:
+            print('正常  ' + line)
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='上传 → 执行 → 下载 全流程基准测试')
+    parser.add_argument('--url', help='被测服务地址；不指定时使用进程内 Flask test client')
+    parser.add_argument('--token', help='API token（Authorization: Bearer）')
+    parser.add_argument('--server-pid', type=int, help='--url 模式下服务主进程 PID，用于统计进程树内存')
+    parser.add_argument('--tmp-dir', default=os.path.join(BASE_DIR, 'tmp_uploads'),
+                        help='--url 模式下统计占用的临时目录')
+    parser.add_argument('--cards', default='calc_md5,AES_crypt', help='逗号分隔的卡片 ID')
+    parser.add_argument('--sizes', default='1K,1M,64M', help='逗号分隔的输入大小，如 1K,1M,100M,2G')
+    parser.add_argument('--concurrency', type=int, default=4, help='并发请求数')
+    parser.add_argument('--requests', type=int, default=20, help='每个场景的请求数')
+    parser.add_argument('--warmup', type=int, default=1, help='每个场景不计入结果的预热请求数')
+    parser.add_argument('--allow-cache', action='store_true', help='不加 nonce，允许命中结果缓存')
+    parser.add_argument('--workdir', help='合成输入的存放目录（默认临时目录）')
+    parser.add_argument('--output', help='结果 JSON 的保存路径')
+    parser.add_argument('--compare', help='基线结果 JSON，检测回归')
+    parser.add_argument('--threshold', type=float, default=0.15, help='回归阈值（比例）')
+    parser.add_argument('--startup', action='store_true', help='只测量应用启动（import app）耗时')
+    parser.add_argument('--startup-runs', type=int, default=5, help='启动测量的次数')
+    parser.add_argument('--startup-budget-ms', type=float, default=STARTUP_BUDGET_MS,
+                        help='启动墙钟时间 p50 的预算（毫秒），超出时以退出码 1 结束')
+    parser.add_argument('--startup-init-db', action='store_true', help='启动测量包含建表 / 补列（DB_AUTO_INIT=1）')
+    args = parser.parse_args()
+
+    if args.startup:
+        result = measure_startup(args.startup_runs, args.startup_init_db)
+        print_startup(result, args.startup_budget_ms)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump({'meta': {'timestamp': datetime.now().isoformat(timespec='seconds'),
+                                    'revision': git_revision(), 'python': platform.python_version()},
+                           'startup': result}, f, ensure_ascii=False, indent=2)
+        over = result['wall']['p50'] * 1000 > args.startup_budget_ms
+        if over:
+            print('超出启动预算')
+        sys.exit(1 if over else 0)
+
+    if args.url:
+        target = HttpTarget(args.url, args.token, args.server_pid, args.tmp_dir)
+    else:
+        target = TestClientTarget(args.token)
+    workdir = args.workdir or tempfile.mkdtemp(prefix='dp-bench-input-')
+    os.makedirs(workdir, exist_ok=True)
+
+    results = []
+    for card_id in [c.strip() for c in args.cards.split(',') if c.strip()]:
+        for size in [parse_size(s) for s in args.sizes.split(',') if s.strip()]:
+            print(f'>> {card_id} {format_size(size)} x{args.requests} (并发 {args.concurrency})', flush=True)
+            results.append(run_scenario(target, card_id, size, args, workdir))
+    print()
+    print_report(results)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'target': args.url or target.name,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+        },
+        'scenarios': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'\n结果已保存到 {args.output}')
+
+    if args.compare:
+        print()
+        if compare(results, args.compare, args.threshold):
+            sys.exit(1)
+    # 进程内模式下调度器 / 清扫线程是守护线程，常驻 worker 随进程退出
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+常驻 worker：由卡片自己的 env/bin/python3 启动，预先导入 program/run.py，
+之后通过 stdin/stdout 上的 JSON 行协议反复执行任务，省去解释器启动和依赖导入。
+
+仅依赖标准库（运行在卡片的虚拟环境中）。
+
+协议：
+    启动后输出一行 {"ready": true} 或 {"ready": false, "error": "..."}
+    每个任务输入一行 {"argv": [...], "max_cpu": 秒, "max_output": 字符数}，输出一行
+    {"returncode": int, "stdout": str, "stderr": str, "cpu": float, "maxrss": int}
+    之前可能有若干行 {"progress": "PROGRESS <百分比> [说明]"}：run.py 输出的进度行，读到即转发；
+    其中 cpu 为本次任务的 CPU 秒数，maxrss 为 worker 进程迄今的峰值内存（字节）；
+    max_cpu / max_output 为 0 表示不限制，超出 max_cpu 时 worker 被 SIGXCPU 终止
+"""
+import collections
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import re
+import sys
+import threading
+import traceback
+
+try:
+    import resource
+except ImportError:          # Windows
+    resource = None
+
+
+def usage():
+    """返回 (累计 CPU 秒数, 峰值内存字节)"""
+    if resource is None:
+        return 0.0, 0
+    ru = resource.getrusage(resource.RUSAGE_SELF)
+    maxrss = ru.ru_maxrss if sys.platform == 'darwin' else ru.ru_maxrss * 1024
+    return ru.ru_utime + ru.ru_stime, maxrss
+
+
+class TailWriter(io.TextIOBase):
+    """只保留最后 limit 个字符的输出（limit 为 0 时不截断）"""
+
+    def __init__(self, limit=0):
+        self.limit = limit
+        self.size = 0
+        self.dropped = 0
+        self._parts = collections.deque()
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        self._parts.append(s)
+        self.size += len(s)
+        while self.limit and self.size > self.limit:
+            excess = self.size - self.limit
+            head = self._parts[0]
+            cut = min(len(head), excess)
+            if cut == len(head):
+                self._parts.popleft()
+            else:
+                self._parts[0] = head[cut:]
+            self.size -= cut
+            self.dropped += cut
+        return len(s)
+
+    def getvalue(self):
+        text = ''.join(self._parts)
+        if self.dropped:
+            text = f'[已截断前 {self.dropped} 字符]\n' + text
+        return text
+
+
+class ProgressTee(TailWriter):
+    """run.py 的 stdout：照常保留输出，同时把进度行（PROGRESS ...）立即转发给父进程"""
+
+    def __init__(self, limit, forward):
+        super().__init__(limit)
+        self.forward = forward
+        self._line = ''
+        self._lock = threading.Lock()       # run.py 可能在多个线程中输出
+
+    def write(self, s):
+        with self._lock:
+            super().write(s)
+            lines = re.split(r'[\r\n]', self._line + s)
+            self._line = lines.pop()[-4096:]
+            for line in lines:
+                if line.startswith('PROGRESS '):
+                    self.forward({'progress': line})
+        return len(s)
+
+
+def limit_cpu(seconds):
+    """把 RLIMIT_CPU 软限制设为 已用 CPU + seconds，使限制按单个任务计算；0 表示取消"""
+    if resource is None:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = resource.RLIM_INFINITY
+    if seconds:
+        soft = int(usage()[0]) + 1 + int(seconds)
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def load_program(script_path):
+    program_dir = os.path.dirname(os.path.abspath(script_path))
+    if program_dir not in sys.path:
+        sys.path.insert(0, program_dir)
+    spec = importlib.util.spec_from_file_location('card_program', script_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_job(module, script_path, argv, max_output=0, forward=None):
+    """模拟 `python run.py *argv` 的一次执行，返回 (returncode, stdout, stderr)；进度行交给 forward"""
+    out = ProgressTee(max_output, forward) if forward is not None else TailWriter(max_output)
+    err = TailWriter(max_output)
+    returncode = 0
+    saved_argv = sys.argv
+    sys.argv = [script_path, *argv]
+    try:
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            try:
+                module.main()
+            except SystemExit as e:
+                # 与解释器退出时的处理保持一致
+                if e.code is None:
+                    returncode = 0
+                elif isinstance(e.code, int):
+                    returncode = e.code
+                else:
+                    print(e.code, file=sys.stderr)
+                    returncode = 1
+            except BaseException:
+                traceback.print_exc()
+                returncode = 1
+    finally:
+        sys.argv = saved_argv
+    return returncode, out.getvalue(), err.getvalue()
+
+
+def serve(script_path):
+    # 协议独占原 stdout；run.py 的 print 在任务内被重定向，C 层输出丢弃
+    proto = os.fdopen(os.dup(sys.stdout.fileno()), 'w', encoding='utf-8')
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    os.close(devnull)
+
+    def reply(obj):
+        proto.write(json.dumps(obj, ensure_ascii=False) + '\n')
+        proto.flush()
+
+    try:
+        module = load_program(script_path)
+        if not callable(getattr(module, 'main', None)):
+            raise AttributeError('run.py 未定义 main()')
+    except BaseException as e:
+        reply({'ready': False, 'error': f'{type(e).__name__}: {e}'})
+        return
+    reply({'ready': True})
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        job = json.loads(line)
+        cpu_before, _ = usage()
+        limit_cpu(job.get('max_cpu') or 0)
+        returncode, stdout, stderr = run_job(module, script_path, job['argv'], job.get('max_output') or 0, reply)
+        limit_cpu(0)
+        cpu_after, maxrss = usage()
+        reply({'returncode': returncode, 'stdout': stdout, 'stderr': stderr,
+               'cpu': cpu_after - cpu_before, 'maxrss': maxrss})
+
+
+if __name__ == '__main__':
+    serve(sys.argv[1])
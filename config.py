@@ -3,9 +3,151 @@ BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-change-me'
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(BASE_DIR, 'instance', 'site.db')
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(BASE_DIR, 'instance', 'site.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # 连接池：调度线程、清扫线程与请求线程共用；SQLite 的写锁冲突由 busy_timeout 排队等待
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': 10,
+        'max_overflow': 20,
+        'pool_timeout': 30,
+        'pool_recycle': 3600,
+    }
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 15000,
+    }
+    # 创建应用时建表 / 补列；部署时改用 flask --app app init-db 执行一次的可设为 0
+    DB_AUTO_INIT = os.environ.get('DB_AUTO_INIT', '1') == '1'
     SECRET_KEY = os.getenv('SECRET_KEY') or 'dev-hardcode'
     UPLOAD_ALLOWED_EXT = {'zip'}
     UPLOAD_TMP_DIR = os.path.join(BASE_DIR, 'tmp_uploads')
-    FUNCTIONS_DIR = os.path.join(BASE_DIR, 'functions')
\ No newline at end of file
+    FUNCTIONS_DIR = os.path.join(BASE_DIR, 'functions')
+    FUNCTION_CSV = os.path.join(BASE_DIR, 'function.csv')
+
+    # 登录态缓存：用户记录与 API token 在进程内缓存的秒数与条目上限
+    USER_CACHE_TTL = 30
+    USER_CACHE_MAX = 10000
+
+    # 邀请码：单次生成数量上限（页面显示 / CSV 流式下载）
+    INVCODE_PAGE_MAX = 10000
+    INVCODE_CSV_MAX = 1000000
+
+    # 常驻 worker：单个进程执行多少次任务后回收、空闲多久后退出（秒）、
+    # 启动（导入 run.py）超过多少秒未完成握手即终止并回退冷启动
+    WORKER_MAX_JOBS = 200
+    WORKER_IDLE_TIMEOUT = 600
+    WORKER_START_TIMEOUT = 30
+
+    # 卡片运行资源限制的默认值，可在 functions/<ID>/card.json 的 limits 中按卡片覆盖（0 表示不限制）：
+    # 墙钟超时（秒）、地址空间（字节）、CPU 时间（秒）、nice 增量、stdout/stderr 各自保留的字节数
+    RUN_TIMEOUT = int(os.environ.get('RUN_TIMEOUT', 3600))
+    RUN_MAX_MEMORY = int(os.environ.get('RUN_MAX_MEMORY', 0))
+    RUN_MAX_CPU = int(os.environ.get('RUN_MAX_CPU', 0))
+    RUN_NICE = 0
+    RUN_MAX_OUTPUT = 1024 * 1024
+
+    # 异步任务：全局并发上限、单卡片并发上限、调度线程轮询间隔（秒）
+    JOB_MAX_CONCURRENCY = os.cpu_count() or 4
+    JOB_MAX_PER_CARD = 2
+    JOB_POLL_INTERVAL = 2
+
+    # 执行中任务的心跳：执行进程每 JOB_HEARTBEAT_INTERVAL 秒更新 job.heartbeat_at，
+    # 超过 JOB_HEARTBEAT_TIMEOUT 秒没有更新的任务（进程 / 容器 / 主机已退出）由任一进程放回队列
+    JOB_HEARTBEAT_INTERVAL = 10
+    JOB_HEARTBEAT_TIMEOUT = int(os.environ.get('JOB_HEARTBEAT_TIMEOUT', 60))
+
+    # 公平调度：单用户并发上限（0 不限，匿名用户合计为一个用户）；
+    # 角色 -> 优先级，优先级 -> 公平份额权重（权重 2 的用户可同时占用 2 倍的执行槽位）；
+    # 同一份额内输入小的任务优先，排队每满 JOB_AGING_SECONDS 秒，比较用的输入大小减半，避免大任务饿死；
+    # 每轮调度只考虑最早的 JOB_SCHED_WINDOW 个排队任务
+    JOB_MAX_PER_USER = int(os.environ.get('JOB_MAX_PER_USER', 2))
+    JOB_ROLE_PRIORITY = {'admin': 2}
+    JOB_DEFAULT_PRIORITY = 1
+    JOB_ANONYMOUS_PRIORITY = 0
+    JOB_PRIORITY_WEIGHTS = {2: 4, 1: 2, 0: 1}
+    JOB_AGING_SECONDS = 300
+    JOB_SCHED_WINDOW = 500
+
+    # 指标：各进程的快照目录与写入间隔（秒），/admin/metrics 汇总所有 worker 进程
+    METRICS_DIR = os.path.join(BASE_DIR, 'instance', 'metrics')
+    METRICS_FLUSH_INTERVAL = 5
+
+    # 执行后端：local 在本机执行；remote 分发到 worker_node.py 执行节点（WORKER_NODES 为逗号分隔的节点地址，
+    # 如 http://10.0.0.2:8700），此时 JOB_MAX_CONCURRENCY 应调到各节点槽位数之和。
+    # 节点访问令牌、节点状态刷新间隔（秒）、单次执行的网络超时（秒，节点每 15 秒发送心跳）、
+    # 节点上运行目录的保留秒数（结果未被取回时）、没有可用节点时是否在本机执行
+    EXECUTOR = os.environ.get('EXECUTOR', 'local')
+    WORKER_NODES = [u.strip() for u in os.environ.get('WORKER_NODES', '').split(',') if u.strip()]
+    WORKER_NODE_TOKEN = os.environ.get('WORKER_NODE_TOKEN', '')
+    WORKER_NODE_REFRESH = 5
+    WORKER_NODE_TIMEOUT = 120
+    WORKER_NODE_DIR = os.path.join(BASE_DIR, 'node_runs')
+    WORKER_NODE_RUN_TTL = 3600
+    EXECUTOR_LOCAL_FALLBACK = os.environ.get('EXECUTOR_LOCAL_FALLBACK', '1') == '1'
+
+    # 执行进度：写入 job 表的最小间隔（秒）；/jobs/<id>/events 检查进度的间隔与无变化时的心跳间隔（秒）
+    JOB_PROGRESS_INTERVAL = 1.0
+    JOB_EVENTS_POLL = 0.5
+    JOB_EVENTS_KEEPALIVE = 15
+    # 每个事件流最长保持的秒数（之后关闭，浏览器按 retry 重连）；每个进程同时保持的事件流上限，
+    # 须小于 gunicorn 的 threads，超出时返回 503，页面改为轮询 /jobs/<id>/status
+    JOB_EVENTS_MAX_SECONDS = 30
+    JOB_EVENTS_MAX_STREAMS = int(os.environ.get('JOB_EVENTS_MAX_STREAMS', 2))
+
+    # 上传：请求体大小上限、每次从 socket 读取的块大小、普通表单字段上限
+    UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', 16 * 1024 ** 3))
+    UPLOAD_CHUNK_SIZE = 1024 * 1024
+    UPLOAD_MAX_FIELD_BYTES = 64 * 1024
+
+    # 可续传上传仓库（内容寻址、按引用计数共享，须与 tmp_uploads 在同一文件系统以便硬链接）：
+    # 上传时顺带计算的摘要（calc_md5 可直接采用）、未完成上传与已完成句柄的保留秒数
+    UPLOAD_STORE_DIR = os.path.join(BASE_DIR, 'instance', 'uploads')
+    UPLOAD_STORE_DIGESTS = ('sha256', 'md5', 'sha1')
+    UPLOAD_SESSION_TTL = 24 * 3600
+    UPLOAD_HANDLE_TTL = 7 * 24 * 3600
+    # 仓库总大小上限（已入库内容 + 未完成上传的声明大小）；超出时从最久未使用的句柄开始释放
+    UPLOAD_STORE_MAX_BYTES = int(os.environ.get('UPLOAD_STORE_MAX_BYTES', 50 * 1024 ** 3))
+
+    # tmp_uploads 回收：清扫间隔（秒）、条目最长保留时间（秒）、目录总大小上限、
+    # 无任务记录的新条目（正在上传）的保护期（秒）、结果下载完成后是否立即删除任务目录
+    # （默认关闭：重试或再次下载仍能取得结果，由清扫线程按保留时间回收）、单用户临时空间配额（0 表示不限制）
+    TMP_SWEEP_INTERVAL = 600
+    TMP_MAX_AGE = int(os.environ.get('TMP_MAX_AGE', 24 * 3600))
+    TMP_MAX_BYTES = int(os.environ.get('TMP_MAX_BYTES', 50 * 1024 ** 3))
+    TMP_GRACE = 600
+    TMP_DELETE_AFTER_DOWNLOAD = os.environ.get('TMP_DELETE_AFTER_DOWNLOAD', '0') == '1'
+    TMP_USER_QUOTA_BYTES = int(os.environ.get('TMP_USER_QUOTA_BYTES', 10 * 1024 ** 3))
+
+    # 下载：由 nginx 通过 X-Accel-Redirect 发送结果，本地目录 -> internal location
+    USE_X_ACCEL_REDIRECT = os.environ.get('USE_X_ACCEL_REDIRECT') == '1'
+    X_ACCEL_REDIRECT_MAP = {
+        os.path.join(BASE_DIR, 'tmp_uploads'): '/_tmp_uploads/',
+        os.path.join(BASE_DIR, 'instance', 'result_cache'): '/_result_cache/',
+    }
+
+    # 结果缓存：目录与总大小上限（超出后按 LRU 淘汰）
+    RESULT_CACHE_DIR = os.path.join(BASE_DIR, 'instance', 'result_cache')
+    RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 20 * 1024 ** 3))
+
+    # 批量任务：单次最多条目数、条目并行度上限（卡片开启常驻 worker 时取两者较大值；
+    # 第一个之外的并行条目各占用一个执行槽位，受 JOB_MAX_CONCURRENCY / JOB_MAX_PER_CARD / JOB_MAX_PER_USER 约束）
+    BATCH_MAX_ITEMS = 1000
+    BATCH_PARALLELISM = os.cpu_count() or 2
+
+    # 多步流水线：定义文件，以及同一流水线中互不依赖的步骤的并发数
+    PIPELINES_JSON = os.path.join(BASE_DIR, 'pipelines.json')
+    PIPELINE_PARALLELISM = os.cpu_count() or 2
+
+    # 后台安装卡片：zip 解压线程数、冒烟测试（冷启动执行一次 run.py）的超时秒数
+    CARD_INSTALL_WORKERS = os.cpu_count() or 2
+    CARD_SMOKE_TIMEOUT = 300
+
+    # 内容寻址的运行环境仓库：相同的依赖文件在各卡片之间硬链接共享（见 envstore.py）
+    ENV_STORE_DIR = os.path.join(BASE_DIR, 'instance', 'envstore')
+
+    # 页面缓存：浏览器缓存秒数（之后以 ETag 重新验证）；手册目录与 PDF 手册；预压缩静态包输出目录
+    PAGE_MAX_AGE = 300
+    MANUAL_DIR = os.path.join(BASE_DIR, 'static_page')
+    MANUAL_PDFS = [os.path.join(BASE_DIR, '用户手册.pdf'), os.path.join(BASE_DIR, '维护手册.pdf')]
+    STATIC_BUNDLE_DIR = os.path.join(BASE_DIR, 'static_bundle')
@@ -0,0 +1,231 @@
+"""
+内容寻址的运行环境仓库：多张卡片依赖相同时只保留一份文件，页缓存中也只有一份。
+
+instance/envstore/
+    objects/<sha[:2]>/<sha>[.x]   文件内容，按 SHA-256 与可执行位寻址，只读
+    envs/<env 摘要>/              完整的 env 目录树，其中的普通文件都是 objects 的硬链接
+
+env 摘要：
+- 卡片带锁文件（functions/<ID>/env.lock 或 requirements.lock）时为 lock-sha256(锁文件 + pyvenv.cfg)，
+  锁文件相同的卡片直接共用已有的 env，不再逐个文件入库；
+- 否则为 tree-sha256(整棵目录树的相对路径、权限、内容摘要与符号链接目标)。
+
+卡片入库（intern_env）后 functions/<ID>/env/ 被删除，由 functions/<ID>/env.ref 记录 env 摘要，
+runner.card_paths 通过 resolve_env 找到实际的解释器；没有 env.ref 的卡片仍使用自带的 env/。
+注册表缓存了各卡片的解释器路径，命令行入库后会更新 function.csv 的 mtime，让运行中的服务重新加载。
+
+命令行：
+    python envstore.py intern [卡片 ID ...]    # 把已有卡片的 env 入库（默认全部）
+    python envstore.py gc                       # 删除没有卡片引用的 env 与对象
+"""
+import argparse
+import hashlib
+import logging
+import os
+import shutil
+import stat
+import sys
+import threading
+import uuid
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+REF_NAME = 'env.ref'
+LOCKFILES = ('env.lock', 'requirements.lock')
+CHUNK_SIZE = 1024 * 1024
+
+
+# ---------- 路径 ----------
+def objects_dir():
+    return os.path.join(Config.ENV_STORE_DIR, 'objects')
+
+
+def envs_dir():
+    return os.path.join(Config.ENV_STORE_DIR, 'envs')
+
+
+_refs = {}              # env.ref 路径 -> (mtime_ns, env 目录)
+_refs_lock = threading.Lock()
+
+
+def resolve_env(card_dir):
+    """返回卡片实际使用的 env 目录：有 env.ref 时为仓库中的共享 env，否则为卡片自带的 env/"""
+    ref = os.path.join(card_dir, REF_NAME)
+    try:
+        mtime = os.stat(ref).st_mtime_ns
+    except OSError:
+        return os.path.join(card_dir, 'env')
+    with _refs_lock:
+        hit = _refs.get(ref)
+        if hit is None or hit[0] != mtime:
+            with open(ref, encoding='ascii') as f:
+                hit = (mtime, os.path.join(envs_dir(), f.read().strip()))
+            _refs[ref] = hit
+    return hit[1]
+
+
+# ---------- 入库 ----------
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(CHUNK_SIZE):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def store_object(path):
+    """把文件放入 objects（已存在则复用），返回对象路径与摘要"""
+    executable = bool(os.stat(path).st_mode & stat.S_IXUSR)
+    digest = file_digest(path)
+    obj = os.path.join(objects_dir(), digest[:2], digest + ('.x' if executable else ''))
+    if os.path.exists(obj):
+        return obj, digest
+    os.makedirs(os.path.dirname(obj), exist_ok=True)
+    tmp = f'{obj}.{uuid.uuid4().hex}.tmp'
+    try:
+        os.link(path, tmp)
+    except OSError:             # 跨文件系统时只能复制一次
+        shutil.copyfile(path, tmp)
+    os.chmod(tmp, 0o555 if executable else 0o444)
+    os.replace(tmp, obj)        # 并发入库同一内容时后者覆盖前者，内容相同
+    return obj, digest
+
+
+def _build_tree(env_dir, target):
+    """在 target 下按 env_dir 建立目录树，普通文件硬链接到 objects；返回用于计算摘要的清单"""
+    manifest = []
+    for root, dirs, files in os.walk(env_dir):
+        rel_root = os.path.relpath(root, env_dir)
+        os.makedirs(os.path.join(target, rel_root), exist_ok=True)
+        for name in sorted(dirs) + sorted(files):
+            src = os.path.join(root, name)
+            rel = os.path.normpath(os.path.join(rel_root, name))
+            dst = os.path.join(target, rel)
+            if os.path.islink(src):
+                link = os.readlink(src)
+                os.symlink(link, dst)
+                manifest.append(f'L {rel} {link}')
+                if name in dirs:
+                    dirs.remove(name)       # 不跟随目录符号链接
+            elif name in files:
+                obj, digest = store_object(src)
+                os.link(obj, dst)
+                manifest.append(f'F {rel} {os.path.basename(obj)} {digest}')
+    return manifest
+
+
+def lock_digest(card_dir):
+    """卡片带锁文件时返回 lock-<摘要>，否则返回 None"""
+    for name in LOCKFILES:
+        path = os.path.join(card_dir, name)
+        if os.path.isfile(path):
+            h = hashlib.sha256()
+            with open(path, 'rb') as f:
+                h.update(f.read())
+            cfg = os.path.join(card_dir, 'env', 'pyvenv.cfg')
+            if os.path.isfile(cfg):
+                with open(cfg, 'rb') as f:
+                    h.update(f.read())
+            return 'lock-' + h.hexdigest()
+    return None
+
+
+def _write_ref(card_dir, digest):
+    ref = os.path.join(card_dir, REF_NAME)
+    tmp = ref + '.tmp'
+    with open(tmp, 'w', encoding='ascii') as f:
+        f.write(digest + '\n')
+    os.replace(tmp, ref)
+
+
+def intern_env(card_dir):
+    """
+    把卡片自带的 env/ 放入仓库并改为引用共享 env，返回 env 摘要；
+    卡片没有 env/（或已入库）时返回 None。
+    """
+    env_dir = os.path.join(card_dir, 'env')
+    if not os.path.isdir(env_dir) or os.path.islink(env_dir):
+        return None
+    os.makedirs(envs_dir(), exist_ok=True)
+
+    digest = lock_digest(card_dir)
+    if digest is None or not os.path.isdir(os.path.join(envs_dir(), digest)):
+        tmp = os.path.join(envs_dir(), f'.tmp-{uuid.uuid4().hex}')
+        try:
+            manifest = _build_tree(env_dir, tmp)
+            if digest is None:
+                digest = 'tree-' + hashlib.sha256('\n'.join(manifest).encode('utf-8')).hexdigest()
+            try:
+                os.rename(tmp, os.path.join(envs_dir(), digest))
+            except OSError:
+                pass                # 相同的 env 已存在，复用已有的
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    _write_ref(card_dir, digest)
+    shutil.rmtree(env_dir)
+    logger.info('卡片 %s 的 env 已入库: %s', os.path.basename(card_dir), digest)
+    return digest
+
+
+# ---------- 清理 ----------
+def referenced_envs():
+    """functions/ 下（含安装中的暂存目录）各卡片引用的 env 摘要"""
+    refs = set()
+    for entry in os.scandir(Config.FUNCTIONS_DIR):
+        ref = os.path.join(entry.path, REF_NAME)
+        if entry.is_dir() and os.path.isfile(ref):
+            with open(ref, encoding='ascii') as f:
+                refs.add(f.read().strip())
+    return refs
+
+
+def gc():
+    """删除没有卡片引用的 env，以及不再被任何 env 链接的对象；返回 (env 数, 对象数)"""
+    if not os.path.isdir(envs_dir()):
+        return 0, 0
+    refs = referenced_envs()
+    envs = 0
+    for entry in os.scandir(envs_dir()):
+        if entry.name not in refs:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            envs += 1
+    objects = 0
+    for root, _, files in os.walk(objects_dir()):
+        for name in files:
+            path = os.path.join(root, name)
+            if os.stat(path).st_nlink == 1:
+                os.remove(path)
+                objects += 1
+    return envs, objects
+
+
+def main():
+    parser = argparse.ArgumentParser(description='卡片运行环境仓库')
+    sub = parser.add_subparsers(dest='command', required=True)
+    intern = sub.add_parser('intern', help='把卡片自带的 env/ 入库')
+    intern.add_argument('cards', nargs='*', help='卡片 ID，默认全部')
+    sub.add_parser('gc', help='删除没有卡片引用的 env 与对象')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    if args.command == 'intern':
+        cards = args.cards or sorted(e.name for e in os.scandir(Config.FUNCTIONS_DIR)
+                                     if e.is_dir() and not e.name.startswith('.'))
+        interned = 0
+        for card_id in cards:
+            digest = intern_env(os.path.join(Config.FUNCTIONS_DIR, card_id))
+            print(f'{card_id}: {digest or "无 env/ 或已入库"}')
+            interned += digest is not None
+        if interned and os.path.exists(Config.FUNCTION_CSV):
+            os.utime(Config.FUNCTION_CSV)
+    else:
+        envs, objects = gc()
+        print(f'删除 env {envs} 个，对象 {objects} 个')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
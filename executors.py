@@ -0,0 +1,325 @@
+"""
+执行后端：函数任务、批量任务的条目与流水线的步骤由执行器运行卡片。
+
+- LocalExecutor：在本机执行（冷启动 / 常驻 worker / 进程内，见 runner.py），即原有行为；
+- RemoteExecutor：分发到执行节点（worker_node.py）。输入文件以 tar 流随请求上传，节点执行期间以 JSON 行
+  回报进度与结果，输出再以 tar 流取回写入本机的任务目录；结果缓存、下载与清理仍在 Web 主机上完成。
+
+选择节点：只考虑已安装该卡片的节点（节点 /status 中的 cards），取
+(执行中 + 排队 + 本进程已派发未返回) / 槽位数 最低的节点，相同时取系统负载（loadavg / CPU 数）较低的；
+节点状态每 WORKER_NODE_REFRESH 秒刷新一次，连接失败的节点在下次刷新前不再选择。
+没有可用节点时，EXECUTOR_LOCAL_FALLBACK 为真则在本机执行，否则任务失败。
+
+函数任务、批量任务的条目与流水线的步骤都经由 get_executor() 执行。结果缓存键中的代码版本取自 Web 主机上的卡片，
+节点回报它实际执行的卡片版本，两者不一致（节点上的卡片未同步更新）时该结果不写入缓存。
+
+节点协议（HTTP，请求头 Authorization: Bearer <WORKER_NODE_TOKEN>）：
+    GET  /status                  {"name", "slots", "running", "queued", "load", "cpus", "cards": [卡片 ID, ...]}
+    POST /run/<卡片 ID>            请求体为输入文件的 tar 流（成员名 <序号>/<文件名>），请求头 Card-Outputs 为
+                                  输出文件名的 JSON 列表（inprocess 卡片为空），Card-Options 为卡片参数的
+                                  JSON 对象（可省略）；响应为 JSON 行：
+                                  若干 {"progress": "PROGRESS ..."} / {"heartbeat": true}，
+                                  最后一行 {"run": 运行 ID, "outputs": [文件名, ...], "version": 卡片代码版本}
+                                  或 {"error": ..., "info": ...}
+    GET  /runs/<运行 ID>/outputs    输出文件的 tar 流（成员名 <序号>/<文件名>），发送完毕后节点删除运行目录
+"""
+import http.client
+import json
+import logging
+import os
+import shutil
+import tarfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlsplit
+
+from config import Config
+from metrics import REMOTE_RUNS
+from progress import parse_progress
+from runner import CardFailed, run_card, run_inprocess
+
+logger = logging.getLogger(__name__)
+
+BLOCK = 512
+CHUNK_SIZE = 1024 * 1024
+# 查询节点状态的超时（秒）
+STATUS_TIMEOUT = 5
+
+
+# 一次执行的结果：输出文件路径列表；code_version 为实际执行的卡片代码版本，在本机执行时为 None（即本机的卡片）
+Run = namedtuple('Run', 'outputs code_version')
+
+
+class ExecutionFailed(CardFailed):
+    """远程执行失败；info 为结构化的失败原因（如节点上超出的资源限制）"""
+
+    def __init__(self, message, info=None):
+        super().__init__(message)
+        self.info = info
+
+
+class NodeUnavailable(Exception):
+    """节点连接失败或未安装卡片，可以换一个节点重试"""
+
+
+# ---------- tar 流 ----------
+class TarStream:
+    """把 [(成员名, 路径)] 按 tar 格式边读边发送，不落盘也不在内存中拼接；length 为总字节数"""
+
+    def __init__(self, members):
+        self.members = []
+        for name, path in members:
+            info = tarfile.TarInfo(name)
+            info.size = os.path.getsize(path)
+            info.mode = 0o644
+            info.mtime = int(time.time())
+            self.members.append((info.tobuf(format=tarfile.PAX_FORMAT), path, info.size))
+        self.length = sum(len(header) + -(-size // BLOCK) * BLOCK for header, _, size in self.members) + 2 * BLOCK
+
+    def __iter__(self):
+        for header, path, size in self.members:
+            yield header
+            with open(path, 'rb') as f:
+                while chunk := f.read(CHUNK_SIZE):
+                    yield chunk
+            if size % BLOCK:
+                yield b'\0' * (BLOCK - size % BLOCK)
+        yield b'\0' * (2 * BLOCK)
+
+
+def read_tar(fileobj, place):
+    """读取 tar 流，只接受普通文件；place(成员名) 返回写入路径。返回按顺序写入的路径列表"""
+    paths = []
+    with tarfile.open(fileobj=fileobj, mode='r|') as tf:
+        for member in tf:
+            if not member.isfile():
+                raise ValueError(f'tar 中含非普通文件: {member.name}')
+            path = place(member.name)
+            with tf.extractfile(member) as src, open(path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+            paths.append(path)
+    return paths
+
+
+def split_member(name):
+    """成员名 <序号>/<文件名> -> (序号, 安全的文件名)"""
+    index, _, filename = name.partition('/')
+    filename = os.path.basename(filename.replace('\\', '/'))
+    if not index.isdigit() or filename in ('', '.', '..'):
+        raise ValueError(f'非法的成员名: {name}')
+    return int(index), filename
+
+
+# ---------- 本机执行 ----------
+class LocalExecutor:
+    name = 'local'
+
+    def run(self, card, input_paths, output_paths, output_dir, on_progress=None, options=None):
+        """
+        执行一次卡片，返回 Run：subprocess 卡片写入 output_paths，
+        inprocess 卡片由 main() 写在 output_dir 下；options 为卡片参数 {名称: 取值}（见 limits.card_options）。
+        失败抛出 CardFailed，超出资源限制抛出 LimitExceeded。
+        """
+        if card['exec_mode'] == 'inprocess':
+            return Run(run_inprocess(card, input_paths, output_dir, on_progress, options), None)
+        result = run_card(card, input_paths, output_paths, on_progress, options)
+        if result.returncode != 0:
+            raise CardFailed(result.stderr)
+        return Run(output_paths, None)
+
+
+local_executor = LocalExecutor()
+
+
+# ---------- 远程执行 ----------
+def _connect(url, timeout):
+    parts = urlsplit(url)
+    cls = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    return cls(parts.hostname, parts.port, timeout=timeout), parts.path.rstrip('/')
+
+
+class NodeDirectory:
+    """执行节点的状态与本进程派发到各节点的未完成任务数"""
+
+    def __init__(self, urls, token, refresh):
+        self.urls = list(urls)
+        self.token = token
+        self.refresh_interval = refresh
+        self._status = {}
+        self._inflight = {url: 0 for url in self.urls}
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def headers(self):
+        return {'Authorization': f'Bearer {self.token}'}
+
+    def _fetch(self, url):
+        conn, prefix = _connect(url, STATUS_TIMEOUT)
+        try:
+            conn.request('GET', prefix + '/status', headers=self.headers())
+            response = conn.getresponse()
+            if response.status != 200:
+                logger.warning('执行节点 %s 状态查询失败: HTTP %d', url, response.status)
+                return None
+            return json.loads(response.read())
+        except (OSError, ValueError, http.client.HTTPException) as e:
+            logger.warning('执行节点 %s 不可用: %s', url, e)
+            return None
+        finally:
+            conn.close()
+
+    def refresh(self, force=False):
+        if not force and time.monotonic() - self._checked < self.refresh_interval:
+            return
+        with ThreadPoolExecutor(max(1, len(self.urls))) as pool:
+            status = dict(zip(self.urls, pool.map(self._fetch, self.urls)))
+        with self._lock:
+            self._status = status
+            self._checked = time.monotonic()
+
+    def choose(self, card_id, exclude=()):
+        """选出已安装该卡片、负载最低的节点并计入派发数；没有可用节点时返回 None"""
+        self.refresh()
+        with self._lock:
+            best, best_score = None, None
+            for url, status in self._status.items():
+                if status is None or url in exclude or card_id not in status.get('cards', ()):
+                    continue
+                busy = status.get('running', 0) + status.get('queued', 0) + self._inflight[url]
+                score = (busy / max(status.get('slots', 1), 1),
+                         status.get('load', 0) / max(status.get('cpus', 1), 1))
+                if best_score is None or score < best_score:
+                    best, best_score = url, score
+            if best is not None:
+                self._inflight[best] += 1
+            return best
+
+    def release(self, url):
+        with self._lock:
+            self._inflight[url] -= 1
+
+    def mark_down(self, url):
+        with self._lock:
+            self._status[url] = None
+
+
+class RemoteExecutor:
+    name = 'remote'
+
+    def __init__(self, urls, token, refresh, timeout, fallback):
+        self.nodes = NodeDirectory(urls, token, refresh)
+        self.timeout = timeout
+        self.fallback = fallback
+
+    def run(self, card, input_paths, output_paths, output_dir, on_progress=None, options=None):
+        tried = set()
+        while True:
+            node = self.nodes.choose(card['ID'], tried)
+            if node is None:
+                if self.fallback:
+                    logger.info('没有可执行卡片 %s 的节点，在本机执行', card['ID'])
+                    return local_executor.run(card, input_paths, output_paths, output_dir, on_progress, options)
+                raise ExecutionFailed(f'没有已安装卡片 {card["ID"]} 的可用执行节点')
+            tried.add(node)
+            try:
+                outputs = self._run_on(node, card, input_paths, output_paths, output_dir, on_progress, options)
+            except NodeUnavailable as e:
+                logger.warning('执行节点 %s 不可用，换一个节点: %s', node, e)
+                self.nodes.mark_down(node)
+                REMOTE_RUNS.inc(node=node, outcome='unavailable')
+                continue
+            except CardFailed:
+                REMOTE_RUNS.inc(node=node, outcome='error')
+                raise
+            finally:
+                self.nodes.release(node)
+            REMOTE_RUNS.inc(node=node, outcome='ok')
+            return outputs
+
+    def _run_on(self, node, card, input_paths, output_paths, output_dir, on_progress, options):
+        stream = TarStream([(f'{i}/{os.path.basename(p)}', p) for i, p in enumerate(input_paths)])
+        conn, prefix = _connect(node, self.timeout)
+        try:
+            # 节点读完整个请求体之后才开始执行，这之前的失败都可以换节点重试
+            try:
+                conn.putrequest('POST', f'{prefix}/run/{quote(card["ID"])}')
+                for key, value in self.nodes.headers().items():
+                    conn.putheader(key, value)
+                conn.putheader('Content-Type', 'application/x-tar')
+                conn.putheader('Card-Outputs', json.dumps([os.path.basename(p) for p in output_paths]))
+                if options:
+                    conn.putheader('Card-Options', json.dumps(options))
+                conn.putheader('Content-Length', str(stream.length))
+                conn.endheaders()
+                for chunk in stream:
+                    conn.send(chunk)
+                response = conn.getresponse()
+            except (OSError, http.client.HTTPException) as e:
+                raise NodeUnavailable(str(e))
+            if response.status == 404:
+                raise NodeUnavailable(f'节点未安装卡片 {card["ID"]}')
+            if response.status != 200:
+                raise ExecutionFailed(f'执行节点 {node} 返回 HTTP {response.status}: {response.read(4096)!r}')
+
+            final = None
+            try:
+                for line in response:
+                    message = json.loads(line)
+                    if 'progress' in message:
+                        parsed = parse_progress(message['progress'])
+                        if on_progress is not None and parsed is not None:
+                            on_progress(*parsed)
+                    elif 'heartbeat' not in message:
+                        final = message
+                        break
+            except (OSError, ValueError, http.client.HTTPException) as e:
+                raise ExecutionFailed(f'与执行节点 {node} 的连接中断: {e}')
+            if final is None:
+                raise ExecutionFailed(f'执行节点 {node} 未返回结果')
+            if 'error' in final:
+                raise ExecutionFailed(final['error'], final.get('info'))
+        finally:
+            conn.close()
+        return Run(self._fetch_outputs(node, final['run'], output_paths, output_dir), final.get('version', ''))
+
+    def _fetch_outputs(self, node, run_id, output_paths, output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+
+        def place(name):
+            index, filename = split_member(name)
+            if output_paths:
+                return output_paths[index]
+            return os.path.join(output_dir, filename)
+
+        conn, prefix = _connect(node, self.timeout)
+        try:
+            conn.request('GET', f'{prefix}/runs/{run_id}/outputs', headers=self.nodes.headers())
+            response = conn.getresponse()
+            if response.status != 200:
+                raise ExecutionFailed(f'从执行节点 {node} 取回输出失败: HTTP {response.status}')
+            return read_tar(response, place)
+        except (OSError, ValueError, IndexError, tarfile.TarError, http.client.HTTPException) as e:
+            raise ExecutionFailed(f'从执行节点 {node} 取回输出失败: {e}')
+        finally:
+            conn.close()
+
+
+# ---------- 选择执行器 ----------
+_remote = None
+_remote_lock = threading.Lock()
+
+
+def get_executor():
+    """按 Config.EXECUTOR 返回执行器（local / remote）"""
+    global _remote
+    if Config.EXECUTOR == 'local':
+        return local_executor
+    if Config.EXECUTOR != 'remote':
+        raise ValueError(f'未知的 EXECUTOR: {Config.EXECUTOR!r}')
+    with _remote_lock:
+        if _remote is None:
+            _remote = RemoteExecutor(Config.WORKER_NODES, Config.WORKER_NODE_TOKEN, Config.WORKER_NODE_REFRESH,
+                                     Config.WORKER_NODE_TIMEOUT, Config.EXECUTOR_LOCAL_FALLBACK)
+        return _remote
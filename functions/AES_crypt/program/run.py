@@ -1,15 +1,30 @@
+import argparse
+import hashlib
+import hmac
 import os
 import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import pad, unpad
 from Crypto.Random import get_random_bytes
-import base64
 
-def encrypt_file(input_file, key_file, output_file):
+# 每次读写的块大小，必须是 AES 分组长度（16 字节）的整数倍
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# 新格式文件头：魔数 + 版本 + 模式；旧格式（IV + CBC 密文）没有文件头
+MAGIC = b'AESX'
+VERSION = 2
+MODE_CTR = 1
+NONCE_SIZE = 8
+TAG_SIZE = 32
+
+
+def load_key(key_file):
     # 读取密钥文件
     with open(key_file, 'r') as f:
         key_content = f.read().strip()
-    
+
     # 确保密钥长度为16, 24或32字节(AES要求)
     key = key_content.encode('utf-8')
     if len(key) not in [16, 24, 32]:
@@ -18,83 +33,178 @@ def encrypt_file(input_file, key_file, output_file):
         h = SHA256.new()
         h.update(key)
         key = h.digest()[:32]  # 使用32字节密钥(AES-256)
-    
-    # 读取待加密文件
-    with open(input_file, 'rb') as f:
-        plaintext = f.read()
-    
+    return key
+
+
+def read_chunks(f, size=CHUNK_SIZE):
+    while chunk := f.read(size):
+        yield chunk
+
+
+# ---------- CBC（旧格式：IV + 密文，流式处理） ----------
+def encrypt_cbc(key, fin, fout):
     # 生成随机初始化向量(IV)
     iv = get_random_bytes(16)
-    
-    # 创建AES加密器
     cipher = AES.new(key, AES.MODE_CBC, iv)
-    
-    # 加密数据
-    ciphertext = cipher.encrypt(pad(plaintext, AES.block_size))
-    
-    # 将IV和密文一起保存
-    with open(output_file, 'wb') as f:
-        f.write(iv)
-        f.write(ciphertext)
-    
-    print(f"文件已加密并保存到: {output_file}")
+    fout.write(iv)
 
-def decrypt_file(input_file, key_file, output_file):
-    # 读取密钥文件
-    with open(key_file, 'r') as f:
-        key_content = f.read().strip()
-    
-    # 确保密钥长度为16, 24或32字节
-    key = key_content.encode('utf-8')
-    if len(key) not in [16, 24, 32]:
-        from Crypto.Hash import SHA256
-        h = SHA256.new()
-        h.update(key)
-        key = h.digest()[:32]
-    
-    # 读取加密文件
-    with open(input_file, 'rb') as f:
-        iv = f.read(16)  # 前16字节是IV
-        ciphertext = f.read()  # 剩余部分是密文
-    
-    # 创建AES解密器
+    # 只有最后一块需要 PKCS7 填充；f.read 只会在文件末尾返回不足一块的数据
+    pending = b''
+    for chunk in read_chunks(fin):
+        if pending:
+            fout.write(cipher.encrypt(pending))
+        pending = chunk
+    fout.write(cipher.encrypt(pad(pending, AES.block_size)))
+
+
+def decrypt_cbc(key, fin, fout):
+    iv = fin.read(16)  # 前16字节是IV
+    if len(iv) != 16:
+        raise ValueError('密文过短')
     cipher = AES.new(key, AES.MODE_CBC, iv)
-    
-    # 解密数据
+
+    # 留住最后一块，读到文件末尾后再去除填充
+    pending = b''
+    for chunk in read_chunks(fin):
+        if pending:
+            fout.write(cipher.decrypt(pending))
+        pending = chunk
+    if not pending or len(pending) % AES.block_size:
+        raise ValueError('密文长度不是分组长度的整数倍')
+    fout.write(unpad(cipher.decrypt(pending), AES.block_size))
+
+
+# ---------- CTR（新格式：可多核并行，附 HMAC-SHA256 校验） ----------
+def _ctr_keys(key):
+    enc_key = hmac.new(key, b'aesx-enc', hashlib.sha256).digest()[:len(key)]
+    mac_key = hmac.new(key, b'aesx-mac', hashlib.sha256).digest()
+    return enc_key, mac_key
+
+
+def _ctr_segment(enc_key, nonce, offset, data):
+    # CTR 的计数器可以从任意分组开始，因此各块互不依赖，可并行计算
+    cipher = AES.new(enc_key, AES.MODE_CTR, nonce=nonce,
+                     initial_value=offset // AES.block_size)
+    return cipher.encrypt(data)
+
+
+def _ctr_stream(enc_key, nonce, chunks, workers):
+    """按顺序产出各块的 CTR 结果；同时在途的块数有上限，内存占用与文件大小无关"""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        offset = 0
+        for chunk in chunks:
+            in_flight.append(pool.submit(_ctr_segment, enc_key, nonce, offset, chunk))
+            offset += len(chunk)
+            if len(in_flight) >= workers * 2:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def encrypt_ctr(key, fin, fout, workers):
+    enc_key, mac_key = _ctr_keys(key)
+    nonce = get_random_bytes(NONCE_SIZE)
+    header = MAGIC + bytes([VERSION, MODE_CTR]) + nonce
+    mac = hmac.new(mac_key, header, hashlib.sha256)
+    fout.write(header)
+    for data in _ctr_stream(enc_key, nonce, read_chunks(fin), workers):
+        mac.update(data)
+        fout.write(data)
+    fout.write(mac.digest())
+
+
+def decrypt_ctr(key, fin, fout, workers):
+    enc_key, mac_key = _ctr_keys(key)
+    header = fin.read(len(MAGIC) + 2 + NONCE_SIZE)
+    nonce = header[-NONCE_SIZE:]
+    mac = hmac.new(mac_key, header, hashlib.sha256)
+
+    # 末尾 TAG_SIZE 字节是校验值，不参与解密
+    body_size = os.fstat(fin.fileno()).st_size - len(header) - TAG_SIZE
+    if body_size < 0:
+        raise ValueError('密文过短')
+
+    def body():
+        remaining = body_size
+        while remaining:
+            chunk = fin.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ValueError('密文被截断')
+            remaining -= len(chunk)
+            mac.update(chunk)
+            yield chunk
+
+    for data in _ctr_stream(enc_key, nonce, body(), workers):
+        fout.write(data)
+    if not hmac.compare_digest(mac.digest(), fin.read(TAG_SIZE)):
+        raise ValueError('校验失败')
+
+
+def has_header(input_file):
+    with open(input_file, 'rb') as f:
+        head = f.read(len(MAGIC) + 2)
+    return head[:len(MAGIC)] == MAGIC and head[len(MAGIC):] == bytes([VERSION, MODE_CTR])
+
+
+def encrypt_file(input_file, key_file, output_file, mode='cbc', workers=None):
+    key = load_key(key_file)
+    with open(input_file, 'rb') as fin, open(output_file, 'wb') as fout:
+        if mode == 'ctr':
+            encrypt_ctr(key, fin, fout, workers or os.cpu_count() or 1)
+        else:
+            encrypt_cbc(key, fin, fout)
+
+    print(f"文件已加密并保存到: {output_file}")
+
+def decrypt_file(input_file, key_file, output_file, workers=None):
+    key = load_key(key_file)
     try:
-        decrypted_data = unpad(cipher.decrypt(ciphertext), AES.block_size)
-        
-        # 保存解密后的文件
-        with open(output_file, 'wb') as f:
-            f.write(decrypted_data)
-        
+        with open(input_file, 'rb') as fin, open(output_file, 'wb') as fout:
+            # 根据文件头区分新旧格式
+            if has_header(input_file):
+                decrypt_ctr(key, fin, fout, workers or os.cpu_count() or 1)
+            else:
+                decrypt_cbc(key, fin, fout)
+
         print(f"文件已解密并保存到: {output_file}")
+        return True
     except ValueError:
+        # 流式解密可能已写出部分明文，失败时删除
+        if os.path.exists(output_file):
+            os.remove(output_file)
         print("解密失败: 可能是密钥不正确或文件已损坏")
+        return False
 
 def main():
-    if len(sys.argv) != 4:
-        print("用法: python run.py <输入文件> <密钥文件> <输出文件>")
-        sys.exit(1)
-    
-    input_file = sys.argv[1]
-    key_file = sys.argv[2]
-    output_file = sys.argv[3]
-    
+    parser = argparse.ArgumentParser(description="AES 文件加解密（以 .enc 结尾或带 AESX 文件头的输入做解密）")
+    parser.add_argument("input_file", help="输入文件")
+    parser.add_argument("key_file", help="密钥文件")
+    parser.add_argument("output_file", help="输出文件")
+    parser.add_argument("--mode", choices=["cbc", "ctr"], default=os.environ.get("AES_MODE", "cbc"),
+                        help="加密模式：cbc 与旧版格式兼容（默认）；ctr 可多核并行，带完整性校验")
+    parser.add_argument("--workers", type=int, default=None, help="ctr 模式的并行线程数，默认等于 CPU 核数")
+    args = parser.parse_args()
+
+    input_file = args.input_file
+    key_file = args.key_file
+    output_file = args.output_file
+
     # 检查文件是否存在
     if not os.path.exists(input_file):
         print(f"错误: 输入文件 '{input_file}' 不存在")
         sys.exit(1)
-    
+
     if not os.path.exists(key_file):
         print(f"错误: 密钥文件 '{key_file}' 不存在")
         sys.exit(1)
-    
-    # 根据文件扩展名判断是加密还是解密
-    if input_file.endswith('.enc'):
-        decrypt_file(input_file, key_file, output_file)
+
+    # 根据文件扩展名或文件头判断是加密还是解密
+    if input_file.endswith('.enc') or has_header(input_file):
+        if not decrypt_file(input_file, key_file, output_file, args.workers):
+            sys.exit(1)
     else:
-        encrypt_file(input_file, key_file, output_file)
+        encrypt_file(input_file, key_file, output_file, args.mode, args.workers)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,123 +1,274 @@
 import argparse
 import hashlib
+import json
+import mmap
 import os
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-def calculate_hashes(file_path):
+# 默认计算的哈希算法（与旧版报告保持一致）
+DEFAULT_ALGORITHMS = ["md5", "sha1", "sha256"]
+
+# 报告中的显示名称
+LABELS = {
+    "md5": "MD5:   ",
+    "sha1": "SHA-1: ",
+    "sha256": "SHA-256:",
+}
+
+# 每次交给 hashlib 的数据量；hashlib 处理大块数据时会释放 GIL，各摘要线程可真正并行
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# 进度输出的最小间隔（秒）
+PROGRESS_INTERVAL = 0.5
+
+# 进程内调用 main(input_files, output_dir) 时生成的报告文件名
+REPORT_NAME = "hash_report.txt"
+
+# 平台以该环境变量启动时，进度以 "PROGRESS <百分比>" 行输出（供平台实时转发给浏览器）
+PROGRESS_ENV = "CARD_PROGRESS"
+
+# 平台上传仓库写在输入文件旁的摘要旁注（<文件>.digests），上传时已顺带算出
+DIGEST_SUFFIX = ".digests"
+
+
+def new_hasher(name):
+    """创建哈希对象；blake3 需要额外安装 blake3 包"""
+    if name == "blake3":
+        try:
+            import blake3
+        except ImportError:
+            sys.exit("错误: 使用 blake3 需要先安装 blake3 包")
+        return blake3.blake3()
+    if name not in hashlib.algorithms_available:
+        sys.exit(f"错误: 不支持的哈希算法 '{name}'")
+    return hashlib.new(name)
+
+
+class Progress:
     """
-    计算文件的三种哈希值（MD5, SHA-1, SHA-256）
-    使用分块读取处理大文件
-    返回包含文件信息和哈希值的字典
+    汇总所有摘要线程的处理量，限频报告进度：
+    有回调（进程内执行）时调用 callback(百分比, 说明)，由平台启动时输出进度行，否则在控制台显示
     """
-    if not os.path.exists(file_path):
-        sys.exit(f"错误: 文件 '{file_path}' 不存在")
-    
+
+    def __init__(self, total_bytes, callback=None):
+        self.total = total_bytes
+        self.done = 0
+        self.lock = threading.Lock()
+        self.last = 0.0
+        self.callback = callback
+        self.protocol = bool(os.environ.get(PROGRESS_ENV))
+
+    def advance(self, n):
+        with self.lock:
+            self.done += n
+            now = time.monotonic()
+            if self.total > 1024 * 1024 and now - self.last >= PROGRESS_INTERVAL:
+                self.last = now
+                percent = self.done / self.total * 100
+                if self.callback is not None:
+                    self.callback(percent, "计算摘要")
+                elif self.protocol:
+                    sys.stdout.write(f"PROGRESS {percent:.1f} 计算摘要\n")
+                else:
+                    sys.stdout.write(f"\r进度: [{percent:.1f}%]")
+                sys.stdout.flush()
+
+
+def known_digests(file_path):
+    """读取文件旁的摘要旁注；旁注记录的大小与 mtime 与文件不符（文件已被改动）时不采用"""
+    try:
+        with open(file_path + DIGEST_SUFFIX, encoding="utf-8") as f:
+            note = json.load(f)
+        st = os.stat(file_path)
+        if note["size"] == st.st_size and note["mtime_ns"] == st.st_mtime_ns:
+            return dict(note["digests"])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return {}
+
+
+def digest_file(file_path, name, progress=None):
+    """用一个线程对整个文件计算一种摘要；文件通过 mmap 读取，多个摘要共享同一份页缓存"""
+    hasher = new_hasher(name)
+    if os.path.getsize(file_path) == 0:
+        return hasher.hexdigest()
+    with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        # 切片必须及时 release，否则 mmap 关闭时会报 exported pointers exist
+        with memoryview(mm) as view:
+            for offset in range(0, len(view), CHUNK_SIZE):
+                with view[offset:offset + CHUNK_SIZE] as chunk:
+                    hasher.update(chunk)
+                    if progress is not None:
+                        progress.advance(len(chunk))
+    return hasher.hexdigest()
+
+
+def calculate_hashes_many(file_paths, algorithms=DEFAULT_ALGORITHMS, workers=None, quiet=False, progress=None):
+    """
+    并行计算多个文件的多种哈希值：每个 (文件, 算法) 组合一个任务
+    返回与 file_paths 顺序一致的结果字典列表；quiet 为真时不输出进度，progress 为进度回调
+    """
+    for file_path in file_paths:
+        if not os.path.exists(file_path):
+            sys.exit(f"错误: 文件 '{file_path}' 不存在")
+    # 提前校验算法名，避免在工作线程中才报错
+    for name in algorithms:
+        new_hasher(name)
+
+    # 旁注中已有的 (文件, 算法) 直接采用，只计算其余的组合
+    digests = {}
+    for file_path in file_paths:
+        known = known_digests(file_path)
+        for name in algorithms:
+            if name in known:
+                digests[(file_path, name)] = known[name]
+    pending = [(file_path, name) for file_path in file_paths for name in algorithms
+               if (file_path, name) not in digests]
+
+    total = sum(os.path.getsize(p) for p, _ in pending)
+    callback = progress
+    progress = Progress(total, callback) if callback is not None or not quiet else None
+    if total > 1024 * 1024 and not quiet:
+        names = ", ".join(os.path.basename(p) for p in file_paths)
+        print(f"正在处理 {names} ({total / len(algorithms) / 1024 / 1024:.2f} MB)...")
+
+    workers = workers or min(32, max(1, len(pending)))
     try:
-        # 获取文件基本信息
-        file_size = os.path.getsize(file_path)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                (file_path, name): pool.submit(digest_file, file_path, name, progress)
+                for file_path, name in pending
+            }
+            digests.update({key: future.result() for key, future in futures.items()})
+    except PermissionError as e:
+        sys.exit(f"错误: 没有权限读取文件 '{e.filename}'")
+    except Exception as e:
+        sys.exit(f"处理文件时出错: {str(e)}")
+
+    # 完成进度条显示
+    if total > 1024 * 1024 and not quiet and not progress.protocol:
+        print("\r", end="")
+
+    results = []
+    for file_path in file_paths:
         mod_time = datetime.fromtimestamp(os.path.getmtime(file_path))
-        
-        # 初始化哈希对象
-        hash_md5 = hashlib.md5()
-        hash_sha1 = hashlib.sha1()
-        hash_sha256 = hashlib.sha256()
-        
-        # 读取文件并更新哈希
-        with open(file_path, "rb") as f:
-            # 显示进度提示（处理大文件时）
-            if file_size > 1024 * 1024:  # >1MB文件显示进度
-                print(f"正在处理 {os.path.basename(file_path)} ({file_size/1024/1024:.2f} MB)...")
-            
-            # 分块读取（10MB/块）
-            chunk_size = 10 * 1024 * 1024
-            bytes_processed = 0
-            
-            while chunk := f.read(chunk_size):
-                hash_md5.update(chunk)
-                hash_sha1.update(chunk)
-                hash_sha256.update(chunk)
-                bytes_processed += len(chunk)
-                
-                # 显示进度条（仅当文件大于1MB时）
-                if file_size > 1024 * 1024:
-                    percent = bytes_processed / file_size * 100
-                    sys.stdout.write(f"\r进度: [{percent:.1f}%]")
-                    sys.stdout.flush()
-        
-        # 完成进度条显示
-        if file_size > 1024 * 1024:
-            print("\r", end="")
-        
-        return {
+        data = {
             "file_name": os.path.basename(file_path),
             "file_path": os.path.abspath(file_path),
-            "file_size": file_size,
+            "file_size": os.path.getsize(file_path),
             "last_modified": mod_time.strftime("%Y-%m-%d %H:%M:%S"),
-            "md5": hash_md5.hexdigest(),
-            "sha1": hash_sha1.hexdigest(),
-            "sha256": hash_sha256.hexdigest()
+            "algorithms": list(algorithms),
         }
-    
-    except PermissionError:
-        sys.exit(f"错误: 没有权限读取文件 '{file_path}'")
-    except Exception as e:
-        sys.exit(f"处理文件时出错: {str(e)}")
+        for name in algorithms:
+            data[name] = digests[(file_path, name)]
+        results.append(data)
+    return results
 
-def save_results_to_file(data, output_path):
-    """将哈希结果保存到指定文件"""
+
+def calculate_hashes(file_path, algorithms=DEFAULT_ALGORITHMS):
+    """
+    计算单个文件的哈希值（默认 MD5, SHA-1, SHA-256）
+    返回包含文件信息和哈希值的字典
+    """
+    return calculate_hashes_many([file_path], algorithms)[0]
+
+
+def format_digests(data):
+    return [f"{LABELS.get(name, name.upper() + ':')} {data[name]}" for name in data["algorithms"]]
+
+
+def save_results_to_file(results, output_path, quiet=False, portable=False):
+    """
+    将哈希结果保存到指定文件
+    portable 为真时报告只由输入文件名与内容决定（不含生成时间、完整路径与修改时间），
+    服务端据此可以安全地复用缓存的报告
+    """
+    if isinstance(results, dict):
+        results = [results]
     try:
         # 确保输出目录存在
         output_dir = os.path.dirname(output_path)
         if output_dir and not os.path.exists(output_dir):
             os.makedirs(output_dir, exist_ok=True)
-            
+
         with open(output_path, "w") as f:
             f.write(f"文件哈希校验报告\n")
-            f.write(f"生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+            if not portable:
+                f.write(f"生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
             f.write("-" * 60 + "\n")
-            f.write(f"文件名: {data['file_name']}\n")
-            f.write(f"完整路径: {data['file_path']}\n")
-            f.write(f"文件大小: {data['file_size']:,} 字节\n")
-            f.write(f"最后修改: {data['last_modified']}\n")
-            f.write("-" * 60 + "\n")
-            f.write(f"MD5:    {data['md5']}\n")
-            f.write(f"SHA-1:  {data['sha1']}\n")
-            f.write(f"SHA-256: {data['sha256']}\n")
-            f.write("-" * 60 + "\n")
-        
-        print(f"\n结果已保存到: {os.path.abspath(output_path)}")
-    
+            for data in results:
+                f.write(f"文件名: {data['file_name']}\n")
+                if not portable:
+                    f.write(f"完整路径: {data['file_path']}\n")
+                f.write(f"文件大小: {data['file_size']:,} 字节\n")
+                if not portable:
+                    f.write(f"最后修改: {data['last_modified']}\n")
+                f.write("-" * 60 + "\n")
+                for line in format_digests(data):
+                    f.write(line + "\n")
+                f.write("-" * 60 + "\n")
+
+        if not quiet:
+            print(f"\n结果已保存到: {os.path.abspath(output_path)}")
+
     except Exception as e:
         sys.exit(f"写入输出文件时出错: {str(e)}")
 
-def main():
+def parse_algorithms(value):
+    return [a.strip().lower() for a in value.split(",") if a.strip()]
+
+
+def main(input_files=None, output_dir=None, progress=None, algorithms=None):
+    """
+    两种调用方式：
+    - 命令行：python run.py 输入文件... 输出文件 [--algorithms ...]
+    - 进程内：main(input_files, output_dir, progress=回调, algorithms="md5,sha256") -> [报告路径]，
+      不输出到控制台（exec_mode=inprocess）；报告不含生成时间与服务器路径，可被结果缓存复用。
+      algorithms 即 card.json 中声明的卡片参数，平台页面与 API 以 option_algorithms 字段提交
+    """
+    if input_files is not None:
+        chosen = parse_algorithms(algorithms) if algorithms else DEFAULT_ALGORITHMS
+        results = calculate_hashes_many(input_files, chosen, quiet=True, progress=progress)
+        output_path = os.path.join(output_dir, REPORT_NAME)
+        save_results_to_file(results, output_path, quiet=True, portable=True)
+        return [output_path]
+
     # 设置命令行参数解析器
     parser = argparse.ArgumentParser(
-        description="计算文件的三种哈希值（MD5、SHA-1、SHA-256）并保存结果",
+        description="计算文件的哈希值（默认 MD5、SHA-1、SHA-256）并保存结果",
         formatter_class=argparse.RawTextHelpFormatter
     )
-    
-    # 使用两个位置参数（输入文件和输出文件）
-    parser.add_argument("input_file", help="要计算哈希值的文件路径")
+
+    # 位置参数：一个或多个输入文件，最后一个为输出文件
+    parser.add_argument("input_files", nargs="+", help="要计算哈希值的文件路径（可多个，并行计算）")
     parser.add_argument("output_file", help="保存哈希结果的输出文件路径")
-    
+    parser.add_argument("--algorithms", default=",".join(DEFAULT_ALGORITHMS),
+                        help="逗号分隔的算法列表，如 sha256 或 md5,sha256,blake2b（blake3 需安装 blake3 包）")
+    parser.add_argument("--workers", type=int, default=None, help="并行线程数，默认每个 (文件, 算法) 一个线程")
+
     args = parser.parse_args()
-    
+    algorithms = parse_algorithms(args.algorithms)
+    if not algorithms:
+        parser.error("至少需要一种哈希算法")
+
     # 计算哈希值
-    file_data = calculate_hashes(args.input_file)
-    
+    results = calculate_hashes_many(args.input_files, algorithms, args.workers)
+
     # 在控制台显示结果
     print("\n文件哈希计算结果:")
-    print(f"文件名:    {file_data['file_name']}")
-    print(f"大小:      {file_data['file_size']:,} 字节")
-    print(f"最后修改:  {file_data['last_modified']}")
-    print(f"MD5:      {file_data['md5']}")
-    print(f"SHA-1:    {file_data['sha1']}")
-    print(f"SHA-256:  {file_data['sha256']}")
-    
+    for file_data in results:
+        print(f"文件名:    {file_data['file_name']}")
+        print(f"大小:      {file_data['file_size']:,} 字节")
+        print(f"最后修改:  {file_data['last_modified']}")
+        for line in format_digests(file_data):
+            print(line)
+
     # 保存结果到文件
-    save_results_to_file(file_data, args.output_file)
+    save_results_to_file(results, args.output_file)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,27 @@
+"""
+gunicorn 配置：gunicorn -c gunicorn.conf.py app:app
+
+preload_app 时 master 只导入一次应用（Flask / SQLAlchemy 与注册表等在 fork 后由各 worker 共享内存页），
+建表 / 补列也只在 master 中执行一次；worker 因 max_requests 回收重启时不再重复这些工作。
+后台线程不能跨 fork 存活，由 post_worker_init 在每个 worker 中启动。
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+# 大文件的上传 / 下载请求可能持续较久
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 300))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+preload_app = True
+
+
+def post_worker_init(worker):
+    from app import app, start_background
+    from models import db
+    with app.app_context():
+        # master 建表时打开的连接不能在多个进程间共用，丢弃而不关闭（关闭会影响 master 持有的同一连接）
+        db.engine.dispose(close=False)
+    start_background(app)
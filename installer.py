@@ -0,0 +1,224 @@
+"""
+管理员安装服务卡片（后台任务 kind='install'）。
+
+卡片 zip 中带着整个 env/ 虚拟环境，动辄数百 MB、上千个文件，不在请求中同步解压：
+1. 请求中只校验表单与 zip 目录结构，zip 保存到任务目录后入队；
+2. 任务把 zip 多线程解压到 functions/.staging-<ID>-<任务 ID>/（与 functions/ 在同一文件系统）；
+3. env/ 放入 envstore（相同文件 / 相同锁文件的 env 与已有卡片共享），
+   再用卡片的 env 冷启动执行一次 program/run.py（冒烟测试），记录冷启动耗时；
+4. 通过后把暂存目录整体 rename 为 functions/<ID>，再向 function.csv 追加一行，卡片随即出现在菜单上。
+任一步失败只删除暂存目录，不会留下半成品的 functions/<ID>。
+
+冒烟测试的输入可在卡片的 card.json 中指定（路径相对卡片目录）：
+    {"smoke_test": {"inputs": ["samples/plain.txt", "samples/key.txt"]}}
+未指定时为每个输入生成一个小文本文件。
+"""
+import csv
+import json
+import logging
+import os
+import shutil
+import stat
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import PurePosixPath
+
+from config import Config
+from envstore import intern_env
+from jobs import JobFailed, job_handler
+from limits import MANIFEST_NAME, LimitExceeded, card_limits
+from metrics import INSTALL_SECONDS
+from registry import function_registry
+from runner import card_paths, run_cold
+
+logger = logging.getLogger(__name__)
+
+STAGING_PREFIX = '.staging-'
+REPORT_NAME = 'install.json'
+SMOKE_INPUT = b'data_process smoke test\n'
+CHUNK_SIZE = 1024 * 1024
+
+_csv_lock = threading.Lock()
+
+
+# ---------- 校验 ----------
+def check_archive(zf):
+    """检查卡片 zip 的目录结构，返回错误信息；合法时返回 None"""
+    names = zf.namelist()
+    if not any('env/' in s for s in names) or 'program/run.py' not in names:
+        return 'zip 内必须包含 env/ 目录与 program/run.py'
+    for name in names:
+        if name.startswith('/') or '..' in PurePosixPath(name).parts:
+            return f'zip 内含非法路径: {name}'
+    return None
+
+
+# ---------- 解压 ----------
+def _extract_one(zf, info, target):
+    path = os.path.join(target, info.filename)
+    mode = info.external_attr >> 16
+    if stat.S_ISLNK(mode):
+        # 虚拟环境中的 python3 通常是指向系统解释器的符号链接
+        os.symlink(zf.read(info).decode('utf-8'), path)
+        return
+    with zf.open(info) as src, open(path, 'wb') as dst:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    if mode & 0o777:
+        os.chmod(path, mode & 0o777)        # 保留 env/bin 下的可执行权限
+
+
+def _extract_group(zip_path, infos, target):
+    with zipfile.ZipFile(zip_path) as zf:
+        for info in infos:
+            _extract_one(zf, info, target)
+
+
+def extract_parallel(zip_path, target, workers):
+    """
+    先建好全部目录，再按解压后大小把文件均分给多个线程；
+    每个线程各自打开 zip，zlib 解压时释放 GIL。返回 (文件数, 解压后字节数)。
+    """
+    with zipfile.ZipFile(zip_path) as zf:
+        infos = zf.infolist()
+    files = []
+    for info in infos:
+        path = os.path.join(target, info.filename)
+        if info.is_dir():
+            os.makedirs(path, exist_ok=True)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            files.append(info)
+
+    # 大文件优先，依次分给当前负载最小的线程
+    groups = [[] for _ in range(max(1, workers))]
+    loads = [0] * len(groups)
+    for info in sorted(files, key=lambda i: i.file_size, reverse=True):
+        k = loads.index(min(loads))
+        groups[k].append(info)
+        loads[k] += info.file_size
+    with ThreadPoolExecutor(max_workers=len(groups)) as pool:
+        for future in [pool.submit(_extract_group, zip_path, group, target) for group in groups if group]:
+            future.result()
+    return len(files), sum(loads)
+
+
+# ---------- 冒烟测试 ----------
+def _smoke_inputs(card_dir, input_count, work_dir):
+    try:
+        with open(os.path.join(card_dir, MANIFEST_NAME), encoding='utf-8') as f:
+            spec = json.load(f).get('smoke_test') or {}
+    except FileNotFoundError:
+        spec = {}
+    except (OSError, ValueError, AttributeError) as e:
+        raise JobFailed(f'无法解析 {MANIFEST_NAME}: {e}')
+    inputs = [os.path.join(card_dir, p) for p in spec.get('inputs') or []]
+    if inputs:
+        if len(inputs) != input_count:
+            raise JobFailed(f'smoke_test.inputs 有 {len(inputs)} 个文件，卡片需要 {input_count} 个输入')
+        return inputs
+    for i in range(input_count):
+        path = os.path.join(work_dir, f'smoke_input_{i}.txt')
+        with open(path, 'wb') as f:
+            f.write(SMOKE_INPUT)
+        inputs.append(path)
+    return inputs
+
+
+def smoke_test(card_id, card_dir, input_count, output_count, work_dir):
+    """用卡片自己的解释器冷启动执行一次 run.py，返回 (耗时秒数, CompletedProcess)；失败抛出 JobFailed"""
+    python_exec, script_path = card_paths(card_id, card_dir)
+    limits = card_limits(card_id, card_dir)
+    limits['timeout'] = min(limits['timeout'] or Config.CARD_SMOKE_TIMEOUT, Config.CARD_SMOKE_TIMEOUT)
+    smoke_dir = os.path.join(work_dir, 'smoke')
+    os.makedirs(smoke_dir, exist_ok=True)
+    argv = (_smoke_inputs(card_dir, input_count, smoke_dir)
+            + [os.path.join(smoke_dir, f'output_{i}.bin') for i in range(output_count)])
+
+    start = time.perf_counter()
+    try:
+        result, _ = run_cold(python_exec, script_path, argv, limits)
+    except LimitExceeded as e:
+        raise JobFailed(f'冒烟测试失败: {e}', e.to_dict())
+    except OSError as e:
+        raise JobFailed(f'冒烟测试无法启动 {python_exec}: {e}')
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise JobFailed(f'冒烟测试失败（退出码 {result.returncode}）: {result.stderr}')
+    return elapsed, result
+
+
+# ---------- 启用 ----------
+def csv_row(fields):
+    """表单字段 -> function.csv 的一行"""
+    as_list = lambda values: str(values).replace("'", '"')
+    return [
+        fields['id'], fields['name'],
+        as_list(fields['input_list']),
+        as_list(fields['output_list']),
+        fields['description'],
+        as_list(fields['input_desc']),
+        as_list(fields['output_desc']),
+        fields['workers'],
+        fields['cacheable'],
+        fields['exec_mode'],
+    ]
+
+
+def append_card(fields):
+    with _csv_lock, open(Config.FUNCTION_CSV, 'a', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerow(csv_row(fields))
+    function_registry.invalidate()
+
+
+@job_handler('install')
+def run_install_job(job):
+    params = json.loads(job.input_paths)
+    fields, zip_path = params['fields'], params['zip']
+    card_id = job.function_id
+    func_dir = os.path.join(Config.FUNCTIONS_DIR, card_id)
+    if os.path.exists(func_dir) or card_id in function_registry:
+        raise JobFailed(f'卡片 {card_id} 已存在')
+
+    staging = os.path.join(Config.FUNCTIONS_DIR, f'{STAGING_PREFIX}{card_id}-{job.id}')
+    shutil.rmtree(staging, ignore_errors=True)          # 进程中断后重新排队时清掉上次的残留
+    try:
+        try:
+            with zipfile.ZipFile(zip_path) as zf:
+                error = check_archive(zf)
+            if error:
+                raise JobFailed(error)
+            with INSTALL_SECONDS.time(stage='extract'):
+                files, size = extract_parallel(zip_path, staging, Config.CARD_INSTALL_WORKERS)
+        except (OSError, zipfile.BadZipFile) as e:
+            raise JobFailed(f'解压失败: {e}')
+
+        with INSTALL_SECONDS.time(stage='intern'):
+            env = intern_env(staging)
+        with INSTALL_SECONDS.time(stage='smoke_test'):
+            cold_start, result = smoke_test(card_id, staging, len(fields['input_list']),
+                                            len(fields['output_list']), job.temp_dir)
+        report = {
+            'card': card_id,
+            'installed_at': datetime.now().isoformat(timespec='seconds'),
+            'files': files,
+            'bytes': size,
+            'env': env,
+            'cold_start_seconds': round(cold_start, 3),
+            'smoke_test_stdout': result.stdout[-4096:],
+        }
+        with open(os.path.join(staging, REPORT_NAME), 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+        if os.path.exists(func_dir):
+            raise JobFailed(f'卡片 {card_id} 已存在')
+        os.rename(staging, func_dir)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    append_card(fields)
+    os.remove(zip_path)
+    logger.info('卡片 %s 安装完成：%d 个文件，%d 字节，冷启动 %.2f 秒', card_id, files, size, cold_start)
+    job.output_paths = json.dumps([os.path.join(func_dir, REPORT_NAME)])
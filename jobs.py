@@ -0,0 +1,367 @@
+"""
+异步任务调度：任务持久化在 instance/site.db 的 job 表中，
+各进程的调度线程以条件 UPDATE 原子地认领排队中的任务，
+从而在多个 gunicorn worker 之间共享全局 / 单卡片 / 单用户并发上限，并在重启后继续执行。
+上限按执行槽位计：每个执行中的任务占一个槽位，批量任务并行执行的条目另外申请槽位（job.slots）。
+
+调度顺序（加权公平队列 + 短作业优先）：
+1. 按用户当前占用的执行槽位 / 角色权重，占用相对最少的用户先得到槽位；
+2. 同等份额时优先级高（角色）的先执行；
+3. 再按输入大小从小到大，排队越久比较用的大小越小（老化），大任务不会一直被插队；
+4. 最后按入队时间。
+
+执行进程每 JOB_HEARTBEAT_INTERVAL 秒为自己执行中的任务更新心跳（job.heartbeat_at）；
+心跳超过 JOB_HEARTBEAT_TIMEOUT 秒没有更新的任务由任一进程放回队列，
+不依赖 host:pid（容器重建后主机名改变、pid 被复用时也能回收）。
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import aliased
+
+from models import db, Job
+from registry import function_registry
+from result_cache import result_cache
+from config import Config
+from executors import get_executor
+from metrics import JOBS, JOBS_IN_FLIGHT, QUEUE_DEPTH, QUEUE_WAIT_SECONDS
+from limits import LimitExceeded
+from progress import ProgressReporter
+from runner import CardFailed
+from usercache import user_cache
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class JobFailed(Exception):
+    """任务执行失败，消息写入 job.error，结构化信息（如超出的资源限制）写入 job.error_info"""
+
+    def __init__(self, message, info=None):
+        super().__init__(message)
+        self.info = info
+
+
+# job.kind -> 执行函数(job)；函数正常返回即任务完成，抛出 JobFailed 即失败
+HANDLERS = {}
+
+
+def job_handler(kind):
+    def decorator(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return decorator
+
+
+def card_for(job):
+    card = function_registry.get(job.function_id)
+    if card is None:
+        raise JobFailed(f'卡片 {job.function_id} 不存在')
+    return card
+
+
+@job_handler('function')
+def run_function_job(job):
+    card = card_for(job)
+    progress = ProgressReporter(job.id)
+    # inprocess 卡片的输出文件由 main() 决定，写在任务目录的 outputs/ 下
+    try:
+        run = get_executor().run(card, json.loads(job.input_paths), json.loads(job.output_paths),
+                                 os.path.join(job.temp_dir, 'outputs'), progress, job_options(job))
+    except LimitExceeded as e:
+        raise JobFailed(str(e), e.to_dict())
+    except CardFailed as e:
+        raise JobFailed(str(e), getattr(e, 'info', None))
+    job.output_paths = json.dumps(run.outputs)
+    # 缓存键按本机的卡片版本计算；执行节点上的卡片版本不同时不缓存
+    if job.cache_key and run.code_version in (None, result_cache.code_version(card['ID'])):
+        result_cache.store(job.cache_key, run.outputs)
+    progress.finish()
+
+
+def job_options(job):
+    return json.loads(job.options) if job.options else None
+
+
+def priority_for(user_id):
+    """提交者角色对应的优先级"""
+    if user_id is None:
+        return Config.JOB_ANONYMOUS_PRIORITY
+    user = user_cache.get(user_id)
+    role = user.role if user is not None else None
+    return Config.JOB_ROLE_PRIORITY.get(role, Config.JOB_DEFAULT_PRIORITY)
+
+
+def weight_of(priority):
+    return Config.JOB_PRIORITY_WEIGHTS.get(priority or 0, 1)
+
+
+def sjf_size(job, now):
+    """短作业优先比较用的输入大小：排队每满 JOB_AGING_SECONDS 秒减半"""
+    waited = (now - job.created_at).total_seconds()
+    return job.input_bytes / 2 ** (waited / Config.JOB_AGING_SECONDS)
+
+
+def fair_order(queued, running_per_user, limit, max_per_user=0):
+    """
+    从排队任务中按加权公平 + 短作业优先挑出最多 limit 个候选；
+    running_per_user 为各用户执行中的任务数，挑中后计入该用户的占用，已达单用户上限的用户不再挑选。
+    """
+    now = datetime.now()
+    load = dict(running_per_user)
+    pending = list(queued)
+    order = []
+    while pending and len(order) < limit:
+        eligible = [job for job in pending
+                    if not max_per_user or load.get(job.user_id, 0) < max_per_user]
+        if not eligible:
+            break
+        best = min(eligible, key=lambda job: (load.get(job.user_id, 0) / weight_of(job.priority),
+                                              -(job.priority or 0), sjf_size(job, now), job.created_at))
+        pending.remove(best)
+        order.append(best)
+        load[best.user_id] = load.get(best.user_id, 0) + 1
+    return order
+
+
+def owner_id():
+    # fork 之后 pid 会变化，因此每次现取
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobScheduler:
+    """本地任务调度器：全局并发与单卡片并发均有上限"""
+
+    def __init__(self):
+        self.app = None
+        self.max_jobs = 4
+        self.max_per_card = 2
+        self.max_per_user = 2
+        self.poll_interval = 2
+        self.heartbeat_interval = 10
+        self._pool = None
+        self._running = 0
+        self._active = set()        # 本进程执行中的任务 ID，心跳只更新这些任务
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._started = False
+
+    def init_app(self, app):
+        self.app = app
+        self.max_jobs = app.config['JOB_MAX_CONCURRENCY']
+        self.max_per_card = app.config['JOB_MAX_PER_CARD']
+        self.max_per_user = app.config['JOB_MAX_PER_USER']
+        self.poll_interval = app.config['JOB_POLL_INTERVAL']
+        self.heartbeat_interval = app.config['JOB_HEARTBEAT_INTERVAL']
+        app.extensions['job_scheduler'] = self
+        QUEUE_DEPTH.set_function(lambda: Job.query.filter_by(status=QUEUED).count())
+        JOBS_IN_FLIGHT.set_function(lambda: Job.query.filter_by(status=RUNNING).count())
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        with self.app.app_context():
+            self.recover()
+        self._pool = ThreadPoolExecutor(self.max_jobs, thread_name_prefix='job')
+        threading.Thread(target=self._loop, name='job-scheduler', daemon=True).start()
+
+    # ---------- 入队 ----------
+    def submit(self, job):
+        job.status = QUEUED
+        job.created_at = job.created_at or datetime.now()
+        if job.priority is None:
+            job.priority = priority_for(job.user_id)
+        db.session.add(job)
+        db.session.commit()
+        self._wakeup.set()
+        return job
+
+    def record_done(self, job):
+        """记录无需执行、已经完成的任务（如命中结果缓存），与执行完成的任务一样查询状态与下载结果"""
+        now = datetime.now()
+        job.status = DONE
+        job.created_at = job.created_at or now
+        job.started_at = job.finished_at = now
+        if job.priority is None:
+            job.priority = priority_for(job.user_id)
+        db.session.add(job)
+        db.session.commit()
+        JOBS.inc(function_id=job.function_id, kind=job.kind, outcome=DONE)
+        return job
+
+    def heartbeat(self):
+        """为本进程执行中的任务更新心跳；任务已被放回队列、由其他进程认领时不更新"""
+        with self._lock:
+            active = list(self._active)
+        if not active:
+            return
+        db.session.execute(
+            update(Job)
+            .where(Job.id.in_(active), Job.status == RUNNING, Job.owner == owner_id())
+            .values(heartbeat_at=datetime.now())
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+    def recover(self):
+        """
+        把失去执行进程的 running 任务重新放回队列：心跳超过 JOB_HEARTBEAT_TIMEOUT 秒没有更新，
+        或执行进程在本机上且已经退出（不必等心跳超时）。
+        条件 UPDATE 同时检查心跳 / owner，刚被其他进程重新认领的任务不会被放回队列
+        """
+        cutoff = datetime.now() - timedelta(seconds=Config.JOB_HEARTBEAT_TIMEOUT)
+        host = socket.gethostname()
+        dead = []
+        for (owner,) in db.session.query(Job.owner).filter(Job.status == RUNNING).distinct():
+            job_host, _, pid = (owner or '').rpartition(':')
+            if job_host == host and pid.isdigit() and not pid_alive(int(pid)):
+                dead.append(owner)
+        result = db.session.execute(
+            update(Job)
+            .where(Job.status == RUNNING,
+                   db.or_(func.coalesce(Job.heartbeat_at, Job.started_at) < cutoff, Job.owner.in_(dead)))
+            .values(status=QUEUED, owner=None, started_at=None, slots=None, heartbeat_at=None)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        if result.rowcount:
+            logger.info('重新排队 %d 个中断的任务', result.rowcount)
+        return result.rowcount
+
+    # ---------- 调度 ----------
+    def _loop(self):
+        last_beat = time.monotonic()
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            try:
+                with self.app.app_context():
+                    if time.monotonic() - last_beat >= self.heartbeat_interval:
+                        last_beat = time.monotonic()
+                        self.heartbeat()
+                        self.recover()
+                    self._dispatch()
+            except Exception:
+                logger.exception('任务调度出错')
+
+    def _capacity(self, function_id, user_id):
+        """全局 / 单卡片 / 单用户占用的执行槽位（running 任务的 slots 之和）都未满的条件"""
+        running = aliased(Job)
+        used = func.coalesce(func.sum(func.coalesce(running.slots, 1)), 0)
+        total = select(used).where(running.status == RUNNING).scalar_subquery()
+        per_card = select(used).where(
+            running.status == RUNNING, running.function_id == function_id).scalar_subquery()
+        conditions = [total < self.max_jobs, per_card < self.max_per_card]
+        if self.max_per_user:
+            per_user = select(used).where(
+                running.status == RUNNING, running.user_id.is_(user_id) if user_id is None
+                else running.user_id == user_id).scalar_subquery()
+            conditions.append(per_user < self.max_per_user)
+        return conditions
+
+    def _claim(self, job):
+        """原子地认领任务；全局 / 单卡片 / 单用户的执行槽位已满时认领失败"""
+        now = datetime.now()
+        result = db.session.execute(
+            update(Job)
+            .where(Job.id == job.id, Job.status == QUEUED, *self._capacity(job.function_id, job.user_id))
+            .values(status=RUNNING, owner=owner_id(), started_at=now, heartbeat_at=now, slots=1)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return result.rowcount == 1
+
+    def acquire_slot(self, job):
+        """
+        执行中的任务再占用一个执行槽位（批量任务并行执行的条目），与认领任务受同样的上限约束；
+        槽位已满时返回 False。用完后以 release_slots 归还，任务结束后不再计入占用
+        """
+        result = db.session.execute(
+            update(Job)
+            .where(Job.id == job.id, Job.status == RUNNING, *self._capacity(job.function_id, job.user_id))
+            .values(slots=func.coalesce(Job.slots, 1) + 1)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        return result.rowcount == 1
+
+    def release_slots(self, job, count=1):
+        if count <= 0:
+            return
+        db.session.execute(
+            update(Job)
+            .where(Job.id == job.id)
+            .values(slots=func.coalesce(Job.slots, 1) - count)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+    def _dispatch(self):
+        with self._lock:
+            free = self.max_jobs - self._running
+        if free <= 0:
+            return
+        queued = (Job.query.filter_by(status=QUEUED)
+                  .order_by(Job.created_at).limit(Config.JOB_SCHED_WINDOW).all())
+        running = dict(db.session.query(Job.user_id, func.sum(func.coalesce(Job.slots, 1)))
+                       .filter(Job.status == RUNNING).group_by(Job.user_id).all())
+        for job in fair_order(queued, running, free * 4, self.max_per_user):
+            if free <= 0:
+                break
+            job_id, kind, priority, created_at = job.id, job.kind, job.priority or 0, job.created_at
+            if not self._claim(job):
+                continue
+            with self._lock:
+                self._running += 1
+                self._active.add(job_id)
+            free -= 1
+            QUEUE_WAIT_SECONDS.observe((datetime.now() - created_at).total_seconds(),
+                                       kind=kind, priority=priority)
+            self._pool.submit(self._execute, job_id)
+
+    def _execute(self, job_id):
+        try:
+            with self.app.app_context():
+                job = db.session.get(Job, job_id)
+                try:
+                    HANDLERS[job.kind](job)
+                    job.status = DONE
+                except JobFailed as e:
+                    job.status = FAILED
+                    job.error = str(e)
+                    job.error_info = json.dumps(e.info, ensure_ascii=False) if e.info else None
+                except Exception as e:
+                    logger.exception('任务 %s 执行失败', job_id)
+                    job.status = FAILED
+                    job.error = str(e)
+                job.finished_at = datetime.now()
+                db.session.commit()
+                JOBS.inc(function_id=job.function_id, kind=job.kind, outcome=job.status)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._active.discard(job_id)
+            self._wakeup.set()
+
+
+job_scheduler = JobScheduler()
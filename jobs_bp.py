@@ -0,0 +1,127 @@
+import json
+import threading
+import time
+
+from flask import Blueprint, Response, current_app, render_template, jsonify, abort, url_for, stream_with_context
+from flask_login import current_user
+
+from models import db, Job
+from batch import archive_names
+from jobs import DONE, FAILED
+from transfer import send_outputs
+from sweeper import delete_after_send
+
+bp = Blueprint('jobs', __name__, url_prefix='/jobs')
+
+# 本进程中正在保持的事件流数
+_streams = 0
+_streams_lock = threading.Lock()
+
+
+# ---------- 工具 ----------
+def get_job_or_404(job_id):
+    """取任务；属于其他用户的任务对非管理员不可见"""
+    job = db.session.get(Job, job_id)
+    if job is None:
+        abort(404)
+    if job.user_id is not None:
+        if not current_user.is_authenticated:
+            abort(404)
+        if current_user.id != job.user_id and current_user.role != 'admin':
+            abort(404)
+    return job
+
+
+def job_status(job):
+    data = job.to_dict()
+    data['status_url'] = url_for('jobs.status', job_id=job.id)
+    data['events_url'] = url_for('jobs.events', job_id=job.id)
+    if job.status == DONE and job.purged_at is None:
+        data['result_url'] = url_for('jobs.result', job_id=job.id)
+    return data
+
+
+# ---------- 路由 ----------
+@bp.route('/<job_id>')
+def page(job_id):
+    job = get_job_or_404(job_id)
+    return render_template('job.html', job=job_status(job))
+
+
+@bp.route('/<job_id>/status')
+def status(job_id):
+    return jsonify(job_status(get_job_or_404(job_id)))
+
+
+@bp.route('/<job_id>/events')
+def events(job_id):
+    """
+    Server-Sent Events：状态或进度变化时发送 progress 事件，任务结束时发送 done 事件后关闭；
+    无变化时每 JOB_EVENTS_KEEPALIVE 秒发送一行注释，避免代理断开空闲连接。
+    进度由执行任务的进程限频写入数据库，任何 worker 处理该请求都能看到。
+
+    每个事件流占用一个 worker 线程：保持 JOB_EVENTS_MAX_SECONDS 秒后关闭，由浏览器按 retry 重连；
+    本进程的事件流达到 JOB_EVENTS_MAX_STREAMS 个时返回 503，页面改为轮询 /jobs/<id>/status。
+    """
+    global _streams
+    get_job_or_404(job_id)
+    poll = current_app.config['JOB_EVENTS_POLL']
+    keepalive = current_app.config['JOB_EVENTS_KEEPALIVE']
+    deadline = time.monotonic() + current_app.config['JOB_EVENTS_MAX_SECONDS']
+
+    with _streams_lock:
+        if _streams >= current_app.config['JOB_EVENTS_MAX_STREAMS']:
+            return jsonify({'error': '事件流已满，请轮询任务状态', 'status_url': url_for('jobs.status', job_id=job_id)}), 503
+        _streams += 1
+
+    def closed():
+        global _streams
+        with _streams_lock:
+            _streams -= 1
+
+    def message(event, data):
+        return f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+    def stream():
+        yield 'retry: 3000\n\n'
+        last, idle = None, 0.0
+        while time.monotonic() < deadline:
+            job = db.session.get(Job, job_id, populate_existing=True)
+            if job is None:
+                return
+            if job.status in (DONE, FAILED):
+                yield message('done', job_status(job))
+                return
+            state = (job.status, job.progress, job.progress_message)
+            if state != last:
+                yield message('progress', job_status(job))
+                last, idle = state, 0.0
+            elif idle >= keepalive:
+                yield ': keepalive\n\n'
+                idle = 0.0
+            db.session.rollback()           # 等待期间不占用数据库连接
+            time.sleep(poll)
+            idle += poll
+
+    response = Response(stream_with_context(stream()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'      # nginx 不缓冲，事件立即送达
+    response.call_on_close(closed)
+    return response
+
+
+@bp.route('/<job_id>/result')
+def result(job_id):
+    job = get_job_or_404(job_id)
+    if job.status != DONE:
+        return jsonify(job_status(job)), 409
+    if job.purged_at is not None:
+        # 结果已下载过或已过期被清理
+        return jsonify(job_status(job)), 410
+
+    output_paths = json.loads(job.output_paths)
+    if job.kind == 'batch':
+        response = send_outputs(output_paths, job.function_id, archive_names(job, output_paths), always_zip=True)
+    else:
+        response = send_outputs(output_paths, job.function_id)
+    return delete_after_send(response, job)
@@ -0,0 +1,251 @@
+"""
+卡片执行的资源限制：墙钟超时、RLIMIT_AS / RLIMIT_CPU、nice 值、stdout/stderr 保留上限。
+
+默认值取自 Config.RUN_*，单张卡片可在 functions/<ID>/card.json 中覆盖：
+    {"limits": {"timeout": 600, "max_memory": 2147483648, "max_cpu": 300,
+                "nice": 10, "max_output": 65536}}
+取值 0 表示不限制（nice 为 0 表示不调整优先级）。
+
+card.json 中还可以声明卡片的可选参数（见 card_options），由页面表单 / API 以 option_<名称> 字段提交：
+    {"options": {"algorithms": {"label": "哈希算法", "pattern": "[a-z0-9_]+(,[a-z0-9_]+)*"}}}
+"""
+import collections
+import json
+import logging
+import os
+import re
+import signal
+import threading
+
+try:
+    import resource
+except ImportError:          # Windows
+    resource = None
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'card.json'
+# 超时后先 SIGTERM，等待该秒数后仍未退出则 SIGKILL
+KILL_GRACE = 2
+
+MESSAGES = {
+    'timeout': '运行超过 {} 秒，已终止',
+    'max_cpu': 'CPU 时间超过 {} 秒，已终止',
+    'max_memory': '内存超过 {} 字节上限',
+}
+
+
+class LimitExceeded(Exception):
+    """卡片运行超出资源限制；进程组已被终止"""
+
+    def __init__(self, limit, value, result=None):
+        self.limit = limit
+        self.value = value
+        self.result = result        # subprocess.CompletedProcess（输出已截断）
+        super().__init__(MESSAGES[limit].format(value))
+
+    def to_dict(self):
+        return {
+            'type': 'limit_exceeded',
+            'limit': self.limit,
+            'value': self.value,
+            'returncode': self.result.returncode if self.result else None,
+            'stderr': self.result.stderr if self.result else '',
+        }
+
+
+# ---------- 读取限制 ----------
+def default_limits():
+    return {
+        'timeout': Config.RUN_TIMEOUT,
+        'max_memory': Config.RUN_MAX_MEMORY,
+        'max_cpu': Config.RUN_MAX_CPU,
+        'nice': Config.RUN_NICE,
+        'max_output': Config.RUN_MAX_OUTPUT,
+    }
+
+
+_manifests = {}         # card.json 路径 -> (mtime_ns, {'limits': 覆盖项, 'options': 可选参数})
+_manifests_lock = threading.Lock()
+
+
+def _read_overrides(raw):
+    defaults = default_limits()
+    raw = raw.get('limits') or {}
+    return {key: float(raw[key]) if key == 'timeout' else int(raw[key])
+            for key in defaults if raw.get(key) is not None}
+
+
+def _read_options(raw):
+    options = {}
+    for name, spec in (raw.get('options') or {}).items():
+        if not re.fullmatch(r'[a-z][a-z0-9_]*', name):
+            raise ValueError(f'非法的参数名: {name!r}')
+        pattern = spec.get('pattern') or '.*'
+        re.compile(pattern)
+        options[name] = {'label': str(spec.get('label') or name), 'pattern': pattern}
+    return options
+
+
+def _read_manifest(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            raw = json.load(f)
+        return {'limits': _read_overrides(raw), 'options': _read_options(raw)}
+    except (OSError, ValueError, TypeError, AttributeError, re.error) as e:
+        logger.warning('忽略无法解析的 %s: %s', path, e)
+        return {'limits': {}, 'options': {}}
+
+
+def _manifest(card_id, card_dir=None):
+    """card.json 的解析结果，修改后自动重新读取；card_dir 默认为 functions/{ID}（安装时传入暂存目录）"""
+    path = os.path.join(card_dir or os.path.join(Config.FUNCTIONS_DIR, card_id), MANIFEST_NAME)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return {'limits': {}, 'options': {}}
+    with _manifests_lock:
+        hit = _manifests.get(path)
+        if hit is None or hit[0] != mtime:
+            hit = (mtime, _read_manifest(path))
+            _manifests[path] = hit
+    return hit[1]
+
+
+def card_limits(card_id, card_dir=None):
+    """返回卡片生效的限制（默认值 + card.json 覆盖项）"""
+    limits = default_limits()
+    limits.update(_manifest(card_id, card_dir)['limits'])
+    return limits
+
+
+def card_options(card_id):
+    """
+    卡片声明的可选参数 {名称: {'label': 说明, 'pattern': 取值须完整匹配的正则}}。
+    提交的取值以 --<名称> <取值> 追加在 run.py 的命令行参数之后，进程内卡片作为 main() 的同名关键字参数传入
+    """
+    return _manifest(card_id)['options']
+
+
+def check_options(card_id, values):
+    """校验提交的卡片参数 {名称: 取值}：忽略空值，未声明的参数或取值不匹配时抛出 ValueError"""
+    if not isinstance(values, dict):
+        raise ValueError('卡片参数应为 JSON 对象')
+    declared = card_options(card_id)
+    options = {}
+    for name, value in values.items():
+        value = str(value).strip()
+        if not value:
+            continue
+        spec = declared.get(name)
+        if spec is None:
+            raise ValueError(f'卡片 {card_id} 没有参数 {name}')
+        if not re.fullmatch(spec['pattern'], value):
+            raise ValueError(f'参数 {spec["label"]} 的取值不合法: {value!r}')
+        options[name] = value
+    return options
+
+
+# ---------- 施加限制 ----------
+def apply_limits(pid, limits, cpu=True):
+    """
+    对刚启动的子进程设置 nice 与 rlimit。
+    Linux 上通过 prlimit 从父进程设置，避免在多线程进程中使用 preexec_fn；
+    常驻 worker 的 CPU 上限按任务计算，由 card_worker 自己设置（cpu=False）。
+    """
+    try:
+        if limits['nice'] and hasattr(os, 'setpriority'):
+            current = os.getpriority(os.PRIO_PROCESS, pid)
+            os.setpriority(os.PRIO_PROCESS, pid, min(current + limits['nice'], 19))
+        if resource is None or not hasattr(resource, 'prlimit'):
+            return
+        if limits['max_memory']:
+            resource.prlimit(pid, resource.RLIMIT_AS, (limits['max_memory'], limits['max_memory']))
+        if cpu and limits['max_cpu']:
+            # 软限制到期收到 SIGXCPU；留出余量后硬限制直接 SIGKILL
+            resource.prlimit(pid, resource.RLIMIT_CPU, (limits['max_cpu'], limits['max_cpu'] + KILL_GRACE))
+    except ProcessLookupError:
+        pass            # 子进程已经退出
+    except OSError as e:
+        logger.warning('设置进程 %s 的资源限制失败: %s', pid, e)
+
+
+def _signal_group(proc, sig):
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(proc.pid, sig)        # 子进程以 start_new_session 启动，pgid == pid
+        else:
+            proc.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+class Watchdog:
+    """墙钟超时看门狗：到期后终止子进程所在的整个进程组（先 SIGTERM，再 SIGKILL）"""
+
+    def __init__(self, proc, timeout):
+        self.proc = proc
+        self.timeout = timeout
+        self.fired = False
+        self._done = threading.Event()
+
+    def _watch(self):
+        if self._done.wait(self.timeout):
+            return
+        self.fired = True
+        logger.warning('进程 %s 运行超过 %s 秒，终止进程组', self.proc.pid, self.timeout)
+        _signal_group(self.proc, signal.SIGTERM)
+        if not self._done.wait(KILL_GRACE):
+            _signal_group(self.proc, getattr(signal, 'SIGKILL', signal.SIGTERM))
+
+    def __enter__(self):
+        if self.timeout:
+            threading.Thread(target=self._watch, name='watchdog', daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._done.set()
+
+
+def classify(result, limits):
+    """根据退出状态判断进程是否因 CPU / 内存限制而失败，返回 LimitExceeded 或 None"""
+    sigxcpu = getattr(signal, 'SIGXCPU', None)
+    if limits['max_cpu'] and sigxcpu and result.returncode in (-sigxcpu, -signal.SIGKILL):
+        return LimitExceeded('max_cpu', limits['max_cpu'], result)
+    if limits['max_memory'] and result.returncode != 0 and 'MemoryError' in (result.stderr or ''):
+        return LimitExceeded('max_memory', limits['max_memory'], result)
+    return None
+
+
+# ---------- 输出截断 ----------
+class TailBuffer:
+    """环形输出缓冲：只保留最后 limit 字节（limit 为 0 时不截断）"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.size = 0
+        self.dropped = 0
+        self._chunks = collections.deque()
+
+    def write(self, data):
+        self._chunks.append(data)
+        self.size += len(data)
+        while self.limit and self.size > self.limit:
+            excess = self.size - self.limit
+            head = self._chunks[0]
+            if len(head) <= excess:
+                self._chunks.popleft()
+                cut = len(head)
+            else:
+                self._chunks[0] = head[excess:]
+                cut = excess
+            self.size -= cut
+            self.dropped += cut
+
+    def text(self, encoding='utf-8'):
+        data = b''.join(self._chunks).decode(encoding, errors='replace')
+        if self.dropped:
+            data = f'[已截断前 {self.dropped} 字节]\n' + data
+        return data
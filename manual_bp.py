@@ -0,0 +1,28 @@
+from flask import Blueprint, abort, send_file
+
+from config import Config
+from pages import file_version, manual_files, page_cache, render_manual_index, render_markdown
+
+bp = Blueprint('manual', __name__, url_prefix='/manual')
+
+
+@bp.route('/')
+def index():
+    files = manual_files()
+    return page_cache.respond('manual:', tuple(sorted(files)),
+                              lambda: render_manual_index(files))
+
+
+@bp.route('/<path:name>')
+def manual(name):
+    """markdown 手册渲染为 HTML 后缓存；PDF 由 send_file 处理 ETag / Range"""
+    path = manual_files().get(name)
+    if path is None:
+        abort(404)
+    if not path.endswith('.md'):
+        return send_file(path, conditional=True, max_age=Config.PAGE_MAX_AGE)
+
+    def render():
+        with open(path, encoding='utf-8') as f:
+            return render_markdown(f.read(), name)
+    return page_cache.respond(f'manual:{name}', file_version(path), render)
@@ -0,0 +1,378 @@
+"""
+指标，输出 Prometheus 文本格式（由 /admin/metrics 暴露）。
+
+gunicorn 多 worker 时各进程在内存中计数，每 METRICS_FLUSH_INTERVAL 秒（及退出时）把快照写入
+METRICS_DIR/<主机>-<pid>-<随机串>.json；抓取时汇总目录下所有进程的快照，任何一个 worker 返回的都是全局值：
+- 计数器与直方图按进程相加；已退出进程的快照并入 archive.json 后删除，重启 worker 不会让计数回退；
+- 以 set() 设置的 Gauge 只汇总仍在运行的进程；以 set_function() 设置的 Gauge（队列深度、执行中任务数）
+  在抓取时直接查询数据库，本身就是全局值。
+未调用 init_app（如执行节点、命令行工具）时只统计本进程。
+"""
+import atexit
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:         # Windows：只有进程内的锁
+    fcntl = None
+
+ARCHIVE_NAME = 'archive.json'
+
+
+# 秒级耗时的默认分桶
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+# 字节数分桶（子进程峰值内存）
+BYTE_BUCKETS = tuple(2 ** n * 1024 * 1024 for n in range(0, 15))   # 1 MB .. 16 GB
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    body = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                    for k, v in pairs)
+    return '{' + body + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name, doc, labelnames=()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} 需要标签 {self.labelnames}')
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _samples(self, values=None):
+        raise NotImplementedError
+
+    # ---------- 多进程汇总 ----------
+    def dump(self):
+        """本进程的取值，JSON 可序列化：[[标签值列表, 数值], ...]"""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def load(self, value):
+        return value
+
+    def combine(self, a, b):
+        return a + b
+
+    def reset(self):
+        """fork 出的子进程清空从父进程继承的取值（父进程自己的快照另行汇总）"""
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def render(self, values=None):
+        lines = [f'# HELP {self.name} {self.doc}', f'# TYPE {self.name} {self.kind}']
+        for suffix, labels, extra, value in self._samples(values):
+            lines.append(f'{self.name}{suffix}{_format_labels(self.labelnames, labels, extra)} '
+                         f'{_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self, values=None):
+        if values is None:
+            with self._lock:
+                values = dict(self._values)
+        return [('', key, (), value) for key, value in sorted(values.items())]
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, doc, labelnames=()):
+        super().__init__(name, doc, labelnames)
+        self._callback = None
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, fn):
+        """抓取时调用 fn()，返回 {标签值元组: 数值}；无标签时可直接返回数值"""
+        self._callback = fn
+
+    def dump(self):
+        # 抓取时现查的值不需要跨进程汇总
+        return [] if self._callback is not None else super().dump()
+
+    def _samples(self, values=None):
+        if self._callback is not None:
+            values = self._callback()
+            if not isinstance(values, dict):
+                values = {(): values}
+        elif values is None:
+            with self._lock:
+                values = dict(self._values)
+        return [('', key, (), value) for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, doc, labelnames=(), buckets=TIME_BUCKETS):
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """计时；指标带 outcome 标签而调用方未给出时，按代码块是否抛出异常记为 ok / error"""
+        start = time.perf_counter()
+        outcome = 'ok'
+        try:
+            yield
+        except BaseException:
+            outcome = 'error'
+            raise
+        finally:
+            if 'outcome' in self.labelnames and 'outcome' not in labels:
+                labels = dict(labels, outcome=outcome)
+            self.observe(time.perf_counter() - start, **labels)
+
+    def load(self, value):
+        counts, total = value
+        return list(counts), total
+
+    def combine(self, a, b):
+        if len(a[0]) != len(b[0]):     # 分桶在两次部署之间改变过：保留较新的一份
+            return b
+        return [x + y for x, y in zip(a[0], b[0])], a[1] + b[1]
+
+    def _samples(self, values=None):
+        samples = []
+        if values is None:
+            with self._lock:
+                values = dict(self._values)
+        items = sorted((key, (list(counts), total)) for key, (counts, total) in values.items())
+        for key, (counts, total) in items:
+            for bound, count in zip(self.buckets, counts):
+                samples.append(('_bucket', key, (('le', _format_value(bound)),), count))
+            samples.append(('_sum', key, (), total))
+            samples.append(('_count', key, (), counts[-1]))
+        return samples
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = []
+        self.directory = None
+        self.flush_interval = 5
+        self._file = None
+        self._written = None
+        self._flusher_pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.directory = app.config['METRICS_DIR']
+        self.flush_interval = app.config['METRICS_FLUSH_INTERVAL']
+        os.makedirs(self.directory, exist_ok=True)
+        self._new_file()
+        atexit.register(self.flush)
+        app.extensions['metrics'] = self
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    # ---------- 快照文件 ----------
+    def _new_file(self):
+        self._file = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}.json'
+        self._written = None
+
+    def after_fork(self):
+        for metric in self._metrics:
+            metric.reset()
+        self._lock = threading.Lock()
+        self._flusher_pid = None
+        if self.directory is not None:
+            self._new_file()
+
+    def start(self):
+        """在当前进程中启动定期写快照的线程（重复调用无副作用）"""
+        with self._lock:
+            if self.directory is None or self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def flush(self):
+        """把本进程的取值写入快照文件；与上次写入相同时跳过"""
+        if self.directory is None:
+            return
+        data = json.dumps({m.name: m.dump() for m in self._metrics}, ensure_ascii=False).encode('utf-8')
+        with self._lock:
+            if data == self._written:
+                return
+            path = os.path.join(self.directory, self._file)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+            self._written = data
+
+    @contextmanager
+    def _dir_lock(self):
+        with open(os.path.join(self.directory, '.lock'), 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _alive(filename):
+        host, pid, _ = filename[:-len('.json')].rsplit('-', 2)
+        if host != socket.gethostname():
+            return True         # 其他主机上的进程无法判断，按仍在运行处理
+        return pid.isdigit() and _pid_alive(int(pid))
+
+    def _merge(self, merged, data, gauges=True):
+        by_name = {m.name: m for m in self._metrics}
+        for name, items in (data or {}).items():
+            metric = by_name.get(name)
+            if metric is None or (isinstance(metric, Gauge) and not gauges):
+                continue
+            values = merged.setdefault(name, {})
+            for key, value in items:
+                key, value = tuple(key), metric.load(value)
+                values[key] = metric.combine(values[key], value) if key in values else value
+
+    def collect(self):
+        """汇总所有进程的快照：{指标名: {标签值元组: 数值}}；已退出进程的快照并入 archive.json"""
+        self.flush()
+        archive_path = os.path.join(self.directory, ARCHIVE_NAME)
+        with self._dir_lock():
+            archive = {}
+            self._merge(archive, self._read(archive_path), gauges=False)
+            merged = {}
+            self._merge(merged, self._read(archive_path), gauges=False)
+            dead = []
+            for entry in os.scandir(self.directory):
+                if not entry.name.endswith('.json') or entry.name == ARCHIVE_NAME:
+                    continue
+                data = self._read(entry.path)
+                alive = self._alive(entry.name)
+                self._merge(merged, data, gauges=alive)
+                if not alive:
+                    self._merge(archive, data, gauges=False)
+                    dead.append(entry.path)
+            if dead:
+                by_name = {m.name: m for m in self._metrics}
+                dump = {name: [[list(k), v] for k, v in values.items()]
+                        for name, values in archive.items() if name in by_name}
+                with open(archive_path + '.tmp', 'w', encoding='utf-8') as f:
+                    json.dump(dump, f, ensure_ascii=False)
+                os.replace(archive_path + '.tmp', archive_path)
+                for path in dead:
+                    os.remove(path)
+        return merged
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self):
+        if self.directory is None:
+            return '\n'.join(m.render() for m in self._metrics) + '\n'
+        merged = self.collect()
+        return '\n'.join(m.render(merged.get(m.name, {})) for m in self._metrics) + '\n'
+
+
+registry = Registry()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=registry.after_fork)
+
+# ---------- 任务流水线各阶段 ----------
+UPLOAD_SECONDS = registry.histogram(
+    'dp_upload_save_seconds', '上传内容写入临时目录耗时', ['function_id', 'outcome'])
+TEMPDIR_SECONDS = registry.histogram(
+    'dp_tempdir_setup_seconds', '创建任务临时目录耗时', ['function_id', 'outcome'])
+RUN_WALL_SECONDS = registry.histogram(
+    'dp_run_wall_seconds', '卡片执行墙钟时间', ['function_id', 'outcome'])
+RUN_CPU_SECONDS = registry.histogram(
+    'dp_run_cpu_seconds', '卡片执行 CPU 时间（用户态+内核态）', ['function_id', 'outcome'])
+RUN_MAX_RSS_BYTES = registry.histogram(
+    'dp_run_max_rss_bytes', '执行卡片的子进程峰值内存', ['function_id', 'outcome'], buckets=BYTE_BUCKETS)
+ZIP_SECONDS = registry.histogram(
+    'dp_zip_packaging_seconds', '多输出结果打包耗时（读取与压缩，不含等待客户端接收；outcome=aborted 为客户端中途断开）',
+    ['function_id', 'outcome'])
+SEND_SECONDS = registry.histogram(
+    'dp_send_seconds', '结果发送耗时（从开始响应到连接关闭；outcome=aborted 为流式 zip 未发送完）',
+    ['function_id', 'outcome'])
+INSTALL_SECONDS = registry.histogram(
+    'dp_card_install_seconds', '管理员安装卡片各阶段耗时（extract 解压 / intern env 入库 / smoke_test 冷启动试运行）', ['stage'])
+JOBS = registry.counter(
+    'dp_jobs_total', '已结束的任务数', ['function_id', 'kind', 'outcome'])
+REMOTE_RUNS = registry.counter(
+    'dp_remote_runs_total', '分发到执行节点的卡片执行（ok / error / unavailable 换节点重试）', ['node', 'outcome'])
+
+# ---------- 队列 ----------
+QUEUE_WAIT_SECONDS = registry.histogram(
+    'dp_job_queue_wait_seconds', '任务从入队到开始执行的等待时间', ['kind', 'priority'])
+QUEUE_DEPTH = registry.gauge('dp_job_queue_depth', '排队中的任务数（全局）')
+JOBS_IN_FLIGHT = registry.gauge('dp_jobs_in_flight', '执行中的任务数（全局）')
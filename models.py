@@ -1,4 +1,9 @@
+import json
+import sqlite3
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import Engine
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 
@@ -15,5 +20,126 @@ class User(UserMixin, db.Model):
     def check_password(self, pwd):
         return check_password_hash(self.password_hash, pwd)
 
+class ApiToken(db.Model):
+    """脚本客户端的 API token；只保存 SHA-256，明文只在签发时返回一次"""
+    id         = db.Column(db.Integer, primary_key=True)
+    user_id    = db.Column(db.Integer, nullable=False, index=True)
+    name       = db.Column(db.String(64))
+    token_hash = db.Column(db.String(64), unique=True, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+class UploadBlob(db.Model):
+    """上传仓库中的一份内容（按 SHA-256 寻址）；refcount 为引用它的上传句柄数，归零时删除"""
+    sha256     = db.Column(db.String(64), primary_key=True)
+    size       = db.Column(db.BigInteger, nullable=False)
+    digests    = db.Column(db.Text)                                 # JSON，上传时顺带算出的各摘要
+    refcount   = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+class UploadSession(db.Model):
+    """可续传的分块上传；完成后 sha256 指向 UploadBlob，本身即作为上传句柄提交任务"""
+    id         = db.Column(db.String(32), primary_key=True)
+    user_id    = db.Column(db.Integer, index=True)
+    filename   = db.Column(db.String(255), nullable=False)
+    size       = db.Column(db.BigInteger, nullable=False)
+    received   = db.Column(db.BigInteger, nullable=False, default=0)
+    sha256     = db.Column(db.String(64), index=True)               # 上传完成后才有值
+    created_at = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'size': self.size,
+            'offset': self.received,
+            'complete': self.sha256 is not None,
+            'sha256': self.sha256,
+        }
+
+class QuotaReservation(db.Model):
+    """上传进行中预留的用户配额，请求结束时删除；同一用户的并发上传各自预留，不会一起越过配额"""
+    id         = db.Column(db.String(32), primary_key=True)
+    user_id    = db.Column(db.Integer, nullable=False, index=True)
+    size       = db.Column(db.BigInteger, nullable=False)
+    owner      = db.Column(db.String(128))                          # 预留的进程 host:pid
+    created_at = db.Column(db.DateTime, nullable=False)
+
 class InvCode (db.Model) :
-    invcode = db.Column( primary_key=True )
\ No newline at end of file
+    invcode = db.Column(db.String(64), primary_key=True)
+
+class Job(db.Model):
+    """异步任务：POST /function/<id> 只负责落盘与入队，由 jobs.JobScheduler 执行"""
+    id           = db.Column(db.String(32), primary_key=True)      # 同时是 tmp_uploads 下的目录名
+    kind         = db.Column(db.String(16), nullable=False, default='function')
+    function_id  = db.Column(db.String(64), nullable=False, index=True)
+    user_id      = db.Column(db.Integer, index=True)
+    status       = db.Column(db.String(16), nullable=False, default='queued', index=True)
+    temp_dir     = db.Column(db.String(512), nullable=False)
+    input_paths  = db.Column(db.Text, nullable=False)               # JSON 列表
+    output_paths = db.Column(db.Text, nullable=False)               # JSON 列表
+    input_bytes  = db.Column(db.BigInteger, nullable=False, default=0)
+    priority     = db.Column(db.Integer, default=0)                 # 提交者角色对应的优先级，见 Config.JOB_ROLE_PRIORITY
+    cache_key    = db.Column(db.String(64))                         # 可缓存卡片的结果缓存键
+    options      = db.Column(db.Text)                               # JSON，提交的卡片参数（见 limits.card_options）
+    disk_bytes   = db.Column(db.BigInteger)                         # 任务目录实际占用，由清扫线程更新
+    owner        = db.Column(db.String(128))                        # 执行进程 host:pid
+    slots        = db.Column(db.Integer)                            # 占用的执行槽位数（空即 1），批量任务的并行条目另外申请
+    heartbeat_at = db.Column(db.DateTime)                           # 执行进程最近一次心跳，见 jobs.JobScheduler.recover
+    progress     = db.Column(db.Float)                              # 执行进度百分比，卡片支持进度协议时才有，见 progress.py
+    progress_message = db.Column(db.String(255))
+    error        = db.Column(db.Text)
+    error_info   = db.Column(db.Text)                               # JSON，结构化的失败原因
+    created_at   = db.Column(db.DateTime, nullable=False)
+    started_at   = db.Column(db.DateTime)
+    finished_at  = db.Column(db.DateTime)
+    purged_at    = db.Column(db.DateTime)                           # 任务目录被删除的时间
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'function_id': self.function_id,
+            'status': self.status,
+            'priority': self.priority,
+            'progress': self.progress,
+            'progress_message': self.progress_message,
+            'error': self.error,
+            'error_info': json.loads(self.error_info) if self.error_info else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'purged_at': self.purged_at.isoformat() if self.purged_at else None,
+        }
+
+
+@event.listens_for(Engine, 'connect')
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    """SQLite 连接设置：WAL 让读写互不阻塞，锁冲突时等待而不是立即报 database is locked"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    from config import Config
+    cursor = dbapi_connection.cursor()
+    for name, value in Config.SQLITE_PRAGMAS.items():
+        cursor.execute(f'PRAGMA {name}={value}')
+    cursor.close()
+
+
+def upgrade_schema():
+    """create_all 不会给已有的表补列；按模型用 ALTER TABLE 补齐新增的可空列"""
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(db.engine.dialect)
+            db.session.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+    db.session.commit()
+
+
+def init_db():
+    """建表并补齐新增列；由 flask init-db 在部署时执行（DB_AUTO_INIT 时创建应用时执行）"""
+    db.create_all()
+    upgrade_schema()
@@ -0,0 +1,205 @@
+"""
+界面页面与手册的缓存：
+- 不随登录用户变化的页面（/contact、/user_guide、/menu、/manual/...）渲染一次后缓存在内存中，
+  带 ETag / Last-Modified，浏览器再次访问时直接返回 304；模板、function.csv 或手册修改后自动重新渲染。
+  支持 gzip 的客户端直接拿到预先压缩好的内容。
+- static_page/*.md 手册在首次访问或文件修改后渲染为 HTML（安装了 markdown 包时完整渲染，否则按原文显示）。
+- python pages.py build 生成预压缩的静态包（每个文件附带 .gz，安装了 brotli 包时另有 .br），
+  由 nginx 直接发送，不再占用 Flask worker：
+
+    location = /contact      { root <STATIC_BUNDLE_DIR>; gzip_static on; try_files /contact.html @flask; }
+    location = /user_guide   { root <STATIC_BUNDLE_DIR>; gzip_static on; try_files /user_guide.html @flask; }
+    location /manual/        { root <STATIC_BUNDLE_DIR>; gzip_static on; try_files $uri.html $uri ${uri}index.html @flask; }
+"""
+import argparse
+import gzip
+import hashlib
+import html
+import importlib
+import os
+import sys
+import threading
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from flask import current_app, render_template, request
+
+from config import BASE_DIR, Config
+
+
+def _optional(name):
+    """按需导入可选依赖（markdown / brotli），未安装时返回 None；不在 worker 启动时导入"""
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+# 小于该字节数的页面不压缩
+GZIP_MIN_BYTES = 1024
+
+MANUAL_PAGE = '''<!doctype html>
+<html>
+<head>
+<meta charset="UTF-8"><meta name="viewport" content="width=device-width, initial-scale=1.0">
+<title>{title}</title>
+<style>body {{ max-width: 860px; margin: 2rem auto; padding: 0 1rem; font-family: "Helvetica Neue", Arial, sans-serif; line-height: 1.6; }}
+pre {{ white-space: pre-wrap; }} table {{ border-collapse: collapse; }} td, th {{ border: 1px solid #ccc; padding: 4px 8px; }}</style>
+</head>
+<body>
+{body}
+</body>
+</html>
+'''
+
+Page = namedtuple('Page', 'version etag last_modified body gzipped')
+
+
+# ---------- 手册 ----------
+def render_markdown(text, title):
+    markdown = _optional('markdown')
+    if markdown is not None:
+        body = markdown.markdown(text, extensions=['tables', 'fenced_code'])
+    else:
+        body = f'<pre>{html.escape(text)}</pre>'
+    return MANUAL_PAGE.format(title=html.escape(title), body=body)
+
+
+def manual_files():
+    """手册名 -> 文件路径：static_page/*.md 以去掉扩展名的文件名访问，PDF 手册以完整文件名访问"""
+    files = {}
+    if os.path.isdir(Config.MANUAL_DIR):
+        for entry in os.scandir(Config.MANUAL_DIR):
+            if entry.name.endswith('.md'):
+                files[entry.name[:-3]] = entry.path
+    for path in Config.MANUAL_PDFS:
+        if os.path.isfile(path):
+            files[os.path.basename(path)] = path
+    return files
+
+
+def file_version(*paths):
+    """文件的 (mtime, size) 签名，文件修改后缓存的页面随之失效"""
+    version = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            version.append(None)
+            continue
+        version.append((st.st_mtime_ns, st.st_size))
+    return tuple(version)
+
+
+def render_manual_index(files):
+    items = '\n'.join(f'<li><a href="{html.escape(name)}">{html.escape(name)}</a></li>' for name in sorted(files))
+    return MANUAL_PAGE.format(title='手册', body=f'<h1>手册</h1>\n<ul>\n{items}\n</ul>')
+
+
+# ---------- 页面缓存 ----------
+class PageCache:
+
+    def __init__(self):
+        self.max_age = 300
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_age = app.config['PAGE_MAX_AGE']
+        app.extensions['page_cache'] = self
+
+    def get(self, key, version, render):
+        """返回缓存的页面；version 变化时调用 render() 重新渲染"""
+        page = self._pages.get(key)
+        if page is not None and page.version == version:
+            return page
+        body = render().encode('utf-8')
+        page = Page(
+            version=version,
+            etag=hashlib.sha256(body).hexdigest()[:32],
+            last_modified=datetime.now(timezone.utc).replace(microsecond=0),
+            body=body,
+            gzipped=gzip.compress(body, 9, mtime=0) if len(body) >= GZIP_MIN_BYTES else None,
+        )
+        with self._lock:
+            self._pages[key] = page
+        return page
+
+    def respond(self, key, version, render, mimetype='text/html'):
+        """缓存页面的响应：带 ETag / Last-Modified，条件请求命中时返回 304"""
+        page = self.get(key, version, render)
+        use_gzip = page.gzipped is not None and request.accept_encodings['gzip'] > 0
+        response = current_app.response_class(page.gzipped if use_gzip else page.body, mimetype=mimetype)
+        if use_gzip:
+            response.content_encoding = 'gzip'
+        response.vary.add('Accept-Encoding')
+        response.set_etag(page.etag + ('-gz' if use_gzip else ''))
+        response.last_modified = page.last_modified
+        response.cache_control.public = True
+        response.cache_control.max_age = self.max_age
+        return response.make_conditional(request)
+
+    def template(self, key, name, **context):
+        """只依赖模板文件本身的页面（不含用户信息），模板修改后重新渲染"""
+        path = os.path.join(current_app.root_path, current_app.template_folder, name)
+        return self.respond(key, file_version(path), lambda: render_template(name, **context))
+
+
+page_cache = PageCache()
+
+
+# ---------- 预压缩静态包 ----------
+def _write(out_dir, name, data, mtime):
+    """写入文件及其 .gz / .br，并把 mtime 设为源文件的时间（nginx gzip_static 按此判断新旧）"""
+    path = os.path.join(out_dir, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    variants = [(path, data), (path + '.gz', gzip.compress(data, 9, mtime=0))]
+    brotli = _optional('brotli')
+    if brotli is not None:
+        variants.append((path + '.br', brotli.compress(data)))
+    for target, content in variants:
+        tmp = target + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(content)
+        os.utime(tmp, (mtime, mtime))
+        os.replace(tmp, target)
+    return len(variants)
+
+
+def build_bundle(out_dir, templates=('contact.html', 'user_guide.html')):
+    """把静态模板、渲染后的手册与 PDF 写入 out_dir；/menu 随卡片变化，仍由 Flask（页面缓存）提供"""
+    from jinja2 import Environment, FileSystemLoader
+    env = Environment(loader=FileSystemLoader(os.path.join(BASE_DIR, 'templates')), autoescape=True)
+    written = 0
+    for name in templates:
+        source = os.path.join(BASE_DIR, 'templates', name)
+        written += _write(out_dir, name, env.get_template(name).render().encode('utf-8'), os.stat(source).st_mtime)
+
+    files = manual_files()
+    for name, path in files.items():
+        mtime = os.stat(path).st_mtime
+        if path.endswith('.md'):
+            with open(path, encoding='utf-8') as f:
+                data = render_markdown(f.read(), name).encode('utf-8')
+            written += _write(out_dir, os.path.join('manual', name + '.html'), data, mtime)
+        else:
+            with open(path, 'rb') as f:
+                written += _write(out_dir, os.path.join('manual', name), f.read(), mtime)
+    newest = max([os.stat(p).st_mtime for p in files.values()] or [0])
+    written += _write(out_dir, os.path.join('manual', 'index.html'), render_manual_index(files).encode('utf-8'), newest)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成供 nginx 直接发送的预压缩静态包')
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build', help='渲染静态页面与手册并预压缩')
+    build.add_argument('--output', default=Config.STATIC_BUNDLE_DIR, help='输出目录')
+    args = parser.parse_args()
+    written = build_bundle(args.output)
+    print(f'已写入 {written} 个文件到 {args.output}（brotli: {"是" if _optional("brotli") else "否，未安装 brotli 包"}）')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,254 @@
+"""
+多步流水线：在同一个任务目录中依次执行多张服务卡片，中间结果不经过浏览器。
+
+流水线定义在 function.csv 旁的 pipelines.json 中：
+    {
+      "hash_encrypt_hash": {
+        "name": "哈希-加密-哈希",
+        "description": "...",
+        "inputs": ["待加密文件", "密钥"],
+        "steps": [
+          {"id": "plain", "card": "calc_md5", "inputs": ["input:0"]},
+          {"id": "cipher", "card": "AES_crypt", "inputs": ["input:0", "input:1"]},
+          {"id": "cipher_md5", "card": "calc_md5", "inputs": ["cipher:0"]}
+        ],
+        "outputs": ["plain:0", "cipher:0", "cipher_md5:0"]
+      }
+    }
+input:<i> 为上传的第 i 个文件，<步骤 ID>:<i> 为该步骤的第 i 个输出；步骤只能引用排在它前面的步骤。
+
+每个步骤在 steps/<步骤 ID>/ 下执行，上一步的输出以硬链接交给下一步（不复制），
+互不依赖的步骤并发执行；结束后 outputs 中列出的文件移动到 outputs/，其余中间结果删除。
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from config import Config
+from executors import get_executor
+from jobs import JobFailed, job_handler
+from limits import LimitExceeded
+from registry import function_registry
+from runner import CardFailed
+
+logger = logging.getLogger(__name__)
+
+INPUT = 'input'
+
+
+# ---------- 解析 ----------
+def parse_ref(ref):
+    """'cipher:0' -> ('cipher', 0)"""
+    source, sep, index = str(ref).rpartition(':')
+    if not sep or not source or not index.isdigit():
+        raise ValueError(f'无法解析的引用 {ref!r}（应为 input:<i> 或 <步骤 ID>:<i>）')
+    return source, int(index)
+
+
+def parse_pipeline(pipeline_id, spec):
+    inputs = [str(x) for x in spec.get('inputs') or []]
+    steps, seen = [], set()
+    for raw in spec['steps']:
+        step_id = str(raw['id'])
+        if step_id == INPUT or step_id in seen:
+            raise ValueError(f'步骤 ID {step_id!r} 重复或为保留字')
+        refs = [parse_ref(ref) for ref in raw.get('inputs') or []]
+        for source, index in refs:
+            if source == INPUT and index >= len(inputs):
+                raise ValueError(f'步骤 {step_id} 引用了不存在的输入 input:{index}')
+            if source != INPUT and source not in seen:
+                raise ValueError(f'步骤 {step_id} 引用了未定义或排在其后的步骤 {source}')
+        steps.append({'id': step_id, 'card': str(raw['card']), 'inputs': refs})
+        seen.add(step_id)
+    if not steps:
+        raise ValueError('至少需要一个步骤')
+
+    outputs = [parse_ref(ref) for ref in spec['outputs']]
+    if not outputs or len(set(outputs)) != len(outputs):
+        raise ValueError('outputs 不能为空或重复')
+    for source, _ in outputs:
+        if source != INPUT and source not in seen:
+            raise ValueError(f'outputs 引用了未定义的步骤 {source}')
+    return {
+        'ID': pipeline_id,
+        'name': spec.get('name') or pipeline_id,
+        'description': spec.get('description', ''),
+        'inputs': inputs,
+        'steps': steps,
+        'outputs': outputs,
+    }
+
+
+def resolve_cards(pipeline):
+    """检查各步骤的卡片存在且输入个数匹配，返回 步骤 ID -> 卡片记录"""
+    cards = {}
+    for step in pipeline['steps']:
+        card = function_registry.get(step['card'])
+        if card is None:
+            raise ValueError(f'步骤 {step["id"]} 的卡片 {step["card"]} 不存在')
+        if len(step['inputs']) != len(card['input_list']):
+            raise ValueError(f'步骤 {step["id"]} 提供了 {len(step["inputs"])} 个输入，'
+                             f'卡片 {card["ID"]} 需要 {len(card["input_list"])} 个')
+        cards[step['id']] = card
+    return cards
+
+
+def describe(pipeline):
+    """流水线定义的 JSON 表示"""
+    ref = lambda source, index: f'{source}:{index}'
+    return {
+        'id': pipeline['ID'],
+        'name': pipeline['name'],
+        'description': pipeline['description'],
+        'inputs': pipeline['inputs'],
+        'steps': [{'id': s['id'], 'card': s['card'], 'inputs': [ref(*r) for r in s['inputs']]}
+                  for s in pipeline['steps']],
+        'outputs': [ref(*r) for r in pipeline['outputs']],
+    }
+
+
+class PipelineRegistry:
+    """pipelines.json 注册表，文件 mtime/size 变化时自动重新加载"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._signature = None
+        self._pipelines = {}
+
+    def init_app(self, app):
+        self.path = app.config['PIPELINES_JSON']
+        app.extensions['pipeline_registry'] = self
+
+    def _stat_signature(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _load(self, signature):
+        pipelines = {}
+        if signature is not None:
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    raw = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error('无法读取 %s: %s', self.path, e)
+                raw = {}
+            for pipeline_id, spec in raw.items():
+                try:
+                    pipelines[pipeline_id] = parse_pipeline(pipeline_id, spec)
+                except (ValueError, TypeError, KeyError, AttributeError) as e:
+                    logger.warning('跳过无法解析的流水线 %r: %s', pipeline_id, e)
+        self._pipelines = pipelines
+        self._signature = signature
+
+    def _refresh(self):
+        signature = self._stat_signature()
+        if signature != self._signature:
+            with self._lock:
+                if signature != self._signature:
+                    self._load(signature)
+
+    def get(self, pipeline_id):
+        self._refresh()
+        return self._pipelines.get(pipeline_id)
+
+    def all(self):
+        self._refresh()
+        return list(self._pipelines.values())
+
+
+pipeline_registry = PipelineRegistry()
+
+
+# ---------- 执行 ----------
+def _handoff(src, step_dir, i):
+    """把上一步的文件硬链接为本步骤的第 i 个输入；文件系统不支持硬链接时直接使用原路径"""
+    dst = os.path.join(step_dir, f'input_{i}_{os.path.basename(src)}')
+    try:
+        os.link(src, dst)
+    except OSError:
+        return src
+    return dst
+
+
+def _lookup(produced, source, index):
+    paths = produced[source]
+    if index >= len(paths) or not os.path.exists(paths[index]):
+        raise JobFailed(f'{source} 没有第 {index} 个输出')
+    return paths[index]
+
+
+def _run_step(card, step_dir, inputs):
+    """执行一个步骤，返回输出文件路径列表；失败抛出 CardFailed / LimitExceeded"""
+    output_paths = []
+    if card['exec_mode'] == 'subprocess':
+        output_paths = [os.path.join(step_dir, f'output_{i}.bin') for i in range(len(card['output_list']))]
+    return get_executor().run(card, inputs, output_paths, os.path.join(step_dir, 'outputs')).outputs
+
+
+@job_handler('pipeline')
+def run_pipeline_job(job):
+    pipeline = pipeline_registry.get(job.function_id)
+    if pipeline is None:
+        raise JobFailed(f'流水线 {job.function_id} 不存在')
+    try:
+        cards = resolve_cards(pipeline)
+    except ValueError as e:
+        raise JobFailed(str(e))
+
+    steps_dir = os.path.join(job.temp_dir, 'steps')
+    produced = {INPUT: json.loads(job.input_paths)}
+    pending = list(pipeline['steps'])
+    running = {}
+    failure = None
+    with ThreadPoolExecutor(max_workers=Config.PIPELINE_PARALLELISM) as pool:
+        while pending or running:
+            # 输入都已就绪的步骤立即提交，互不依赖的步骤并发执行
+            for step in [s for s in pending if all(src in produced for src, _ in s['inputs'])]:
+                pending.remove(step)
+                step_dir = os.path.join(steps_dir, step['id'])
+                os.makedirs(step_dir, exist_ok=True)
+                inputs = [_handoff(_lookup(produced, *ref), step_dir, i)
+                          for i, ref in enumerate(step['inputs'])]
+                running[pool.submit(_run_step, cards[step['id']], step_dir, inputs)] = (step, time.perf_counter())
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step, start = running.pop(future)
+                try:
+                    produced[step['id']] = future.result()
+                except LimitExceeded as e:
+                    failure = failure or (step, str(e), e.to_dict())
+                except CardFailed as e:
+                    failure = failure or (step, str(e), getattr(e, 'info', None))
+                else:
+                    logger.info('流水线 %s 步骤 %s 完成，用时 %.2f 秒',
+                                job.id, step['id'], time.perf_counter() - start)
+            if failure:
+                break           # 已在执行的步骤在退出线程池时等待结束，剩余步骤不再提交
+
+    if failure:
+        step, message, info = failure
+        raise JobFailed(f'步骤 {step["id"]}（{step["card"]}）失败: {message}',
+                        {'type': 'pipeline_step', 'step': step['id'], 'card': step['card'], 'detail': info})
+
+    # 最终输出移动到 outputs/，文件名带上步骤 ID；其余中间结果随 steps/ 一起删除
+    outputs_dir = os.path.join(job.temp_dir, 'outputs')
+    os.makedirs(outputs_dir, exist_ok=True)
+    outputs = []
+    for source, index in pipeline['outputs']:
+        src = _lookup(produced, source, index)
+        dst = os.path.join(outputs_dir, f'{source}_{index}_{os.path.basename(src)}')
+        if source == INPUT:
+            os.link(src, dst)
+        else:
+            os.replace(src, dst)
+        outputs.append(dst)
+    shutil.rmtree(steps_dir, ignore_errors=True)
+    job.output_paths = json.dumps(outputs)
@@ -0,0 +1,98 @@
+"""
+卡片执行进度：卡片输出进度行，应用边读 stdout 边解析，限频写入 job 表，
+由 /jobs/<id>/events（Server-Sent Events）推送给浏览器，用户不必刷新或重复提交。
+
+协议：应用以环境变量 CARD_PROGRESS=1 启动卡片，卡片据此在 stdout 上输出进度行
+    PROGRESS <百分比 0-100>[ <说明>]
+每行以 \\n 或 \\r 结束，其余输出照常作为卡片的 stdout。
+- 冷启动：runner.run_cold 分块读取 stdout 时逐行识别，不缓存整个输出；
+- 常驻 worker：card_worker.py 把进度行立即转发为协议消息 {"progress": "<进度行>"}；
+- 进程内执行：main() 接受 progress 参数时，以回调 progress(百分比, 说明) 报告。
+"""
+import re
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import update
+
+from models import db, Job
+
+PROGRESS_ENV = 'CARD_PROGRESS'
+PREFIX = 'PROGRESS '
+# 进度说明与未结束行的最大长度
+MESSAGE_MAX = 255
+LINE_MAX = 4096
+
+_line_end = re.compile(rb'[\r\n]')
+
+
+def parse_progress(line):
+    """解析进度行，返回 (百分比, 说明)；不是进度行时返回 None"""
+    if not line.startswith(PREFIX):
+        return None
+    value, _, message = line[len(PREFIX):].strip().partition(' ')
+    try:
+        percent = float(value)
+    except ValueError:
+        return None
+    if percent != percent:          # NaN
+        return None
+    return max(0.0, min(100.0, percent)), message.strip()[:MESSAGE_MAX]
+
+
+class LineScanner:
+    """从分块读到的 stdout 中找出进度行；只保留最后一个未结束的行（最多 LINE_MAX 字节）"""
+
+    def __init__(self, callback):
+        self.callback = callback
+        self._partial = b''
+
+    def feed(self, chunk):
+        lines = _line_end.split(self._partial + chunk)
+        self._partial = lines.pop()[-LINE_MAX:]
+        for raw in lines:
+            if raw.startswith(PREFIX.encode()):
+                parsed = parse_progress(raw.decode('utf-8', 'replace'))
+                if parsed is not None:
+                    self.callback(*parsed)
+
+
+class ProgressReporter:
+    """
+    任务的进度回调，可在任意线程中调用（stdout 读取线程、卡片的工作线程）。
+    只在数值变化且距上次写入超过 JOB_PROGRESS_INTERVAL 秒时写入 job 表，
+    卡片输出再频繁，每个任务每秒也只有有限次数据库写入。
+    """
+
+    def __init__(self, job_id):
+        self.app = current_app._get_current_object()
+        self.job_id = job_id
+        self.interval = self.app.config['JOB_PROGRESS_INTERVAL']
+        self._lock = threading.Lock()
+        self._last = 0.0
+        self._written = None
+
+    def __call__(self, percent, message=''):
+        value = (round(float(percent), 1), message or None)
+        now = time.monotonic()
+        with self._lock:
+            if value == self._written or now - self._last < self.interval:
+                return
+            self._last, self._written = now, value
+        self._write(value)
+
+    def finish(self):
+        """任务成功结束：报告过进度的任务补记 100%（最后几次更新可能被限频略过）"""
+        with self._lock:
+            if self._written is None or self._written[0] >= 100:
+                return
+            self._written = (100.0, self._written[1])
+        self._write(self._written)
+
+    def _write(self, value):
+        # 独立的应用上下文即独立的数据库会话，不影响执行任务的线程中的会话
+        with self.app.app_context():
+            db.session.execute(update(Job).where(Job.id == self.job_id)
+                               .values(progress=value[0], progress_message=value[1]))
+            db.session.commit()
@@ -0,0 +1,142 @@
+import ast
+import csv
+import logging
+import os
+import threading
+
+from runner import card_paths
+
+logger = logging.getLogger(__name__)
+
+# function.csv 中以 Python 列表字面量存储的列 -> 卡片记录中的字段名
+LIST_COLUMNS = {
+    'input_list': 'input_list',
+    'output_list': 'output_list',
+    'input_list_description': 'input_descs',
+    'output_list_description': 'output_descs',
+}
+
+# subprocess：每次以命令行参数运行 run.py（可走常驻 worker）；
+# inprocess：受信任卡片，在应用进程内调用 main(input_files, output_dir)
+EXEC_MODES = ('subprocess', 'inprocess')
+
+
+def parse_int(value, default=0):
+    """解析可选的整数列，缺省（老的 7 列 CSV 行）时取默认值"""
+    if value is None or not str(value).strip():
+        return default
+    return int(value)
+
+
+def parse_list(value):
+    """安全解析形如 ['txt', 'bin'] 的列表字符串（不再使用 eval）"""
+    if value is None or not value.strip():
+        return []
+    parsed = ast.literal_eval(value)
+    if not isinstance(parsed, (list, tuple)):
+        raise ValueError(f'不是列表: {value!r}')
+    return [str(x) for x in parsed]
+
+
+class FunctionRegistry:
+    """
+    服务卡片注册表。
+    启动时解析一次 function.csv，之后仅当文件 mtime/size 变化
+    或显式 invalidate() 时才重新加载；各请求直接读取内存中的卡片记录。
+    """
+
+    def __init__(self, csv_path=None):
+        self.csv_path = csv_path
+        self.version = 0
+        self._lock = threading.Lock()
+        self._signature = None
+        self._cards = {}
+
+    def init_app(self, app):
+        self.csv_path = app.config['FUNCTION_CSV']
+        app.extensions['function_registry'] = self
+        self.reload()
+
+    # ---------- 加载 ----------
+    def _stat_signature(self):
+        try:
+            st = os.stat(self.csv_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _parse_row(self, row):
+        card = {
+            'ID': row['ID'].strip(),
+            'name': row['name'],
+            'description': row['description'],
+        }
+        for column, field in LIST_COLUMNS.items():
+            card[field] = parse_list(row.get(column))
+        # 常驻 worker 数量，0 表示每次冷启动解释器
+        card['workers'] = parse_int(row.get('workers'))
+        # 输出只由输入决定时才能复用缓存结果；非确定性卡片置 0
+        card['cacheable'] = bool(parse_int(row.get('cacheable'), default=1))
+        card['exec_mode'] = (row.get('exec_mode') or '').strip() or EXEC_MODES[0]
+        if card['exec_mode'] not in EXEC_MODES:
+            raise ValueError(f'未知的 exec_mode: {card["exec_mode"]!r}')
+        # inprocess 卡片在应用进程内执行，不经过常驻 worker，也就没有 worker 上的资源限制
+        if card['exec_mode'] == 'inprocess' and card['workers']:
+            raise ValueError('inprocess 卡片不使用常驻 worker，workers 须为 0')
+        # 解释器与 run.py 路径在加载时解析一次，执行时不再逐次查找 env
+        card['python_exec'], card['script_path'] = card_paths(card['ID'])
+        return card
+
+    def reload(self):
+        """无条件重新解析 function.csv"""
+        with self._lock:
+            self._load(self._stat_signature())
+
+    def _load(self, signature):
+        cards = {}
+        if signature is None:
+            logger.error('function.csv file not found: %s', self.csv_path)
+        else:
+            with open(self.csv_path, newline='', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    try:
+                        card = self._parse_row(row)
+                    except (ValueError, SyntaxError, KeyError, AttributeError) as e:
+                        logger.warning('跳过无法解析的卡片 %r: %s', row.get('ID'), e)
+                        continue
+                    cards[card['ID']] = card
+        self._cards = cards
+        self._signature = signature
+        self.version += 1
+
+    def _refresh(self):
+        signature = self._stat_signature()
+        if signature != self._signature:
+            with self._lock:
+                if signature != self._signature:
+                    self._load(signature)
+
+    def invalidate(self):
+        """admin 追加卡片后调用，下次访问时强制重新加载"""
+        with self._lock:
+            self._signature = object()
+
+    # ---------- 查询 ----------
+    def get(self, card_id):
+        self._refresh()
+        return self._cards.get(card_id)
+
+    def all(self):
+        self._refresh()
+        return list(self._cards.values())
+
+    def current_version(self):
+        """当前卡片版本（function.csv 变化后递增），用于缓存依赖卡片列表的页面"""
+        self._refresh()
+        return self.version
+
+    def __contains__(self, card_id):
+        return self.get(card_id) is not None
+
+
+function_registry = FunctionRegistry()
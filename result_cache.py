@@ -0,0 +1,214 @@
+"""
+内容寻址的结果缓存：
+    key = sha256(卡片 ID, 代码版本, 各输入文件的 SHA-256 与文件名, 卡片参数)
+代码版本 = program/run.py 内容 + 虚拟环境指纹（pyvenv.cfg 与已安装包的 dist-info 名称）。
+缓存条目存放在 instance/result_cache/<key[:2]>/<key>/<序号>/<原输出文件名>，按目录 mtime 做 LRU 淘汰。
+各进程共享同一目录：缓存总大小记在 .total 中，写入新条目与淘汰都在 .lock 的文件锁内进行，
+RESULT_CACHE_MAX_BYTES 因此是整个目录的上限，而不是每个进程各自的上限。
+只有输出完全由输入文件名与内容决定的卡片才能缓存（结果会发给其他用户）；
+非确定性的卡片（如 AES 加密使用随机 IV）或输出含时间、服务器路径的卡片在 function.csv 中以 cacheable=0 关闭缓存。
+"""
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:         # Windows：只有进程内的锁
+    fcntl = None
+
+from config import Config
+from envstore import resolve_env
+
+logger = logging.getLogger(__name__)
+
+
+def _env_fingerprint(env_dir):
+    h = hashlib.sha256()
+    cfg = os.path.join(env_dir, 'pyvenv.cfg')
+    if os.path.exists(cfg):
+        with open(cfg, 'rb') as f:
+            h.update(f.read())
+    patterns = [os.path.join(env_dir, 'lib', 'python*', 'site-packages', '*.dist-info'),
+                os.path.join(env_dir, 'Lib', 'site-packages', '*.dist-info')]
+    for name in sorted(os.path.basename(p) for pattern in patterns for p in glob.glob(pattern)):
+        h.update(name.encode('utf-8') + b'\n')
+    return h.hexdigest()
+
+
+class ResultCache:
+
+    def __init__(self):
+        self.cache_dir = None
+        self.max_bytes = 0
+        # 执行节点不调用 init_app，也要能计算卡片的代码版本
+        self.functions_dir = Config.FUNCTIONS_DIR
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.cache_dir = app.config['RESULT_CACHE_DIR']
+        self.max_bytes = app.config['RESULT_CACHE_MAX_BYTES']
+        self.functions_dir = app.config['FUNCTIONS_DIR']
+        os.makedirs(self.cache_dir, exist_ok=True)
+        app.extensions['result_cache'] = self
+
+    # ---------- 键 ----------
+    def code_version(self, card_id):
+        """run.py 与虚拟环境的指纹，run.py 或 env 变化后自动更新"""
+        card_dir = os.path.join(self.functions_dir, card_id)
+        script = os.path.join(card_dir, 'program', 'run.py')
+        env_dir = resolve_env(card_dir)
+        st = os.stat(script)
+        env_mtime = os.stat(env_dir).st_mtime_ns if os.path.isdir(env_dir) else 0
+        signature = (st.st_mtime_ns, st.st_size, env_mtime)
+        cached = self._versions.get(card_id)
+        if cached and cached[0] == signature:
+            return cached[1]
+        h = hashlib.sha256()
+        with open(script, 'rb') as f:
+            h.update(f.read())
+        h.update(_env_fingerprint(env_dir).encode('ascii'))
+        version = h.hexdigest()
+        self._versions[card_id] = (signature, version)
+        return version
+
+    def key(self, card_id, input_digests, input_names, options=None):
+        """input_names 为卡片看到的输入文件名（basename），报告等输出中可能含有文件名；options 为卡片参数"""
+        h = hashlib.sha256()
+        h.update(card_id.encode('utf-8') + b'\0')
+        h.update(self.code_version(card_id).encode('ascii') + b'\0')
+        for digest, name in zip(input_digests, input_names, strict=True):
+            h.update(digest.encode('ascii') + b'\0' + name.encode('utf-8') + b'\0')
+        if options:
+            h.update(json.dumps(options, sort_keys=True).encode('utf-8'))
+        return h.hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    # ---------- 读写 ----------
+    def lookup(self, key, output_count):
+        """命中时返回缓存中的输出文件路径列表（保留原输出文件名），并刷新 LRU 时间"""
+        entry = self._entry_dir(key)
+        paths = []
+        try:
+            for i in range(output_count):
+                names = os.listdir(os.path.join(entry, str(i)))
+                if len(names) != 1:
+                    return None
+                paths.append(os.path.join(entry, str(i), names[0]))
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        try:
+            os.utime(entry)
+        except FileNotFoundError:
+            return None
+        return paths
+
+    def link_into(self, paths, directory):
+        """把命中的缓存输出硬链接进任务目录（<目录>/outputs/<序号>/<文件名>），之后淘汰缓存条目不影响该任务"""
+        linked = []
+        for i, path in enumerate(paths):
+            target = os.path.join(directory, 'outputs', str(i), os.path.basename(path))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                os.link(path, target)
+            except OSError:         # 缓存与任务目录不在同一文件系统
+                shutil.copyfile(path, target)
+            linked.append(target)
+        return linked
+
+    def store(self, key, output_paths):
+        """保存一次成功执行的输出；优先硬链接，跨文件系统时复制"""
+        entry = self._entry_dir(key)
+        if os.path.exists(entry):
+            return
+        staging = os.path.join(self.cache_dir, f'.staging-{uuid.uuid4().hex}')
+        os.makedirs(staging)
+        size = 0
+        try:
+            for i, path in enumerate(output_paths):
+                os.makedirs(os.path.join(staging, str(i)))
+                target = os.path.join(staging, str(i), os.path.basename(path))
+                try:
+                    os.link(path, target)
+                except OSError:
+                    shutil.copyfile(path, target)
+                size += os.path.getsize(target)
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            os.rename(staging, entry)
+        except OSError:
+            # 其他进程已写入同一条目，或磁盘出错：放弃本次缓存
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+        self._account(size)
+
+    # ---------- 淘汰 ----------
+    @contextmanager
+    def _dir_lock(self):
+        with self._lock, open(os.path.join(self.cache_dir, '.lock'), 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def _read_total(self):
+        try:
+            with open(os.path.join(self.cache_dir, '.total'), encoding='ascii') as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def _write_total(self, total):
+        path = os.path.join(self.cache_dir, '.total')
+        with open(path + '.tmp', 'w', encoding='ascii') as f:
+            f.write(str(total))
+        os.replace(path + '.tmp', path)
+
+    def _scan(self):
+        entries = []
+        for bucket in os.scandir(self.cache_dir):
+            if not bucket.is_dir() or bucket.name.startswith('.'):
+                continue
+            for entry in os.scandir(bucket.path):
+                try:
+                    size = sum(os.path.getsize(os.path.join(root, name))
+                               for root, _, names in os.walk(entry.path) for name in names)
+                    entries.append((entry.stat().st_mtime, size, entry.path))
+                except FileNotFoundError:
+                    # 其他进程刚刚淘汰了该条目
+                    continue
+        return entries
+
+    def _account(self, size):
+        """把新条目计入共享的缓存总大小；总大小未知或超过上限时重新扫描整个目录并淘汰"""
+        with self._dir_lock():
+            total = self._read_total()
+            if total is not None:
+                total += size
+            if total is None or total > self.max_bytes:
+                total = self._evict()
+            self._write_total(total)
+
+    def _evict(self):
+        entries = self._scan()
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            # 淘汰到上限的 90%，避免每次写入都触发扫描
+            target = self.max_bytes * 0.9
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+            logger.info('结果缓存淘汰后大小 %d 字节', total)
+        return total
+
+
+result_cache = ResultCache()
@@ -0,0 +1,208 @@
+"""
+执行服务卡片：开启了常驻 worker 的卡片走 worker 池，其余卡片每次冷启动
+functions/{ID}/env/python 运行 program/run.py。
+两种方式都受 limits.card_limits 中的资源限制约束。
+
+exec_mode 为 inprocess 的受信任卡片不启动子进程：run.py 被导入应用进程一次，
+按文档约定直接调用 main(input_files, output_dir) -> list[str]（见 run_inprocess）。
+
+三种方式都可以传入 on_progress(百分比, 说明) 接收卡片的执行进度（协议见 progress.py）。
+"""
+import importlib.util
+import inspect
+import locale
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from config import Config
+import workers
+from envstore import resolve_env
+from limits import LimitExceeded, TailBuffer, Watchdog, apply_limits, card_limits, classify
+from metrics import RUN_CPU_SECONDS, RUN_MAX_RSS_BYTES, RUN_WALL_SECONDS
+from progress import PROGRESS_ENV, LineScanner
+
+logger = logging.getLogger(__name__)
+
+# env 目录中解释器的相对路径，按平台在导入时确定一次
+PYTHON_IN_ENV = 'python.exe' if os.name == 'nt' else os.path.join('bin', 'python3')
+
+
+def card_paths(card_id, card_dir=None):
+    """
+    返回 (解释器路径, run.py 路径)；card_dir 默认为 functions/{ID}（安装时传入暂存目录）。
+    已注册的卡片在注册表加载时解析一次，记录在卡片的 python_exec / script_path 中。
+    """
+    card_dir = card_dir or os.path.join(Config.FUNCTIONS_DIR, card_id)
+    python_exec = os.path.join(resolve_env(card_dir), PYTHON_IN_ENV)
+    script_path = os.path.join(card_dir, 'program', 'run.py')
+    return python_exec, script_path
+
+
+def _drain(stream, buffer, scanner=None):
+    # read1 有多少读多少，输出多的卡片也不会在父进程中积累超过 max_output 字节；
+    # 进度行在读到时即交给 scanner，不等进程退出
+    for chunk in iter(lambda: stream.read1(64 * 1024), b''):
+        buffer.write(chunk)
+        if scanner is not None:
+            scanner.feed(chunk)
+
+
+def run_cold(python_exec, script_path, argv, limits, on_progress=None):
+    """
+    冷启动解释器执行 run.py，子进程在独立的进程组中运行。
+    返回 (CompletedProcess, usage)，usage 为子进程的 {'cpu': 秒, 'maxrss': 字节}，
+    取自 os.wait4；不支持 wait4 的平台（Windows）为 None。
+    超过墙钟时间时整个进程组被终止并抛出 LimitExceeded。
+    """
+    cmd_args = [python_exec, script_path, *argv]
+    logger.info('run command %s', cmd_args)
+    env = dict(os.environ, **{PROGRESS_ENV: '1'}) if on_progress is not None else None
+    proc = subprocess.Popen(cmd_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            start_new_session=True, env=env)
+    apply_limits(proc.pid, limits)
+    stdout, stderr = TailBuffer(limits['max_output']), TailBuffer(limits['max_output'])
+    scanner = LineScanner(on_progress) if on_progress is not None else None
+    readers = [threading.Thread(target=_drain, args=(proc.stdout, stdout, scanner)),
+               threading.Thread(target=_drain, args=(proc.stderr, stderr))]
+    for reader in readers:
+        reader.start()
+
+    usage = None
+    with Watchdog(proc, limits['timeout']) as watchdog:
+        for reader in readers:
+            reader.join()
+        proc.stdout.close()
+        proc.stderr.close()
+        if hasattr(os, 'wait4'):
+            # 自己回收子进程以拿到它的 rusage；设置 returncode 后 Popen 不会再次 wait
+            _, status, ru = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            maxrss = ru.ru_maxrss if sys.platform == 'darwin' else ru.ru_maxrss * 1024
+            usage = {'cpu': ru.ru_utime + ru.ru_stime, 'maxrss': maxrss}
+        else:
+            proc.wait()
+
+    encoding = locale.getpreferredencoding(False)
+    result = subprocess.CompletedProcess(cmd_args, proc.returncode,
+                                         stdout.text(encoding), stderr.text(encoding))
+    if watchdog.fired:
+        raise LimitExceeded('timeout', limits['timeout'], result)
+    return result, usage
+
+
+# ---------- 进程内执行 ----------
+class CardFailed(Exception):
+    """进程内执行的卡片失败（main() 抛出异常、调用 sys.exit 或返回了不存在的输出）"""
+
+
+_modules = {}           # run.py 路径 -> (mtime_ns, 模块)
+_modules_lock = threading.Lock()
+
+
+def load_module(card_id, script_path):
+    """导入卡片的 run.py（每张卡片独立的模块名，不加入 sys.modules）；文件修改后重新导入"""
+    mtime = os.stat(script_path).st_mtime_ns
+    with _modules_lock:
+        hit = _modules.get(script_path)
+        if hit is not None and hit[0] == mtime:
+            return hit[1]
+        spec = importlib.util.spec_from_file_location(f'card_{card_id}', script_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        if not callable(getattr(module, 'main', None)):
+            raise CardFailed(f'卡片 {card_id} 的 run.py 未定义 main()')
+        _modules[script_path] = (mtime, module)
+        return module
+
+
+def accepts(fn, name):
+    try:
+        return name in inspect.signature(fn).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def run_inprocess(card, input_paths, output_dir, on_progress=None, options=None):
+    """
+    在本进程中调用 main(input_files, output_dir)，返回输出文件路径列表；
+    main() 接受 progress 参数时把 on_progress 作为进度回调传入，卡片参数 options 作为同名关键字参数传入。
+    卡片代码与应用共用解释器和依赖、不受 card.json 资源限制约束，只应对受信任的轻量卡片开启；
+    run.py 应为单文件，且不向 stdout 打印大量内容。
+    """
+    script_path = card['script_path']
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        try:
+            module = load_module(card['ID'], script_path)
+            kwargs = {name: value for name, value in (options or {}).items() if accepts(module.main, name)}
+            if on_progress is not None and accepts(module.main, 'progress'):
+                kwargs['progress'] = on_progress
+            outputs = module.main(list(input_paths), output_dir, **kwargs)
+        except SystemExit as e:
+            raise CardFailed(str(e.code) if e.code not in (None, 0) else 'main() 调用了 sys.exit')
+        except CardFailed:
+            raise
+        except Exception as e:
+            logger.exception('卡片 %s 进程内执行失败', card['ID'])
+            raise CardFailed(f'{type(e).__name__}: {e}')
+        if isinstance(outputs, str) or not isinstance(outputs, (list, tuple)):
+            raise CardFailed('main() 应返回输出文件路径列表')
+        outputs = [os.path.join(output_dir, str(p)) for p in outputs]
+        missing = [p for p in outputs if not os.path.isfile(p)]
+        if missing:
+            raise CardFailed(f'main() 返回的输出不存在: {missing}')
+        outcome = 'ok'
+        return outputs
+    finally:
+        _record(card['ID'], outcome, None, time.perf_counter() - start)
+
+
+def _record(card_id, outcome, usage, wall):
+    RUN_WALL_SECONDS.observe(wall, function_id=card_id, outcome=outcome)
+    if usage is not None:
+        RUN_CPU_SECONDS.observe(usage['cpu'], function_id=card_id, outcome=outcome)
+        RUN_MAX_RSS_BYTES.observe(usage['maxrss'], function_id=card_id, outcome=outcome)
+
+
+def run_card(card, input_paths, output_paths, on_progress=None, options=None):
+    """
+    执行一次卡片，返回 subprocess.CompletedProcess；超出资源限制时抛出 LimitExceeded。
+    卡片参数 options 以 --<名称> <取值> 追加在输入、输出路径之后
+    """
+    python_exec, script_path = card['python_exec'], card['script_path']
+    limits = card_limits(card['ID'])
+    argv = [*input_paths, *output_paths]
+    for name, value in (options or {}).items():
+        argv += [f'--{name}', value]
+    start = time.perf_counter()
+
+    result = usage = None
+    try:
+        if card['workers'] > 0:
+            pool = workers.get_pool(card['ID'], python_exec, script_path, card['workers'],
+                                    Config.WORKER_MAX_JOBS, Config.WORKER_IDLE_TIMEOUT, limits,
+                                    Config.WORKER_START_TIMEOUT)
+            try:
+                returncode, stdout, stderr, usage = pool.run(argv, on_progress)
+                result = subprocess.CompletedProcess([python_exec, script_path, *argv],
+                                                     returncode, stdout, stderr)
+            except workers.WorkerUnavailable:
+                pass
+
+        if result is None:
+            result, usage = run_cold(python_exec, script_path, argv, limits, on_progress)
+        breach = classify(result, limits)
+        if breach is not None:
+            raise breach
+    except LimitExceeded as e:
+        logger.warning('卡片 %s 超出资源限制: %s', card['ID'], e)
+        _record(card['ID'], 'limit', usage, time.perf_counter() - start)
+        raise
+    _record(card['ID'], 'ok' if result.returncode == 0 else 'error', usage, time.perf_counter() - start)
+    return result
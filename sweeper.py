@@ -0,0 +1,322 @@
+"""
+tmp_uploads 回收与用户磁盘配额。
+
+- 后台清扫（TempSweeper）：每 TMP_SWEEP_INTERVAL 秒扫描一次 tmp_uploads，
+  删除超过 TMP_MAX_AGE 秒没有写入的条目；总大小仍超过 TMP_MAX_BYTES 时
+  从最久未写入的条目开始删除，直到降到上限的 90%。
+  排队 / 执行中任务的目录不会被删除，没有任务记录的新条目（正在上传）有 TMP_GRACE 秒保护期。
+- 下载后删除（TMP_DELETE_AFTER_DOWNLOAD，默认关闭）：任务结果完整发送（GET 200）后，在连接关闭时删除任务目录；
+  开启后再次下载同一结果返回 410。
+- 用户配额：按用户未清理任务与上传仓库中句柄的占用计算剩余额度，上传超出时返回 507。
+  开始接收请求体之前先在 quota_reservation 表中预留本次上传的字节数（检查与预留是一条条件 INSERT），
+  同一用户的并发上传因此不会一起通过检查；预留在请求结束时删除，此时任务 / 上传会话已经入库并计入占用。
+  进程异常退出遗留的预留由清扫线程删除。
+- 上传仓库：同一线程顺带释放过期的未完成上传与长期未使用的上传句柄（见 uploads.py）。
+
+多个 gunicorn worker 各自启动清扫线程，但只有持有 instance/tmp_sweeper.lock 文件锁（非阻塞 flock）的一个进程
+执行清扫；其余进程每轮重试取锁，持锁进程退出后由其中一个接替。没有 fcntl 的平台上各进程都清扫（删除操作是幂等的）。
+"""
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:         # Windows：各进程都执行清扫
+    fcntl = None
+
+from flask import current_app, g, request
+from sqlalchemy import delete, func, insert, literal, select
+from werkzeug.exceptions import HTTPException
+
+from config import Config
+from jobs import QUEUED, RUNNING, owner_id, pid_alive
+from models import db, Job, QuotaReservation, UploadSession
+from transfer import UploadTooLarge, on_sent
+from uploads import upload_store
+
+logger = logging.getLogger(__name__)
+
+# 按 ID 批量查询任务时每批的数量（SQLite 绑定参数个数有上限）
+QUERY_CHUNK = 500
+
+
+class QuotaExceeded(HTTPException):
+    code = 507
+    description = '临时存储空间已超出配额，请先下载或等待旧任务被清理'
+
+
+# ---------- 工具 ----------
+def measure(path):
+    """返回 (总字节数, 最近一次写入的 mtime)；上传中的文件 mtime 随写入更新"""
+    st = os.stat(path, follow_symlinks=False)
+    if not os.path.isdir(path):
+        return st.st_size, st.st_mtime
+    size, newest = 0, st.st_mtime
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                fst = os.stat(os.path.join(root, name), follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            size += fst.st_size
+            newest = max(newest, fst.st_mtime)
+    return size, newest
+
+
+def remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def discard(temp_dir):
+    """请求被拒绝 / 出错时立即删除刚建立的任务目录"""
+    shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def _usage(user_id):
+    """用户占用的字节数（SQL 表达式）：未清理的任务 + 上传仓库中的上传 + 进行中上传的预留"""
+    jobs = (select(func.coalesce(func.sum(func.coalesce(Job.disk_bytes, Job.input_bytes)), 0))
+            .where(Job.user_id == user_id, Job.purged_at.is_(None)).scalar_subquery())
+    uploads = (select(func.coalesce(func.sum(UploadSession.size), 0))
+               .where(UploadSession.user_id == user_id).scalar_subquery())
+    reserved = (select(func.coalesce(func.sum(QuotaReservation.size), 0))
+                .where(QuotaReservation.user_id == user_id).scalar_subquery())
+    return jobs + uploads + reserved
+
+
+def user_usage(user_id):
+    """
+    用户尚未清理的任务占用的字节数（已完成的任务由清扫线程实测，其余按输入大小估计），
+    加上上传仓库中该用户的上传（未完成的按声明大小预留）与进行中上传的配额预留。
+    """
+    return db.session.execute(select(_usage(user_id))).scalar()
+
+
+def reserve(user_id, size, quota):
+    """原子地预留 size 字节：占用加上 size 不超过 quota 时插入预留记录并返回其 ID，否则返回 None"""
+    reservation_id = uuid.uuid4().hex
+    result = db.session.execute(
+        insert(QuotaReservation).from_select(
+            ['id', 'user_id', 'size', 'owner', 'created_at'],
+            select(literal(reservation_id), literal(user_id), literal(size), literal(owner_id()),
+                   literal(datetime.now())).where(_usage(user_id) + size <= quota))
+    )
+    db.session.commit()
+    return reservation_id if result.rowcount == 1 else None
+
+
+def release_reservations(exc=None):
+    """请求结束时删除本请求的配额预留（teardown_request）"""
+    ids = g.pop('quota_reservations', None)
+    if not ids:
+        return
+    db.session.rollback()
+    db.session.execute(delete(QuotaReservation).where(QuotaReservation.id.in_(ids)))
+    db.session.commit()
+
+
+@contextmanager
+def user_quota(user_id, size=None):
+    """
+    限制本次上传不超过用户剩余配额，yield 允许的最大请求体字节数。
+    接收之前预留 size 字节（默认取请求的 Content-Length，未知时预留全部剩余额度），预留失败返回 507。
+    匿名用户与未配置配额时只受 UPLOAD_MAX_BYTES 限制（总量由清扫线程兜底）。
+    """
+    quota = Config.TMP_USER_QUOTA_BYTES
+    if not quota or user_id is None:
+        yield Config.UPLOAD_MAX_BYTES
+        return
+    remaining = quota - user_usage(user_id)
+    if remaining <= 0:
+        raise QuotaExceeded()
+    if size is None:
+        size = request.content_length if request.content_length is not None else remaining
+    budget = min(Config.UPLOAD_MAX_BYTES, size)
+    reservation_id = reserve(user_id, budget, quota)
+    if reservation_id is None:
+        raise QuotaExceeded()
+    g.setdefault('quota_reservations', []).append(reservation_id)
+    try:
+        yield budget
+    except UploadTooLarge:
+        if budget < Config.UPLOAD_MAX_BYTES:
+            raise QuotaExceeded()
+        raise
+
+
+def purge_job(job_id):
+    """删除任务目录并标记任务已清理"""
+    job = db.session.get(Job, job_id)
+    if job is None or job.purged_at is not None:
+        return
+    remove(job.temp_dir)
+    job.purged_at = datetime.now()
+    db.session.commit()
+
+
+def delete_after_send(response, job):
+    """
+    结果完整发送后删除任务目录。
+    X-Accel-Redirect 时由 nginx 在响应之后才读文件，Range / HEAD 请求之后还会再来下载，
+    这些情况留给清扫线程处理。
+    """
+    if (not current_app.config['TMP_DELETE_AFTER_DOWNLOAD'] or request.method != 'GET'
+            or response.status_code != 200 or 'X-Accel-Redirect' in response.headers):
+        return response
+    app = current_app._get_current_object()
+    job_id = job.id
+    body = response.response
+
+    def cleanup():
+        # 流式 zip 中途断开时保留结果，等待重新下载
+        if not getattr(body, 'completed', True):
+            return
+        with app.app_context():
+            purge_job(job_id)
+    return on_sent(response, cleanup)
+
+
+# ---------- 后台清扫 ----------
+class TempSweeper:
+
+    def __init__(self):
+        self.app = None
+        self.root = None
+        self.interval = 600
+        self.lock_path = None
+        self._leader = None         # 持有清扫锁时为打开的锁文件
+        self._lock = threading.Lock()
+        self._started = False
+
+    def init_app(self, app):
+        self.app = app
+        self.root = app.config['UPLOAD_TMP_DIR']
+        self.interval = app.config['TMP_SWEEP_INTERVAL']
+        # 锁文件不能放在 tmp_uploads 中，否则会被当作条目清扫
+        self.lock_path = os.path.join(app.instance_path, 'tmp_sweeper.lock')
+        os.makedirs(self.root, exist_ok=True)
+        app.teardown_request(release_reservations)
+        app.extensions['tmp_sweeper'] = self
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._loop, name='tmp-sweeper', daemon=True).start()
+
+    def _elected(self):
+        """本进程是否负责清扫：取得（或已持有）清扫锁时为真；锁随进程退出自动释放"""
+        if fcntl is None or self._leader is not None:
+            return True
+        f = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return False
+        self._leader = f
+        logger.info('本进程 (pid %d) 负责清理 tmp_uploads', os.getpid())
+        return True
+
+    def _loop(self):
+        while True:
+            try:
+                if not self._elected():
+                    time.sleep(self.interval)
+                    continue
+                with self.app.app_context():
+                    self.sweep()
+                    self.expire_reservations()
+                    released = upload_store.sweep()
+                    if released:
+                        logger.info('释放过期上传 %d 个', released)
+            except Exception:
+                logger.exception('清理 tmp_uploads 出错')
+            time.sleep(self.interval)
+
+    def expire_reservations(self):
+        """删除本机已退出进程遗留的配额预留，以及超过 TMP_MAX_AGE 的预留（其他主机上的进程），返回删除数"""
+        host = socket.gethostname()
+        cutoff = datetime.fromtimestamp(time.time() - self.app.config['TMP_MAX_AGE'])
+        stale = []
+        for reservation in QuotaReservation.query.all():
+            owner_host, _, pid = (reservation.owner or '').rpartition(':')
+            if reservation.created_at < cutoff or (owner_host == host and pid.isdigit()
+                                                   and not pid_alive(int(pid))):
+                stale.append(reservation.id)
+        if stale:
+            db.session.execute(delete(QuotaReservation).where(QuotaReservation.id.in_(stale)))
+            db.session.commit()
+        return len(stale)
+
+    def _jobs(self, names):
+        jobs = {}
+        for i in range(0, len(names), QUERY_CHUNK):
+            for job in Job.query.filter(Job.id.in_(names[i:i + QUERY_CHUNK])):
+                jobs[job.id] = job
+        return jobs
+
+    def sweep(self):
+        """执行一轮清理，返回删除的条目数"""
+        cfg = self.app.config
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.root):
+            try:
+                size, newest = measure(entry.path)
+            except FileNotFoundError:
+                continue
+            entries.append([newest, size, entry.path, entry.name])
+        jobs = self._jobs([name for *_, name in entries])
+
+        removed, kept, total = [], [], 0
+        for newest, size, path, name in sorted(entries):
+            job = jobs.get(name)
+            if job is not None and job.status in (QUEUED, RUNNING):
+                total += size
+                continue
+            if job is None and now - newest < cfg['TMP_GRACE']:
+                total += size
+                continue
+            if now - newest > cfg['TMP_MAX_AGE']:
+                removed.append((path, job))
+            else:
+                kept.append((size, path, job))
+                total += size
+
+        # 按总大小淘汰：从最久未写入的开始，降到上限的 90%
+        if total > cfg['TMP_MAX_BYTES']:
+            target = cfg['TMP_MAX_BYTES'] * 0.9
+            while kept and total > target:
+                size, path, job = kept.pop(0)
+                removed.append((path, job))
+                total -= size
+
+        purged_at = datetime.now()
+        for path, job in removed:
+            remove(path)
+            if job is not None and job.purged_at is None:
+                job.purged_at = purged_at
+        for size, _, job in kept:
+            if job is not None:
+                job.disk_bytes = size
+        db.session.commit()
+        if removed:
+            logger.info('清理 tmp_uploads 条目 %d 个，剩余 %d 字节', len(removed), total)
+        return len(removed)
+
+
+tmp_sweeper = TempSweeper()
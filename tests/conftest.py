@@ -0,0 +1,30 @@
+"""
+测试夹具：仓库根目录下的模块直接导入（项目没有打包）。
+不导入 app.py（导入时会按 Config 建表、连接 instance/site.db），
+需要数据库的测试使用临时目录中的 SQLite 与最小的 Flask 应用。
+"""
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from models import db  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config.update(
+        TESTING=True,
+        SQLALCHEMY_DATABASE_URI=f'sqlite:///{tmp_path / "test.db"}',
+    )
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
@@ -0,0 +1,94 @@
+import importlib.util
+import os
+
+import pytest
+
+pytest.importorskip('Crypto', reason='AES 卡片依赖 pycryptodome')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_card(card_id):
+    """按路径加载卡片的 program/run.py（卡片不是包，平台以子进程执行）"""
+    spec = importlib.util.spec_from_file_location(
+        f'card_{card_id}', os.path.join(ROOT, 'functions', card_id, 'program', 'run.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(params=['AES', 'AES_crypt'])
+def aes(request, monkeypatch):
+    module = load_card(request.param)
+    # 块很小，覆盖跨块的流式加解密与并行 CTR
+    monkeypatch.setattr(module, 'CHUNK_SIZE', 64)
+    return module
+
+
+@pytest.fixture
+def key_file(tmp_path):
+    path = tmp_path / 'key.txt'
+    path.write_text('not-a-16-byte-key\n')
+    return str(path)
+
+
+SIZES = [0, 1, 15, 16, 17, 64, 65, 1000]
+
+
+def roundtrip(aes, tmp_path, key_file, data, mode, workers=None):
+    plain, cipher, out = tmp_path / 'plain.txt', tmp_path / 'cipher.enc', tmp_path / 'out.txt'
+    plain.write_bytes(data)
+    aes.encrypt_file(str(plain), key_file, str(cipher), mode, workers)
+    assert aes.decrypt_file(str(cipher), key_file, str(out), workers)
+    return cipher.read_bytes(), out.read_bytes()
+
+
+@pytest.mark.parametrize('size', SIZES)
+def test_cbc_roundtrip(aes, tmp_path, key_file, size):
+    data = os.urandom(size)
+    cipher, out = roundtrip(aes, tmp_path, key_file, data, 'cbc')
+    assert out == data
+    # 旧格式：IV + PKCS7 填充后的密文，没有文件头
+    assert len(cipher) == 16 + (size // 16 + 1) * 16
+    assert not cipher.startswith(aes.MAGIC)
+
+
+@pytest.mark.parametrize('size', SIZES)
+@pytest.mark.parametrize('workers', [1, 4])
+def test_ctr_roundtrip(aes, tmp_path, key_file, size, workers):
+    data = os.urandom(size)
+    cipher, out = roundtrip(aes, tmp_path, key_file, data, 'ctr', workers)
+    assert out == data
+    assert cipher.startswith(aes.MAGIC)
+    assert len(cipher) == len(aes.MAGIC) + 2 + aes.NONCE_SIZE + size + aes.TAG_SIZE
+
+
+def test_ctr_matches_across_worker_counts(aes, tmp_path, key_file):
+    # 并行度不影响密文格式：4 线程加密的文件可以单线程解密
+    data = os.urandom(1000)
+    plain, cipher, out = tmp_path / 'plain.txt', tmp_path / 'cipher.enc', tmp_path / 'out.txt'
+    plain.write_bytes(data)
+    aes.encrypt_file(str(plain), key_file, str(cipher), 'ctr', 4)
+    assert aes.decrypt_file(str(cipher), key_file, str(out), 1)
+    assert out.read_bytes() == data
+
+
+def test_ctr_tampered(aes, tmp_path, key_file):
+    plain, cipher, out = tmp_path / 'plain.txt', tmp_path / 'cipher.enc', tmp_path / 'out.txt'
+    plain.write_bytes(b'secret' * 50)
+    aes.encrypt_file(str(plain), key_file, str(cipher), 'ctr', 2)
+    data = bytearray(cipher.read_bytes())
+    data[40] ^= 1
+    cipher.write_bytes(bytes(data))
+    assert not aes.decrypt_file(str(cipher), key_file, str(out), 2)
+    assert not out.exists()
+
+
+def test_wrong_key(aes, tmp_path, key_file):
+    plain, cipher, out = tmp_path / 'plain.txt', tmp_path / 'cipher.enc', tmp_path / 'out.txt'
+    other = tmp_path / 'other.txt'
+    other.write_text('another key')
+    plain.write_bytes(b'secret' * 50)
+    aes.encrypt_file(str(plain), key_file, str(cipher), 'ctr', 2)
+    assert not aes.decrypt_file(str(cipher), str(other), str(out), 2)
+    assert not out.exists()
@@ -0,0 +1,119 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from jobs import QUEUED, RUNNING, JobScheduler, fair_order, owner_id
+from models import db, Job
+
+
+def queued(id, user_id, input_bytes=100, priority=1, age=0):
+    return SimpleNamespace(id=id, user_id=user_id, input_bytes=input_bytes, priority=priority,
+                           created_at=datetime.now() - timedelta(seconds=age))
+
+
+def ids(jobs):
+    return [job.id for job in jobs]
+
+
+# ---------- 调度顺序 ----------
+def test_least_loaded_user_first():
+    jobs = [queued('a1', 'a', age=10), queued('b1', 'b')]
+    assert ids(fair_order(jobs, {'a': 2}, 2)) == ['b1', 'a1']
+
+
+def test_users_interleave():
+    jobs = [queued(f'a{i}', 'a', age=30 - i) for i in range(3)] + [queued(f'b{i}', 'b', age=10 - i) for i in range(3)]
+    assert ids(fair_order(jobs, {}, 6)) == ['a0', 'b0', 'a1', 'b1', 'a2', 'b2']
+
+
+def test_share_is_weighted_by_priority():
+    # 优先级 2 的权重是优先级 1 的两倍：同样占用 2 个槽位，份额更小
+    jobs = [queued('low', 'b', priority=1, age=10), queued('high', 'a', priority=2)]
+    assert ids(fair_order(jobs, {'a': 2, 'b': 2}, 1)) == ['high']
+
+
+def test_per_user_cap():
+    jobs = [queued('a1', 'a'), queued('a2', 'a'), queued('b1', 'b')]
+    assert ids(fair_order(jobs, {'a': 1}, 3, max_per_user=2)) == ['b1', 'a1']
+
+
+def test_shortest_job_first_with_aging():
+    small = queued('small', 'a', input_bytes=100)
+    big = queued('big', 'a', input_bytes=10 ** 6, age=1)
+    assert ids(fair_order([big, small], {}, 1)) == ['small']
+    # 排队足够久后比较用的大小减半多次，大任务不会一直被插队
+    old_big = queued('old_big', 'a', input_bytes=10 ** 6, age=20 * 300)
+    assert ids(fair_order([small, old_big], {}, 1)) == ['old_big']
+
+
+def test_limit():
+    jobs = [queued(f'j{i}', f'u{i}') for i in range(5)]
+    assert len(fair_order(jobs, {}, 3)) == 3
+
+
+# ---------- 认领 ----------
+@pytest.fixture
+def scheduler(app):
+    scheduler = JobScheduler()
+    scheduler.app = app
+    scheduler.max_jobs = 3
+    scheduler.max_per_card = 1
+    scheduler.max_per_user = 1
+    return scheduler
+
+
+def add_job(id, function_id, user_id, status=QUEUED, **kwargs):
+    job = Job(id=id, function_id=function_id, user_id=user_id, status=status, temp_dir=f'/tmp/{id}',
+              input_paths='[]', output_paths='[]', created_at=datetime.now(), **kwargs)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def test_claim_respects_limits(scheduler):
+    jobs = [add_job('j1', 'a', 1), add_job('j2', 'b', 1), add_job('j3', 'a', 2),
+            add_job('j4', 'b', 2), add_job('j5', 'c', 3), add_job('j6', 'd', 4)]
+    claimed = [job.id for job in jobs if scheduler._claim(job)]
+    # j2：用户 1 已达上限；j3：卡片 a 已达上限；j6：全局已达上限
+    assert claimed == ['j1', 'j4', 'j5']
+    db.session.expire_all()
+    j1 = db.session.get(Job, 'j1')
+    assert (j1.status, j1.owner, j1.slots) == (RUNNING, owner_id(), 1)
+    assert j1.heartbeat_at is not None
+    assert db.session.get(Job, 'j6').status == QUEUED
+
+
+def test_claim_is_once(scheduler):
+    job = add_job('j1', 'a', 1)
+    assert scheduler._claim(job)
+    assert not scheduler._claim(job)
+
+
+def test_anonymous_users_share_a_cap(scheduler):
+    assert scheduler._claim(add_job('j1', 'a', None))
+    assert not scheduler._claim(add_job('j2', 'b', None))
+
+
+def test_extra_slots_count_towards_limits(scheduler):
+    job = add_job('j1', 'a', 1)
+    assert scheduler._claim(job)
+    scheduler.max_per_user = 2
+    scheduler.max_per_card = 2
+    assert scheduler.acquire_slot(job)
+    # 批量任务占用 2 个槽位，同一用户不能再认领
+    assert not scheduler._claim(add_job('j2', 'b', 1))
+    scheduler.release_slots(job)
+    assert scheduler._claim(db.session.get(Job, 'j2'))
+
+
+def test_recover_by_heartbeat(scheduler):
+    stale = datetime.now() - timedelta(hours=1)
+    add_job('lost', 'a', 1, status=RUNNING, owner='gone-host:1', started_at=stale, heartbeat_at=stale)
+    add_job('alive', 'b', 2, status=RUNNING, owner='other-host:1', started_at=stale,
+            heartbeat_at=datetime.now())
+    assert scheduler.recover() == 1
+    db.session.expire_all()
+    lost = db.session.get(Job, 'lost')
+    assert (lost.status, lost.owner, lost.heartbeat_at) == (QUEUED, None, None)
+    assert db.session.get(Job, 'alive').status == RUNNING
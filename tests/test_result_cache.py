@@ -0,0 +1,78 @@
+import os
+import shutil
+
+import pytest
+
+from result_cache import ResultCache
+from transfer import archive_names
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = ResultCache()
+    cache.cache_dir = str(tmp_path / 'cache')
+    cache.max_bytes = 10 ** 6
+    os.makedirs(cache.cache_dir)
+    monkeypatch.setattr(cache, 'code_version', lambda card_id: 'v1')
+    return cache
+
+
+def write_outputs(directory, files):
+    """在 <directory>/outputs/<序号>/ 下写入输出文件，模拟一次执行（inprocess 卡片的输出布局）"""
+    paths = []
+    for i, (name, data) in enumerate(files):
+        path = os.path.join(directory, 'outputs', str(i), name)
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(data)
+        paths.append(path)
+    return paths
+
+
+def test_key_depends_on_inputs_names_and_options(cache):
+    base = cache.key('calc_md5', ['d1'], ['input_0_a.txt'])
+    assert cache.key('calc_md5', ['d1'], ['input_0_a.txt']) == base
+    assert cache.key('calc_md5', ['d2'], ['input_0_a.txt']) != base
+    assert cache.key('calc_md5', ['d1'], ['input_0_b.txt']) != base
+    assert cache.key('calc_md5', ['d1'], ['input_0_a.txt'], {'algorithms': 'sha256'}) != base
+    assert cache.key('AES', ['d1'], ['input_0_a.txt']) != base
+
+
+def test_miss(cache):
+    assert cache.lookup(cache.key('calc_md5', ['d'], ['a']), 1) is None
+
+
+def test_hit_has_same_archive_layout_as_miss(cache, tmp_path):
+    files = [('report.txt', b'r1'), ('report.txt', b'r2'), ('data.bin', b'\0' * 10)]
+    miss = write_outputs(str(tmp_path / 'job1'), files)
+    key = cache.key('card', ['d'], ['a'])
+    cache.store(key, miss)
+
+    cached = cache.lookup(key, len(files))
+    hit = cache.link_into(cached, str(tmp_path / 'job2'))
+    assert [os.path.relpath(p, tmp_path / 'job2') for p in hit] == \
+        [os.path.relpath(p, tmp_path / 'job1') for p in miss]
+    assert archive_names(hit) == archive_names(miss) == ['0/report.txt', '1/report.txt', '2/data.bin']
+    for a, b in zip(miss, hit):
+        with open(a, 'rb') as fa, open(b, 'rb') as fb:
+            assert fa.read() == fb.read()
+
+
+def test_hit_survives_eviction(cache, tmp_path):
+    key = cache.key('card', ['d'], ['a'])
+    cache.store(key, write_outputs(str(tmp_path / 'job1'), [('out.txt', b'x')]))
+    hit = cache.link_into(cache.lookup(key, 1), str(tmp_path / 'job2'))
+    # 硬链接进任务目录，缓存条目被淘汰后任务结果仍然可以下载
+    shutil.rmtree(cache.cache_dir)
+    with open(hit[0], 'rb') as f:
+        assert f.read() == b'x'
+
+
+def test_total_stays_under_limit(cache, tmp_path):
+    cache.max_bytes = 250
+    for i in range(5):
+        key = cache.key('card', [str(i)], ['a'])
+        cache.store(key, write_outputs(str(tmp_path / f'job{i}'), [('out.bin', b'x' * 100)]))
+    assert cache._read_total() <= cache.max_bytes
+    # 最近写入的条目保留
+    assert cache.lookup(cache.key('card', ['4'], ['a']), 1) is not None
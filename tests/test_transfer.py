@@ -0,0 +1,102 @@
+import hashlib
+import os
+
+import pytest
+from flask import Flask
+from werkzeug.exceptions import BadRequest
+
+from transfer import UploadTooLarge, archive_names, stream_upload
+
+BOUNDARY = 'XXboundaryXX'
+
+
+def multipart(*parts):
+    """parts: (字段名, 文件名或 None, 内容)；文件名为 None 时是普通字段"""
+    body = b''
+    for name, filename, data in parts:
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        body += (f'--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n'
+                 f'Content-Type: application/octet-stream\r\n\r\n').encode() + data + b'\r\n'
+    return body + f'--{BOUNDARY}--\r\n'.encode()
+
+
+def upload(tmp_path, body, max_bytes=None, chunk_size=7):
+    app = Flask(__name__)
+    with app.test_request_context('/', method='POST', data=body,
+                                  content_type=f'multipart/form-data; boundary={BOUNDARY}'):
+        # 块很小，文件内容与分隔符跨块
+        return stream_upload(str(tmp_path), lambda field, name: f'{field}_{name}', max_bytes, chunk_size)
+
+
+def test_files_and_fields(tmp_path):
+    content = b'hello world\r\n' * 100
+    fields, files, digests = upload(tmp_path, multipart(
+        ('input_0', 'a.txt', content),
+        ('option_algorithms', None, b'sha256'),
+    ))
+    assert fields == {'option_algorithms': 'sha256'}
+    path = str(tmp_path / 'input_0_a.txt')
+    assert files == {'input_0': [path]}
+    with open(path, 'rb') as f:
+        assert f.read() == content
+    assert digests == {path: hashlib.sha256(content).hexdigest()}
+
+
+def test_empty_filename_is_not_an_upload(tmp_path):
+    # 浏览器对没有选择文件的输入框仍发送文件名为空的部分
+    fields, files, digests = upload(tmp_path, multipart(
+        ('input_0', '', b''),
+        ('input_1', 'b.txt', b'data'),
+    ))
+    assert 'input_0' not in files
+    assert files == {'input_1': [str(tmp_path / 'input_1_b.txt')]}
+    assert os.listdir(tmp_path) == ['input_1_b.txt']
+
+
+def test_empty_file_with_name_is_kept(tmp_path):
+    _, files, digests = upload(tmp_path, multipart(('input_0', 'empty.txt', b'')))
+    path = str(tmp_path / 'input_0_empty.txt')
+    assert files == {'input_0': [path]}
+    assert os.path.getsize(path) == 0
+    assert digests[path] == hashlib.sha256(b'').hexdigest()
+
+
+def test_same_field_multiple_files(tmp_path):
+    app = Flask(__name__)
+    body = multipart(('input_0', 'a.txt', b'1'), ('input_0', 'b.txt', b'2'))
+    with app.test_request_context('/', method='POST', data=body,
+                                  content_type=f'multipart/form-data; boundary={BOUNDARY}'):
+        counter = iter(range(10))
+        _, files, _ = stream_upload(str(tmp_path), lambda field, name: f'{field}_{next(counter)}_{name}')
+    assert [os.path.basename(p) for p in files['input_0']] == ['input_0_0_a.txt', 'input_0_1_b.txt']
+
+
+def test_unknown_file_field_is_dropped(tmp_path):
+    _, files, _ = upload(tmp_path, multipart(('../evil', 'x.txt', b'x'), ('input_0', 'a.txt', b'a')))
+    assert list(files) == ['input_0']
+    assert os.listdir(tmp_path) == ['input_0_a.txt']
+
+
+def test_filename_is_sanitized(tmp_path):
+    _, files, _ = upload(tmp_path, multipart(('input_0', '../../etc/passwd', b'a')))
+    assert os.path.dirname(files['input_0'][0]) == str(tmp_path)
+
+
+def test_too_large(tmp_path):
+    with pytest.raises(UploadTooLarge):
+        upload(tmp_path, multipart(('input_0', 'a.txt', b'x' * 1000)), max_bytes=100)
+
+
+def test_not_multipart(tmp_path):
+    app = Flask(__name__)
+    with app.test_request_context('/', method='POST', data=b'{}', content_type='application/json'):
+        with pytest.raises(BadRequest):
+            stream_upload(str(tmp_path), lambda field, name: name)
+
+
+def test_archive_names():
+    assert archive_names(['/t/outputs/0/report.txt', '/t/outputs/1/data.bin']) == ['report.txt', 'data.bin']
+    # 重名时加序号目录
+    assert archive_names(['/t/a/out.txt', '/t/b/out.txt']) == ['0/out.txt', '1/out.txt']
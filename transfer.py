@@ -0,0 +1,204 @@
+"""
+大文件传输：
+- 上传：直接解析请求体中的 multipart 流，按块写入任务临时目录，
+  不经过 werkzeug 的临时文件，也不在内存中缓冲整个文件；
+  读一块、写一块，磁盘写不动时自然不再从 socket 读取（背压）。
+  上传的同时计算每个文件的 SHA-256，供结果缓存使用。
+- 下载：开启 USE_X_ACCEL_REDIRECT 时交给 nginx 直接发送，
+  否则用 send_file（gunicorn 下走 wsgi.file_wrapper / sendfile）；
+  多个输出以流式 zip 边读边发（见 zipstream.py）。
+
+nginx 配置示例：
+    location /_tmp_uploads/ {
+        internal;
+        alias /srv/app/tmp_uploads/;
+    }
+"""
+import hashlib
+import os
+import re
+import time
+from urllib.parse import quote
+
+from flask import current_app, request, send_file
+from werkzeug.exceptions import BadRequest, NotFound, RequestEntityTooLarge
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+from werkzeug.utils import secure_filename, send_file as _werkzeug_send_file
+
+from config import Config
+from metrics import SEND_SECONDS, ZIP_SECONDS
+from zipstream import ZipStream
+
+
+class UploadTooLarge(RequestEntityTooLarge):
+    description = '上传文件超过大小限制'
+
+
+# 只接受这些字段名的文件，其余文件部分直接丢弃（字段名会成为落盘文件名的一部分）
+UPLOAD_FIELD = re.compile(r'input_\d+|batch_zip')
+
+
+def _open_upload(temp_dir, field_name, filename, name_for):
+    safe_name = secure_filename(filename or '') or 'upload'
+    name = secure_filename(name_for(field_name, safe_name))
+    path = os.path.join(temp_dir, name)
+    if not name or os.path.dirname(os.path.realpath(path)) != os.path.realpath(temp_dir):
+        raise BadRequest('非法的上传文件名')
+    return path, open(path, 'wb')
+
+
+def stream_upload(temp_dir, name_for, max_bytes=None, chunk_size=None):
+    """
+    把 multipart 请求体流式写入 temp_dir。
+    :param name_for: (字段名, 安全文件名) -> 落盘文件名
+    :param max_bytes: 请求体允许的最大字节数（None 表示取 Config.UPLOAD_MAX_BYTES）
+    :return: (fields, files, digests)；fields 为普通表单字段 {name: value}，
+             files 为 {字段名: [落盘路径, ...]}（同一字段可上传多个文件，只接受 UPLOAD_FIELD 字段，
+             忽略文件名为空的部分），
+             digests 为 {落盘路径: SHA-256 十六进制}
+    """
+    max_bytes = Config.UPLOAD_MAX_BYTES if max_bytes is None else max_bytes
+    chunk_size = chunk_size or Config.UPLOAD_CHUNK_SIZE
+
+    mimetype, options = parse_options_header(request.headers.get('Content-Type', ''))
+    if mimetype != 'multipart/form-data' or 'boundary' not in options:
+        raise BadRequest('需要 multipart/form-data 上传')
+    if request.content_length is not None and request.content_length > max_bytes:
+        raise UploadTooLarge()
+
+    decoder = MultipartDecoder(options['boundary'].encode('ascii'))
+    stream = request.stream
+    fields, files, digests = {}, {}, {}
+    hasher = None
+    current, sink, field_parts, field_size = None, None, None, 0
+    received = 0
+    try:
+        while True:
+            chunk = stream.read(chunk_size)
+            received += len(chunk)
+            if received > max_bytes:
+                raise UploadTooLarge()
+            decoder.receive_data(chunk or None)
+            event = decoder.next_event()
+            while not isinstance(event, (NeedData, Epilogue)):
+                if isinstance(event, File) and not UPLOAD_FIELD.fullmatch(event.name):
+                    current = None          # 不认识的文件字段：丢弃内容
+                elif isinstance(event, File) and not event.filename:
+                    current = None          # 未选择文件的输入框（浏览器仍发送空的文件部分）：视为没有上传
+                elif isinstance(event, File):
+                    current = event
+                    path, sink = _open_upload(temp_dir, event.name, event.filename, name_for)
+                    hasher = hashlib.sha256()
+                    files.setdefault(event.name, []).append(path)
+                elif isinstance(event, Field):
+                    current, field_parts, field_size = event, [], 0
+                elif isinstance(event, Data):
+                    if current is None:
+                        pass
+                    elif isinstance(current, File):
+                        sink.write(event.data)
+                        hasher.update(event.data)
+                        if not event.more_data:
+                            sink.close()
+                            sink = None
+                            digests[files[current.name][-1]] = hasher.hexdigest()
+                    else:
+                        # 普通字段保存在内存中，单独限制大小
+                        field_size += len(event.data)
+                        if field_size > Config.UPLOAD_MAX_FIELD_BYTES:
+                            raise RequestEntityTooLarge()
+                        field_parts.append(event.data)
+                        if not event.more_data:
+                            fields[current.name] = b''.join(field_parts).decode('utf-8', 'replace')
+                event = decoder.next_event()
+            if not chunk or isinstance(event, Epilogue):
+                break
+    finally:
+        if sink is not None:
+            sink.close()
+    return fields, files, digests
+
+
+def _accel_uri(path):
+    """把本地路径映射为 nginx internal location 下的 URI，不在映射目录中时返回 None"""
+    path = os.path.abspath(path)
+    for local_dir, prefix in current_app.config['X_ACCEL_REDIRECT_MAP'].items():
+        local_dir = os.path.abspath(local_dir)
+        if os.path.commonpath([path, local_dir]) == local_dir:
+            relative = os.path.relpath(path, local_dir).replace(os.sep, '/')
+            return prefix.rstrip('/') + '/' + quote(relative)
+    return None
+
+
+def on_sent(response, callback):
+    """
+    响应体发送完毕（连接关闭）后调用 callback。
+    send_file 的响应是 direct_passthrough，直接交给 wsgi.file_wrapper 发送，
+    werkzeug 不会调用 call_on_close 注册的函数，因此挂在文件包装对象的 close 上。
+    """
+    body = response.response
+    if response.direct_passthrough and hasattr(body, 'close'):
+        close = body.close
+
+        def closing():
+            try:
+                close()
+            finally:
+                callback()
+        body.close = closing
+    else:
+        response.call_on_close(callback)
+    return response
+
+
+def _timed(response, function_id, start, outcome=lambda: 'ok'):
+    # 响应体发送完毕、连接关闭时记录发送耗时；文件响应整体交给服务器 / nginx 发送，记为 ok
+    return on_sent(response,
+                   lambda: SEND_SECONDS.observe(time.perf_counter() - start, function_id=function_id,
+                                                outcome=outcome()))
+
+
+def send_result(path, download_name=None, function_id=''):
+    """发送结果文件；Flask worker 本身不持有结果内容"""
+    start = time.perf_counter()
+    download_name = download_name or os.path.basename(path)
+    uri = _accel_uri(path) if current_app.config['USE_X_ACCEL_REDIRECT'] else None
+    if uri is not None:
+        response = _werkzeug_send_file(path, request.environ, as_attachment=True,
+                                       download_name=download_name, use_x_sendfile=True)
+        del response.headers['X-Sendfile']
+        response.headers['X-Accel-Redirect'] = uri
+        return _timed(response, function_id, start)
+    return _timed(send_file(path, as_attachment=True, download_name=download_name), function_id, start)
+
+
+def archive_names(output_paths):
+    """压缩包内的文件名默认取各输出的文件名，重名时加序号目录，与输出文件存放的位置（任务目录或结果缓存）无关"""
+    names = [os.path.basename(path) for path in output_paths]
+    if len(set(names)) < len(names):
+        names = [f'{i}/{name}' for i, name in enumerate(names)]
+    return names
+
+
+def send_outputs(output_paths, function_id='', names=None, always_zip=False):
+    """
+    单个输出直接发送；多个输出（或 always_zip 为真时）打包为 outputs.zip，边读取边压缩边发送，不落盘。
+    :param names: 压缩包内的文件名，与 output_paths 一一对应（None 表示取 archive_names）
+    """
+    if not output_paths:
+        raise NotFound('任务没有输出文件')
+    if len(output_paths) == 1 and not always_zip:
+        return send_result(output_paths[0], function_id=function_id)
+
+    start = time.perf_counter()
+    names = archive_names(output_paths) if names is None else names
+    archive = ZipStream(list(zip(output_paths, names)))
+    response = current_app.response_class(archive, mimetype='application/zip')
+    response.headers['Content-Disposition'] = 'attachment; filename=outputs.zip'
+    # 全部 STORED 时大小已知，客户端可以显示下载进度
+    response.content_length = archive.content_length()
+    # 客户端中途断开时压缩包没有生成完
+    outcome = lambda: 'ok' if archive.completed else 'aborted'
+    on_sent(response, lambda: ZIP_SECONDS.observe(archive.busy, function_id=function_id, outcome=outcome()))
+    return _timed(response, function_id, start, outcome)
@@ -0,0 +1,281 @@
+"""
+内容寻址、可续传的上传仓库。
+
+instance/uploads/
+    partial/<上传 ID>         上传中的文件，文件大小即当前偏移
+    blobs/<sha[:2]>/<sha>    完整内容（只读），相同内容只保存一份
+    .lock                    完成 / 释放上传时的跨进程锁
+
+流程（与 tus 协议类似，见 uploads_bp.py）：
+    POST   /uploads           {"filename": ..., "size": ...} -> 201 {"id": ..., "offset": 0, ...}
+    PATCH  /uploads/<id>      请求头 Upload-Offset: <偏移>，请求体为从该偏移开始的一段数据
+    GET    /uploads/<id>      查询当前偏移，断线后从该偏移继续
+    DELETE /uploads/<id>      释放上传句柄
+服务器边接收边计算摘要；最后一块写完后内容移入 blobs/，已有相同内容时丢弃副本、引用计数加一。
+完成的上传 ID 即上传句柄：POST /function/<id> 以表单字段 input_<i>_upload 引用，
+blob 被硬链接进任务目录，并写入 <文件>.digests 旁注，calc_md5 据此跳过已经算过的摘要。
+
+客户端必须上传完整内容，不能凭声明的 SHA-256 直接取得已有内容的句柄（否则可借助卡片读出他人的文件）。
+上传会话属于登录用户（匿名用户不能使用可续传上传），计入用户配额；
+仓库总大小不超过 UPLOAD_STORE_MAX_BYTES，新建上传时按需从最久未使用的句柄开始释放，仍不够时返回 507。
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:         # Windows：只有进程内的锁
+    fcntl = None
+
+from sqlalchemy import func
+from werkzeug.exceptions import BadRequest, Conflict, HTTPException
+
+from config import Config
+from models import db, UploadBlob, UploadSession
+from transfer import UploadTooLarge
+
+DIGEST_SUFFIX = '.digests'
+
+
+class OffsetMismatch(Exception):
+    """PATCH 的 Upload-Offset 与服务器上的偏移不一致，客户端应从 offset 继续"""
+
+    def __init__(self, offset):
+        super().__init__(f'偏移不匹配，当前偏移为 {offset}')
+        self.offset = offset
+
+
+class StoreFull(HTTPException):
+    code = 507
+    description = '上传仓库空间不足，请稍后再试'
+
+
+def write_sidecar(path, digests):
+    """在 path 旁写入摘要旁注；记录文件大小与 mtime，文件被改动后旁注自动失效"""
+    st = os.stat(path)
+    with open(path + DIGEST_SUFFIX, 'w', encoding='utf-8') as f:
+        json.dump({'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'digests': digests}, f)
+
+
+class UploadStore:
+
+    def __init__(self):
+        self.root = None
+        self._lock = threading.Lock()
+        self._hashers = {}          # 上传 ID -> (已计算到的偏移, {算法: hash 对象})
+
+    def init_app(self, app):
+        self.root = app.config['UPLOAD_STORE_DIR']
+        os.makedirs(os.path.join(self.root, 'partial'), exist_ok=True)
+        os.makedirs(os.path.join(self.root, 'blobs'), exist_ok=True)
+        app.extensions['upload_store'] = self
+
+    # ---------- 路径与锁 ----------
+    def _partial(self, upload_id):
+        return os.path.join(self.root, 'partial', upload_id)
+
+    def blob_path(self, sha256):
+        return os.path.join(self.root, 'blobs', sha256[:2], sha256)
+
+    @contextmanager
+    def _store_lock(self):
+        """新建、完成与释放上传时持有，避免并发的"引用计数归零删除"与"相同内容入库"交错，并发新建不会越过总大小上限"""
+        with self._lock, open(os.path.join(self.root, '.lock'), 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    # ---------- 会话 ----------
+    def create(self, user_id, filename, size):
+        if user_id is None:
+            raise BadRequest('可续传上传需要登录')
+        if size < 0:
+            raise BadRequest('size 不能为负数')
+        if size > Config.UPLOAD_MAX_BYTES:
+            raise UploadTooLarge()
+        now = datetime.now()
+        upload = UploadSession(id=uuid.uuid4().hex, user_id=user_id, filename=filename[:255] or 'upload',
+                               size=size, received=0, created_at=now, updated_at=now)
+        # 在仓库锁内预留空间并登记会话，并发的新建上传不会一起越过总大小上限
+        with self._store_lock():
+            self._make_room(size)
+            open(self._partial(upload.id), 'wb').close()
+            db.session.add(upload)
+            db.session.commit()
+        if size == 0:
+            self._finish(upload, self._new_hashers())
+        return upload
+
+    def total_bytes(self):
+        """仓库占用：已入库的内容加上未完成上传的声明大小"""
+        blobs = db.session.query(func.sum(UploadBlob.size)).scalar()
+        partial = (db.session.query(func.sum(UploadSession.size))
+                   .filter(UploadSession.sha256.is_(None)).scalar())
+        return (blobs or 0) + (partial or 0)
+
+    def _make_room(self, size):
+        """（持有仓库锁）从最久未使用的句柄开始释放，直到放得下 size 字节；放不下时抛出 StoreFull"""
+        limit = Config.UPLOAD_STORE_MAX_BYTES
+        if size > limit:
+            raise StoreFull()
+        while self.total_bytes() + size > limit:
+            oldest = (UploadSession.query.filter(UploadSession.sha256.isnot(None))
+                      .order_by(UploadSession.updated_at).first())
+            if oldest is None:
+                raise StoreFull()
+            self._release(oldest)
+
+    def get(self, upload_id, user_id):
+        """取得上传会话；不存在或不属于该（登录）用户时返回 None。未完成时偏移以磁盘上的文件大小为准"""
+        upload = db.session.get(UploadSession, upload_id)
+        if upload is None or user_id is None or upload.user_id != user_id:
+            return None
+        if upload.sha256 is None:
+            try:
+                upload.received = os.path.getsize(self._partial(upload.id))
+            except OSError:
+                pass
+        return upload
+
+    # ---------- 写入 ----------
+    @staticmethod
+    def _new_hashers():
+        names = dict.fromkeys(('sha256',) + tuple(Config.UPLOAD_STORE_DIGESTS))
+        return {name: hashlib.new(name) for name in names}
+
+    def _resume_hashers(self, upload_id, f, offset):
+        """取得计算到 offset 的摘要状态；进程重启或由其他 worker 接收过前面的块时重新读一遍已有内容"""
+        state = self._hashers.pop(upload_id, None)
+        if state is not None and state[0] == offset:
+            return state[1]
+        hashers = self._new_hashers()
+        f.seek(0)
+        remaining = offset
+        while remaining:
+            chunk = f.read(min(Config.UPLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            for h in hashers.values():
+                h.update(chunk)
+        return hashers
+
+    def append(self, upload, offset, stream):
+        """从 offset 起追加一段数据（读到 stream 结束），最后一块写完后完成上传"""
+        if upload.sha256 is not None:
+            raise Conflict('上传已完成')
+        with open(self._partial(upload.id), 'r+b') as f:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise Conflict('另一个请求正在写入该上传')
+            current = os.fstat(f.fileno()).st_size
+            if offset != current:
+                raise OffsetMismatch(current)
+            hashers = self._resume_hashers(upload.id, f, current)
+            f.seek(current)
+            received = current
+            try:
+                while chunk := stream.read(Config.UPLOAD_CHUNK_SIZE):
+                    if received + len(chunk) > upload.size:
+                        raise BadRequest(f'数据超出声明的文件大小 {upload.size}')
+                    f.write(chunk)
+                    received += len(chunk)
+                    for h in hashers.values():
+                        h.update(chunk)
+            finally:
+                # 断线时已写入的部分保留，客户端查询偏移后继续
+                f.flush()
+                f.truncate(received)
+                self._hashers[upload.id] = (received, hashers)
+            upload.received = received
+            upload.updated_at = datetime.now()
+            db.session.commit()
+            if received == upload.size:
+                self._finish(upload, hashers)
+        return upload
+
+    def _finish(self, upload, hashers):
+        digests = {name: h.hexdigest() for name, h in hashers.items()}
+        sha256 = digests['sha256']
+        partial = self._partial(upload.id)
+        target = self.blob_path(sha256)
+        with self._store_lock():
+            blob = db.session.get(UploadBlob, sha256)
+            if blob is None:
+                blob = UploadBlob(sha256=sha256, size=upload.size, digests=json.dumps(digests),
+                                  refcount=0, created_at=datetime.now())
+                db.session.add(blob)
+            blob.refcount += 1
+            if os.path.exists(target):
+                os.remove(partial)          # 相同内容已在仓库中
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.chmod(partial, 0o444)
+                os.replace(partial, target)
+            upload.sha256 = sha256
+            upload.received = upload.size
+            db.session.commit()
+        self._hashers.pop(upload.id, None)
+
+    # ---------- 使用与释放 ----------
+    def link_into(self, upload, directory, name):
+        """把上传内容硬链接进任务目录并写入摘要旁注，返回 (路径, SHA-256)"""
+        blob = db.session.get(UploadBlob, upload.sha256)
+        path = os.path.join(directory, name)
+        try:
+            os.link(self.blob_path(upload.sha256), path)
+        except OSError:             # 仓库与任务目录不在同一文件系统
+            shutil.copyfile(self.blob_path(upload.sha256), path)
+        write_sidecar(path, json.loads(blob.digests) if blob.digests else {'sha256': upload.sha256})
+        upload.updated_at = datetime.now()        # 句柄被使用，延长保留时间
+        db.session.commit()
+        return path, upload.sha256
+
+    def release(self, upload):
+        """释放上传句柄；内容的引用计数归零时从仓库删除（已硬链接进任务目录的文件不受影响）"""
+        with self._store_lock():
+            self._release(upload)
+
+    def _release(self, upload):
+        if upload.sha256 is None:
+            try:
+                os.remove(self._partial(upload.id))
+            except FileNotFoundError:
+                pass
+        else:
+            blob = db.session.get(UploadBlob, upload.sha256)
+            if blob is not None:
+                blob.refcount -= 1
+                if blob.refcount <= 0:
+                    db.session.delete(blob)
+                    try:
+                        os.remove(self.blob_path(upload.sha256))
+                    except FileNotFoundError:
+                        pass
+        db.session.delete(upload)
+        db.session.commit()
+        self._hashers.pop(upload.id, None)
+
+    def sweep(self):
+        """释放超过 UPLOAD_SESSION_TTL 未续传的上传与超过 UPLOAD_HANDLE_TTL 未使用的句柄，返回释放数"""
+        now = datetime.now()
+        stale = UploadSession.query.filter(db.or_(
+            db.and_(UploadSession.sha256.is_(None),
+                    UploadSession.updated_at < now - timedelta(seconds=Config.UPLOAD_SESSION_TTL)),
+            db.and_(UploadSession.sha256.isnot(None),
+                    UploadSession.updated_at < now - timedelta(seconds=Config.UPLOAD_HANDLE_TTL)),
+        )).all()
+        for upload in stale:
+            self.release(upload)
+        return len(stale)
+
+
+upload_store = UploadStore()
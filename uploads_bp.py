@@ -0,0 +1,80 @@
+from flask import Blueprint, request, jsonify, abort, url_for
+from flask_login import current_user
+
+from uploads import upload_store, OffsetMismatch
+from sweeper import user_quota
+from transfer import UploadTooLarge
+
+bp = Blueprint('uploads', __name__, url_prefix='/uploads')
+
+
+# ---------- 工具 ----------
+@bp.before_request
+def require_login():
+    """上传会话按用户隔离并计入用户配额，匿名用户不能使用（脚本客户端以 API 令牌登录）"""
+    if not current_user.is_authenticated:
+        return jsonify({'error': '可续传上传需要登录'}), 401
+
+
+def current_owner():
+    return current_user.id
+
+
+def get_upload_or_404(upload_id):
+    """取上传会话；只有上传者本人可见"""
+    upload = upload_store.get(upload_id, current_owner())
+    if upload is None:
+        abort(404)
+    return upload
+
+
+def upload_response(upload, status=200):
+    response = jsonify(upload.to_dict())
+    response.status_code = status
+    response.headers['Upload-Offset'] = str(upload.received)
+    response.headers['Upload-Length'] = str(upload.size)
+    response.cache_control.no_store = True
+    return response
+
+
+# ---------- 路由 ----------
+@bp.route('', methods=['POST'])
+def create():
+    data = request.get_json(silent=True) or request.form
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return jsonify({'error': '缺少文件大小 size'}), 400
+    with user_quota(current_owner(), size) as budget:
+        if size > budget:
+            raise UploadTooLarge()
+        upload = upload_store.create(current_owner(), str(data.get('filename') or ''), size)
+    response = upload_response(upload, 201)
+    response.headers['Location'] = url_for('uploads.status', upload_id=upload.id)
+    return response
+
+
+@bp.route('/<upload_id>', methods=['GET', 'HEAD'])
+def status(upload_id):
+    return upload_response(get_upload_or_404(upload_id))
+
+
+@bp.route('/<upload_id>', methods=['PATCH'])
+def append(upload_id):
+    upload = get_upload_or_404(upload_id)
+    try:
+        offset = int(request.headers['Upload-Offset'])
+    except (KeyError, ValueError):
+        return jsonify({'error': '缺少请求头 Upload-Offset'}), 400
+    try:
+        upload_store.append(upload, offset, request.stream)
+    except OffsetMismatch as e:
+        upload.received = e.offset
+        return upload_response(upload, 409)
+    return upload_response(upload)
+
+
+@bp.route('/<upload_id>', methods=['DELETE'])
+def delete(upload_id):
+    upload_store.release(get_upload_or_404(upload_id))
+    return '', 204
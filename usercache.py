@@ -0,0 +1,142 @@
+"""
+登录态快速路径：
+- user_loader 命中进程内 TTL 缓存时不访问数据库，缓存的是列值，
+  每次请求用 make_transient_to_detached + session.merge(load=False) 还原为会话内对象（不发 SQL）；
+- API token（Authorization: Bearer <token>）供脚本客户端使用，不需要表单登录与 cookie，
+  数据库中只保存 token 的 SHA-256，token -> 用户 ID 同样走 TTL 缓存。
+
+用户 / token 在本进程被修改或删除时通过 SQLAlchemy 事件立即失效，
+其他 gunicorn worker 最多在 USER_CACHE_TTL 秒后看到变化。
+"""
+import hashlib
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from models import db, User, ApiToken
+
+TOKEN_PREFIX = 'dp_'
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+class TTLCache:
+    """带过期时间与容量上限的字典（超出容量时丢弃最早写入的条目）"""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is None:
+                return None
+            if hit[0] < time.monotonic():
+                del self._data[key]
+                return None
+            return hit[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class UserCache:
+
+    def __init__(self):
+        self.users = TTLCache(30, 10000)
+        self.tokens = TTLCache(30, 10000)
+        self._events = False
+
+    def init_app(self, app):
+        ttl = app.config['USER_CACHE_TTL']
+        max_entries = app.config['USER_CACHE_MAX']
+        self.users = TTLCache(ttl, max_entries)
+        self.tokens = TTLCache(ttl, max_entries)
+        app.extensions['user_cache'] = self
+        if not self._events:
+            # 角色 / 密码修改或删除用户后立即失效
+            event.listen(User, 'after_update', self._user_changed)
+            event.listen(User, 'after_delete', self._user_changed)
+            event.listen(ApiToken, 'after_delete', self._token_changed)
+            self._events = True
+
+    def _user_changed(self, mapper, connection, target):
+        self.users.pop(target.id)
+
+    def _token_changed(self, mapper, connection, target):
+        self.tokens.pop(target.token_hash)
+
+    # ---------- 用户 ----------
+    def get(self, user_id):
+        values = self.users.get(user_id)
+        if values is None:
+            user = db.session.get(User, user_id)
+            if user is None:
+                return None
+            self.users.set(user_id, {attr.key: getattr(user, attr.key)
+                                     for attr in inspect(User).column_attrs})
+            return user
+        user = User(**values)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    # ---------- API token ----------
+    def issue_token(self, user, name=''):
+        """签发新 token，返回明文（只在此时可见）"""
+        token = TOKEN_PREFIX + secrets.token_urlsafe(32)
+        db.session.add(ApiToken(user_id=user.id, name=name[:64], token_hash=hash_token(token),
+                                created_at=datetime.now()))
+        db.session.commit()
+        return token
+
+    def revoke_token(self, token):
+        """吊销 token，返回是否存在"""
+        row = ApiToken.query.filter_by(token_hash=hash_token(token)).first()
+        if row is None:
+            return False
+        db.session.delete(row)
+        db.session.commit()
+        return True
+
+    def user_for_token(self, token):
+        token_hash = hash_token(token)
+        user_id = self.tokens.get(token_hash)
+        if user_id is None:
+            row = ApiToken.query.filter_by(token_hash=token_hash).first()
+            if row is None:
+                return None
+            user_id = row.user_id
+            self.tokens.set(token_hash, user_id)
+        return self.get(user_id)
+
+    def load_from_request(self, request):
+        """flask_login request_loader：解析 Authorization: Bearer <token>"""
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not token.strip():
+            return None
+        return self.user_for_token(token.strip())
+
+
+user_cache = UserCache()
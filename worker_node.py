@@ -0,0 +1,295 @@
+"""
+执行节点：在其他机器上运行卡片（函数任务、批量条目与流水线步骤），由 Web 主机的 RemoteExecutor（executors.py）分发，
+协议见 executors.py。
+
+节点须部署同一份代码，并安装好要执行的卡片（functions/<ID>/ 与 function.csv，可用 envstore.py 安装环境）；
+节点只执行卡片、不访问数据库，任务记录、结果缓存与下载仍由 Web 主机负责。
+
+    WORKER_NODE_TOKEN=<令牌> python worker_node.py --bind 0.0.0.0:8700 --slots 4
+
+Web 主机上设置 EXECUTOR=remote、WORKER_NODES=http://<节点>:8700,...、相同的 WORKER_NODE_TOKEN。
+"""
+import argparse
+import hmac
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import socket
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+from config import Config
+from executors import TarStream, local_executor, read_tar, split_member
+from limits import LimitExceeded, check_options
+from progress import PREFIX
+from registry import FunctionRegistry
+from result_cache import result_cache
+from runner import CardFailed
+
+logger = logging.getLogger(__name__)
+
+# 执行期间无进度输出时发送心跳的间隔（秒），须小于 Web 主机的 WORKER_NODE_TIMEOUT
+HEARTBEAT_INTERVAL = 15
+DEFAULT_PORT = 8700
+
+_run_id = re.compile(r'[0-9a-f]{32}')
+
+
+class _Body:
+    """只读到 Content-Length 为止的请求体"""
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.stream.read(size) if size else b''
+        self.remaining -= len(data)
+        return data
+
+
+class Node:
+
+    def __init__(self, name, slots, registry, run_dir, run_ttl):
+        self.name = name
+        self.slots = slots
+        self.registry = registry
+        self.run_dir = run_dir
+        self.run_ttl = run_ttl
+        self.running = 0
+        self.queued = 0
+        self._slots = threading.Semaphore(slots)
+        self._lock = threading.Lock()
+        os.makedirs(run_dir, exist_ok=True)
+
+    # ---------- 状态 ----------
+    def cards(self):
+        """已安装（run.py 存在）的卡片"""
+        return [card['ID'] for card in self.registry.all() if os.path.isfile(card['script_path'])]
+
+    def status(self):
+        return {
+            'name': self.name,
+            'slots': self.slots,
+            'running': self.running,
+            'queued': self.queued,
+            'load': os.getloadavg()[0] if hasattr(os, 'getloadavg') else 0.0,
+            'cpus': os.cpu_count() or 1,
+            'cards': self.cards(),
+        }
+
+    def _count(self, field, delta):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + delta)
+
+    # ---------- 运行目录 ----------
+    def run_path(self, run_id):
+        return os.path.join(self.run_dir, run_id)
+
+    def sweep(self):
+        """删除超过 run_ttl 秒、输出未被取回的运行目录"""
+        cutoff = time.time() - self.run_ttl
+        for entry in os.scandir(self.run_dir):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            except FileNotFoundError:
+                pass
+
+    def receive(self, body):
+        """把请求体中的输入文件写入新的运行目录，返回 (运行 ID, 输入路径列表)"""
+        run_id = uuid.uuid4().hex
+        root = self.run_path(run_id)
+        os.makedirs(os.path.join(root, 'outputs'))
+
+        def place(name):
+            index, filename = split_member(name)
+            directory = os.path.join(root, 'inputs', str(index))
+            os.makedirs(directory, exist_ok=True)
+            return os.path.join(directory, filename)
+
+        try:
+            return run_id, read_tar(body, place)
+        except Exception:
+            shutil.rmtree(root, ignore_errors=True)
+            raise
+
+    # ---------- 执行 ----------
+    def execute(self, card, run_id, input_paths, output_names, options, messages):
+        """等待空闲槽位后执行卡片，进度与最终结果依次放入 messages 队列"""
+        root = self.run_path(run_id)
+        output_dir = os.path.join(root, 'outputs')
+        output_paths = [os.path.join(output_dir, str(i), name) for i, name in enumerate(output_names)]
+        for path in output_paths:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        def on_progress(percent, message=''):
+            messages.put({'progress': f'{PREFIX}{percent} {message}'.rstrip()})
+
+        self._count('queued', 1)
+        with self._slots:
+            self._count('queued', -1)
+            self._count('running', 1)
+            try:
+                # 回报实际执行的卡片版本，Web 主机据此判断结果能否写入缓存
+                version = result_cache.code_version(card['ID'])
+                outputs = local_executor.run(card, input_paths, output_paths, output_dir, on_progress,
+                                             options).outputs
+                # 输出以 <序号>/<文件名> 发回；inprocess 卡片的输出按返回顺序编号
+                members = [(f'{i}/{os.path.basename(p)}', os.path.relpath(p, root)) for i, p in enumerate(outputs)]
+                with open(os.path.join(root, 'outputs.json'), 'w', encoding='utf-8') as f:
+                    json.dump(members, f)
+                final = {'run': run_id, 'outputs': [name for name, _ in members], 'version': version}
+            except LimitExceeded as e:
+                final = {'error': str(e), 'info': e.to_dict()}
+            except CardFailed as e:
+                final = {'error': str(e)}
+            except Exception as e:
+                logger.exception('卡片 %s 执行失败', card['ID'])
+                final = {'error': f'{type(e).__name__}: {e}'}
+            finally:
+                self._count('running', -1)
+        if 'error' in final:
+            shutil.rmtree(root, ignore_errors=True)
+        messages.put(final)
+
+    def outputs(self, run_id):
+        """运行的输出成员 [(成员名, 路径)]；运行不存在或未成功时返回 None"""
+        try:
+            with open(os.path.join(self.run_path(run_id), 'outputs.json'), encoding='utf-8') as f:
+                members = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return [(name, os.path.join(self.run_path(run_id), path)) for name, path in members]
+
+
+# ---------- HTTP ----------
+class NodeHandler(BaseHTTPRequestHandler):
+    server_version = 'WorkerNode/1.0'
+    node = None
+    token = None
+
+    def log_message(self, format, *args):
+        logger.info('%s %s', self.address_string(), format % args)
+
+    def _authorized(self):
+        supplied = self.headers.get('Authorization', '')
+        if hmac.compare_digest(supplied.encode(), f'Bearer {self.token}'.encode()):
+            return True
+        self._json(401, {'error': '令牌无效'})
+        return False
+
+    def _json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _line(self, data):
+        self.wfile.write(json.dumps(data, ensure_ascii=False).encode('utf-8') + b'\n')
+        self.wfile.flush()
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        if self.path == '/status':
+            return self._json(200, self.node.status())
+        parts = self.path.strip('/').split('/')
+        if len(parts) == 3 and parts[0] == 'runs' and parts[2] == 'outputs' and _run_id.fullmatch(parts[1]):
+            return self._send_outputs(parts[1])
+        self._json(404, {'error': '不存在'})
+
+    def _send_outputs(self, run_id):
+        members = self.node.outputs(run_id)
+        if members is None:
+            return self._json(404, {'error': '运行不存在或已过期'})
+        stream = TarStream(members)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-tar')
+        self.send_header('Content-Length', str(stream.length))
+        self.end_headers()
+        for chunk in stream:
+            self.wfile.write(chunk)
+        shutil.rmtree(self.node.run_path(run_id), ignore_errors=True)
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        if not self.path.startswith('/run/'):
+            return self._json(404, {'error': '不存在'})
+        card = self.node.registry.get(unquote(self.path[len('/run/'):]))
+        if card is None or not os.path.isfile(card['script_path']):
+            return self._json(404, {'error': '节点未安装该卡片'})
+        try:
+            length = int(self.headers['Content-Length'])
+            output_names = [os.path.basename(str(name)) for name in json.loads(self.headers.get('Card-Outputs', '[]'))]
+            options = check_options(card['ID'], json.loads(self.headers.get('Card-Options', '{}')))
+            run_id, input_paths = self.node.receive(_Body(self.rfile, length))
+        except (TypeError, ValueError, OSError) as e:
+            return self._json(400, {'error': f'请求无效: {e}'})
+
+        self.node.sweep()
+        messages = queue.Queue()
+        threading.Thread(target=self.node.execute, args=(card, run_id, input_paths, output_names, options, messages),
+                         name=f'run-{run_id[:8]}', daemon=True).start()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        try:
+            while True:
+                try:
+                    message = messages.get(timeout=HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    self._line({'heartbeat': True})
+                    continue
+                self._line(message)
+                if 'progress' not in message:
+                    break
+        except OSError:
+            # Web 主机断开：卡片照常执行完，运行目录留待过期清理
+            logger.warning('运行 %s 的连接已断开', run_id)
+
+
+def parse_bind(value):
+    host, _, port = value.rpartition(':')
+    return host or '0.0.0.0', int(port or DEFAULT_PORT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='执行节点：接受 Web 主机分发的函数任务')
+    parser.add_argument('--bind', default=f'0.0.0.0:{DEFAULT_PORT}', help='监听地址 host:port')
+    parser.add_argument('--slots', type=int, default=os.cpu_count() or 1, help='同时执行的任务数')
+    parser.add_argument('--name', default=socket.gethostname(), help='节点名（显示在 /status 中）')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    if not Config.WORKER_NODE_TOKEN:
+        print('未设置 WORKER_NODE_TOKEN，拒绝启动', file=sys.stderr)
+        return 1
+    NodeHandler.node = Node(args.name, max(1, args.slots), FunctionRegistry(Config.FUNCTION_CSV),
+                            Config.WORKER_NODE_DIR, Config.WORKER_NODE_RUN_TTL)
+    NodeHandler.token = Config.WORKER_NODE_TOKEN
+    server = ThreadingHTTPServer(parse_bind(args.bind), NodeHandler)
+    server.daemon_threads = True
+    logger.info('执行节点 %s 监听 %s，%d 个槽位，已安装 %d 张卡片',
+                args.name, args.bind, NodeHandler.node.slots, len(NodeHandler.node.cards()))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
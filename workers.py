@@ -0,0 +1,220 @@
+"""
+常驻 worker 池：每张开启了 workers 的卡片保持 N 个已导入 run.py 的子进程，
+任务通过管道下发（协议见 card_worker.py）。
+"""
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+
+from limits import LimitExceeded, Watchdog, apply_limits
+from progress import PROGRESS_ENV, parse_progress
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'card_worker.py')
+
+
+class WorkerUnavailable(Exception):
+    """卡片不支持常驻模式（run.py 无法被导入或没有 main()），应回退到冷启动"""
+
+
+class _Worker:
+    def __init__(self, python_exec, script_path, limits, start_timeout=0):
+        self.proc = subprocess.Popen(
+            [python_exec, '-u', WORKER_SCRIPT, script_path],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            text=True, encoding='utf-8', bufsize=1, start_new_session=True,
+            env=dict(os.environ, **{PROGRESS_ENV: '1'}),
+        )
+        self.limits = limits
+        apply_limits(self.proc.pid, limits, cpu=False)
+        self.jobs = 0
+        self.last_used = time.monotonic()
+        # 导入 run.py 卡住（或始终不输出握手行）时由看门狗终止进程组，readline 随之返回
+        with Watchdog(self.proc, start_timeout) as watchdog:
+            try:
+                hello = self._read()
+            except ValueError:
+                hello = None
+        if hello is None or not hello.get('ready'):
+            self.close()
+            if watchdog.fired:
+                raise WorkerUnavailable(f'worker 超过 {start_timeout} 秒未完成启动')
+            error = hello.get('error') if hello else 'worker 启动失败'
+            raise WorkerUnavailable(error)
+
+    def _read(self):
+        line = self.proc.stdout.readline()
+        return json.loads(line) if line else None
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def call(self, argv, on_progress=None):
+        job = {'argv': argv, 'max_cpu': self.limits['max_cpu'], 'max_output': self.limits['max_output']}
+        with Watchdog(self.proc, self.limits['timeout']) as watchdog:
+            self.proc.stdin.write(json.dumps(job, ensure_ascii=False) + '\n')
+            self.proc.stdin.flush()
+            reply = self._read()
+            # 任务结束前 worker 转发的进度行
+            while reply is not None and 'progress' in reply:
+                parsed = parse_progress(reply['progress'])
+                if on_progress is not None and parsed is not None:
+                    on_progress(*parsed)
+                reply = self._read()
+        self.jobs += 1
+        self.last_used = time.monotonic()
+        if reply is None:
+            # worker 在任务中途退出（超时被终止 / 超出 CPU 限制 / os._exit / 段错误）
+            returncode = self.proc.wait()
+            result = subprocess.CompletedProcess(argv, returncode or 1, '',
+                                                 f'worker exited unexpectedly ({returncode})')
+            if watchdog.fired:
+                raise LimitExceeded('timeout', self.limits['timeout'], result)
+            return result.returncode, result.stdout, result.stderr, None
+        usage = {'cpu': reply.get('cpu', 0.0), 'maxrss': reply.get('maxrss', 0)}
+        return reply['returncode'], reply['stdout'], reply['stderr'], usage
+
+    def close(self):
+        if self.proc.poll() is None:
+            try:
+                self.proc.stdin.close()
+                self.proc.wait(timeout=2)
+            except (OSError, subprocess.TimeoutExpired):
+                self.proc.kill()
+                self.proc.wait()
+
+
+class WorkerPool:
+    """单张卡片的 worker 池：最多 size 个并发，单个 worker 执行 max_jobs 次后回收"""
+
+    def __init__(self, card_id, python_exec, script_path, size, max_jobs, idle_timeout, limits, start_timeout=0):
+        self.card_id = card_id
+        self.python_exec = python_exec
+        self.script_path = script_path
+        self.size = size
+        self.max_jobs = max_jobs
+        self.idle_timeout = idle_timeout
+        self.limits = limits
+        self.start_timeout = start_timeout
+        self.supported = True
+        self._idle = []
+        self._busy = 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _spawn(self):
+        try:
+            return _Worker(self.python_exec, self.script_path, self.limits, self.start_timeout)
+        except WorkerUnavailable as e:
+            logger.warning('卡片 %s 不支持常驻 worker，回退冷启动: %s', self.card_id, e)
+            self.supported = False
+            raise
+
+    def prefork(self):
+        """后台补齐空闲 worker，使下一个请求拿到已预热的进程"""
+        def fill():
+            while self.supported:
+                with self._lock:
+                    if len(self._idle) + self._busy >= self.size:
+                        return
+                try:
+                    worker = self._spawn()
+                except (WorkerUnavailable, OSError):
+                    return
+                with self._lock:
+                    self._idle.append(worker)
+        threading.Thread(target=fill, daemon=True).start()
+
+    def _checkout(self):
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.alive():
+                    return worker
+        return self._spawn()
+
+    def _checkin(self, worker):
+        if worker.jobs >= self.max_jobs or not worker.alive():
+            worker.close()
+            self.prefork()
+            return
+        with self._lock:
+            self._idle.append(worker)
+
+    def run(self, argv, on_progress=None):
+        """执行一次任务，返回 (returncode, stdout, stderr, usage)"""
+        if not self.supported:
+            raise WorkerUnavailable(self.card_id)
+        with self._slots:
+            worker = self._checkout()
+            with self._lock:
+                self._busy += 1
+            try:
+                result = worker.call(argv, on_progress)
+            except BaseException:
+                worker.close()
+                raise
+            finally:
+                with self._lock:
+                    self._busy -= 1
+            self._checkin(worker)
+        return result
+
+    def reap_idle(self):
+        """关闭空闲超过 idle_timeout 的 worker"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [w for w in self._idle if now - w.last_used > self.idle_timeout]
+            self._idle = [w for w in self._idle if w not in expired]
+        for worker in expired:
+            worker.close()
+
+    def shutdown(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.close()
+
+
+# ---------- 全局池管理 ----------
+_pools = {}
+_pools_lock = threading.Lock()
+_reaper_started = False
+
+
+def _reaper(interval):
+    while True:
+        time.sleep(interval)
+        for pool in list(_pools.values()):
+            pool.reap_idle()
+
+
+def get_pool(card_id, python_exec, script_path, size, max_jobs, idle_timeout, limits, start_timeout=0):
+    """取得（必要时创建并预热）卡片的 worker 池；worker 数或资源限制变化时重建"""
+    global _reaper_started
+    key = (card_id, python_exec, script_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool.size != size or pool.limits != limits:
+            if pool is not None:
+                pool.shutdown()
+            pool = WorkerPool(card_id, python_exec, script_path, size, max_jobs, idle_timeout, limits,
+                              start_timeout)
+            _pools[key] = pool
+            pool.prefork()
+        if not _reaper_started:
+            threading.Thread(target=_reaper, args=(max(idle_timeout / 4, 1),), daemon=True).start()
+            _reaper_started = True
+    return pool
+
+
+def shutdown_all():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown()
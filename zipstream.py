@@ -0,0 +1,208 @@
+"""
+流式 zip：边读取输出文件边向客户端发送压缩包，不再先在磁盘上生成 outputs.zip。
+
+- 按扩展名选择压缩方式：已压缩的格式（图片、音视频、压缩包等）用 STORED，文本类用 DEFLATED；
+  其他扩展名试压缩文件开头的一块，几乎压不动（如加密输出）时也用 STORED。
+- 单个文件或偏移超过 4 GiB、条目超过 65535 个时写 zip64 结构。
+- 所有条目都是 STORED 时压缩包大小可以预先算出（content_length），响应带 Content-Length。
+
+CRC 与压缩后大小写在每个条目数据之后的数据描述符中（通用标志位 3），无需回写文件头。
+"""
+import os
+import struct
+import time
+import zlib
+
+STORED, DEFLATED = 0, 8
+
+# 已压缩的格式：再压缩只浪费 CPU
+STORED_EXTENSIONS = frozenset({
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.7z', '.rar', '.lz4',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic',
+    '.mp3', '.mp4', '.m4a', '.mkv', '.mov', '.avi', '.webm', '.ogg', '.flac',
+    '.pdf', '.docx', '.xlsx', '.pptx', '.jar', '.whl', '.parquet',
+})
+# 文本类格式：直接压缩
+DEFLATED_EXTENSIONS = frozenset({
+    '.txt', '.csv', '.tsv', '.json', '.jsonl', '.xml', '.html', '.htm', '.md',
+    '.log', '.yaml', '.yml', '.py', '.sql', '.svg',
+})
+# 未知扩展名试压缩的字节数，以及判定为"压不动"的压缩率
+SNIFF_BYTES = 64 * 1024
+SNIFF_RATIO = 0.9
+
+CHUNK_SIZE = 1024 * 1024
+COMPRESS_LEVEL = 6
+
+ZIP64_LIMIT = 0xFFFFFFFF
+VERSION_DEFAULT = 20
+VERSION_ZIP64 = 45
+MADE_BY = (3 << 8) | VERSION_ZIP64         # Unix，使外部属性中的文件权限生效
+FLAGS = 0x08 | 0x800                        # 数据描述符 + UTF-8 文件名
+EXTERNAL_ATTR = 0o100644 << 16
+
+
+def choose_method(path, size):
+    if size == 0:
+        return STORED
+    ext = os.path.splitext(path)[1].lower()
+    if ext in STORED_EXTENSIONS:
+        return STORED
+    if ext in DEFLATED_EXTENSIONS:
+        return DEFLATED
+    with open(path, 'rb') as f:
+        sample = f.read(SNIFF_BYTES)
+    if len(zlib.compress(sample, 1)) >= len(sample) * SNIFF_RATIO:
+        return STORED
+    return DEFLATED
+
+
+def _dos_datetime(timestamp):
+    t = time.localtime(timestamp)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1             # 1980-01-01 00:00:00
+    date = (t.tm_year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday
+    clock = t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2
+    return clock, date
+
+
+class _Entry:
+
+    def __init__(self, path, arcname):
+        st = os.stat(path)
+        self.path = path
+        self.name = arcname.replace(os.sep, '/').encode('utf-8')
+        self.size = st.st_size
+        self.clock, self.date = _dos_datetime(st.st_mtime)
+        self.method = choose_method(path, self.size)
+        # deflate 对不可压缩数据会略微膨胀，接近上限时提前使用 zip64
+        self.zip64 = self.size + self.size // 64 + 1024 >= ZIP64_LIMIT
+        self.crc = 0
+        self.compressed_size = self.size if self.method == STORED else 0
+        self.offset = 0
+
+    @property
+    def version(self):
+        return VERSION_ZIP64 if self.zip64 else VERSION_DEFAULT
+
+    def local_header(self):
+        extra = b''
+        sizes = 0
+        if self.zip64:
+            extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0)
+            sizes = ZIP64_LIMIT
+        return struct.pack('<IHHHHHIIIHH', 0x04034b50, self.version, FLAGS, self.method,
+                           self.clock, self.date, 0, sizes, sizes,
+                           len(self.name), len(extra)) + self.name + extra
+
+    def descriptor(self):
+        if self.zip64:
+            return struct.pack('<IIQQ', 0x08074b50, self.crc, self.compressed_size, self.size)
+        return struct.pack('<IIII', 0x08074b50, self.crc, self.compressed_size, self.size)
+
+    def central_header(self):
+        fields = []
+        size, compressed_size, offset = self.size, self.compressed_size, self.offset
+        if self.zip64 or size >= ZIP64_LIMIT or compressed_size >= ZIP64_LIMIT:
+            fields += [size, compressed_size]
+            size = compressed_size = ZIP64_LIMIT
+        if offset >= ZIP64_LIMIT:
+            fields.append(offset)
+            offset = ZIP64_LIMIT
+        extra = struct.pack(f'<HH{len(fields)}Q', 0x0001, 8 * len(fields), *fields) if fields else b''
+        version = VERSION_ZIP64 if fields else self.version
+        return struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, MADE_BY, version, FLAGS, self.method,
+                           self.clock, self.date, self.crc, compressed_size, size,
+                           len(self.name), len(extra), 0, 0, 0, EXTERNAL_ATTR,
+                           offset) + self.name + extra
+
+
+def _end_records(count, cd_offset, cd_size):
+    records = b''
+    if count >= 0xFFFF or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+        records += struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, MADE_BY, VERSION_ZIP64,
+                               0, 0, count, count, cd_size, cd_offset)
+        records += struct.pack('<IIQI', 0x07064b50, 0, cd_offset + cd_size, 1)
+    records += struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                           min(cd_size, ZIP64_LIMIT), min(cd_offset, ZIP64_LIMIT), 0)
+    return records
+
+
+class ZipStream:
+    """
+    可迭代的 zip 压缩包，逐块产出字节。
+    :param files: [(本地路径, 包内路径), ...]
+    迭代结束后 completed 为 True，busy 为读取与压缩花费的时间（不含等待客户端接收）。
+    """
+
+    def __init__(self, files, chunk_size=CHUNK_SIZE, compresslevel=COMPRESS_LEVEL):
+        self.entries = [_Entry(path, arcname) for path, arcname in files]
+        self.chunk_size = chunk_size
+        self.compresslevel = compresslevel
+        self.completed = False
+        self.busy = 0.0
+
+    def content_length(self):
+        """全部条目为 STORED 时返回压缩包的总字节数，否则返回 None"""
+        if any(e.method != STORED for e in self.entries):
+            return None
+        offset = 0
+        for e in self.entries:
+            e.offset = offset
+            offset += len(e.local_header()) + e.size + len(e.descriptor())
+        cd_size = sum(len(e.central_header()) for e in self.entries)
+        return offset + cd_size + len(_end_records(len(self.entries), offset, cd_size))
+
+    def _entry_data(self, entry):
+        crc, size, compressed_size = 0, 0, 0
+        compressor = None
+        if entry.method == DEFLATED:
+            compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15)
+        with open(entry.path, 'rb') as f:
+            while chunk := f.read(self.chunk_size):
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    compressed_size += len(chunk)
+                    yield chunk
+        if compressor is not None:
+            tail = compressor.flush()
+            compressed_size += len(tail)
+            yield tail
+        entry.crc, entry.size, entry.compressed_size = crc, size, compressed_size
+
+    def _generate(self):
+        offset = 0
+        for entry in self.entries:
+            entry.offset = offset
+            header = entry.local_header()
+            offset += len(header)
+            yield header
+            for chunk in self._entry_data(entry):
+                offset += len(chunk)
+                yield chunk
+            descriptor = entry.descriptor()
+            offset += len(descriptor)
+            yield descriptor
+
+        cd_size = 0
+        for entry in self.entries:
+            header = entry.central_header()
+            cd_size += len(header)
+            yield header
+        yield _end_records(len(self.entries), offset, cd_size)
+
+    def __iter__(self):
+        chunks = self._generate()
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                break
+            finally:
+                self.busy += time.perf_counter() - start
+            yield chunk
+        self.completed = True